@@ -0,0 +1,72 @@
+-- Reserva atômica de documentos PENDENTE para os workers (vários processos/máquinas).
+-- claim_documents seleciona e marca PROCESSANDO na mesma instrução, com
+-- FOR UPDATE SKIP LOCKED: dois workers nunca recebem o mesmo documento.
+-- Cada reserva tem uma lease; se o worker morrer, o documento volta a ser
+-- reservável quando lease_expires_at passar.
+-- Execute no SQL Editor do Supabase.
+
+ALTER TABLE public.documento_gerenciamento
+ADD COLUMN IF NOT EXISTS worker_id TEXT,
+ADD COLUMN IF NOT EXISTS lease_expires_at TIMESTAMP WITH TIME ZONE;
+
+COMMENT ON COLUMN public.documento_gerenciamento.worker_id IS 'Worker (host:pid) que reservou o documento via claim_documents.';
+COMMENT ON COLUMN public.documento_gerenciamento.lease_expires_at IS 'Fim da reserva: após este horário um PROCESSANDO pode ser reservado por outro worker.';
+
+CREATE INDEX IF NOT EXISTS idx_doc_ger_status_projeto ON public.documento_gerenciamento(status, projeto_id);
+
+CREATE OR REPLACE FUNCTION public.claim_documents(
+    p_projeto_id UUID,
+    p_limit INTEGER,
+    p_worker_id TEXT,
+    p_lease_seconds INTEGER DEFAULT 900
+)
+RETURNS SETOF public.documento_gerenciamento
+LANGUAGE sql
+AS $$
+    WITH candidatos AS (
+        SELECT id
+        FROM public.documento_gerenciamento
+        WHERE storage_path IS NOT NULL
+          AND (p_projeto_id IS NULL OR projeto_id = p_projeto_id)
+          AND (
+              status = 'PENDENTE'
+              OR (status = 'PROCESSANDO' AND lease_expires_at < NOW())
+          )
+        ORDER BY id
+        LIMIT p_limit
+        FOR UPDATE SKIP LOCKED
+    )
+    UPDATE public.documento_gerenciamento d
+    SET status = 'PROCESSANDO',
+        started_at = NOW(),
+        worker_id = p_worker_id,
+        lease_expires_at = NOW() + make_interval(secs => p_lease_seconds)
+    FROM candidatos c
+    WHERE d.id = c.id
+    RETURNING d.*;
+$$;
+
+-- Renova as leases dos documentos ainda em andamento neste worker (nunca encurta uma lease maior).
+CREATE OR REPLACE FUNCTION public.renew_document_leases(
+    p_worker_id TEXT,
+    p_ids TEXT[],
+    p_lease_seconds INTEGER DEFAULT 900
+)
+RETURNS INTEGER
+LANGUAGE sql
+AS $$
+    WITH renovados AS (
+        UPDATE public.documento_gerenciamento
+        SET lease_expires_at = GREATEST(lease_expires_at, NOW() + make_interval(secs => p_lease_seconds))
+        WHERE worker_id = p_worker_id
+          AND status = 'PROCESSANDO'
+          AND id::text = ANY(p_ids)
+        RETURNING 1
+    )
+    SELECT COUNT(*)::INTEGER FROM renovados;
+$$;
+
+GRANT EXECUTE ON FUNCTION public.claim_documents(UUID, INTEGER, TEXT, INTEGER) TO anon, authenticated, service_role;
+GRANT EXECUTE ON FUNCTION public.renew_document_leases(TEXT, TEXT[], INTEGER) TO anon, authenticated, service_role;
+
+SELECT 'Funções claim_documents e renew_document_leases criadas.' AS status;
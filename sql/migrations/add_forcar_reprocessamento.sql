@@ -0,0 +1,10 @@
+-- Reprocessamento forçado: o frontend pode inserir em processar_agora com
+-- forcar_reprocessamento = TRUE para o worker ignorar o cache de respostas da IA.
+-- Execute no SQL Editor do Supabase.
+
+ALTER TABLE public.processar_agora
+ADD COLUMN IF NOT EXISTS forcar_reprocessamento BOOLEAN NOT NULL DEFAULT FALSE;
+
+COMMENT ON COLUMN public.processar_agora.forcar_reprocessamento IS 'TRUE = worker chama a IA mesmo com resposta em cache (prompt/modelo iguais).';
+
+SELECT 'Coluna forcar_reprocessamento adicionada.' AS status;
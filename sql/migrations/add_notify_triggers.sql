@@ -0,0 +1,30 @@
+-- Notifica os workers (LISTEN/NOTIFY) quando chega trabalho novo, em vez de
+-- depender só do polling de 2-5s. O worker escuta com DATABASE_URL (ver src/job_notifier.py).
+-- Execute no SQL Editor do Supabase.
+
+CREATE OR REPLACE FUNCTION public.notify_novo_trabalho()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    -- Canal = nome da tabela; payload = id da linha (apenas informativo)
+    PERFORM pg_notify(TG_TABLE_NAME, NEW.id::text);
+    RETURN NEW;
+END;
+$$;
+
+-- Disparo "Iniciar processamento" (frontend insere em processar_agora)
+DROP TRIGGER IF EXISTS trg_notify_processar_agora ON public.processar_agora;
+CREATE TRIGGER trg_notify_processar_agora
+AFTER INSERT ON public.processar_agora
+FOR EACH ROW EXECUTE FUNCTION public.notify_novo_trabalho();
+
+-- Casos Salesforce novos ou recolocados na fila (retry volta para PENDENTE)
+DROP TRIGGER IF EXISTS trg_notify_casos_processamento ON public.casos_processamento;
+CREATE TRIGGER trg_notify_casos_processamento
+AFTER INSERT OR UPDATE OF status ON public.casos_processamento
+FOR EACH ROW
+WHEN (NEW.status = 'PENDENTE')
+EXECUTE FUNCTION public.notify_novo_trabalho();
+
+SELECT 'Triggers de notificação criados (canais processar_agora e casos_processamento).' AS status;
@@ -0,0 +1,13 @@
+-- Modo de processamento por disparo: 'ONLINE' (padrão, chamadas diretas) ou
+-- 'BATCH' (OpenAI Batch API: mais barato, resultado em até 24h, para reprocessamento em massa).
+-- Execute no SQL Editor do Supabase.
+
+ALTER TABLE public.processar_agora
+ADD COLUMN IF NOT EXISTS modo TEXT NOT NULL DEFAULT 'ONLINE';
+
+ALTER TABLE public.processar_agora DROP CONSTRAINT IF EXISTS processar_agora_modo_check;
+ALTER TABLE public.processar_agora ADD CONSTRAINT processar_agora_modo_check CHECK (modo IN ('ONLINE', 'BATCH'));
+
+COMMENT ON COLUMN public.processar_agora.modo IS 'ONLINE = worker chama a IA por documento; BATCH = envia o projeto inteiro pela OpenAI Batch API.';
+
+SELECT 'Coluna modo adicionada em processar_agora.' AS status;
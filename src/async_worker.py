@@ -0,0 +1,378 @@
+"""
+Worker em modo asyncio (WORKER_MODE=async).
+
+Em vez de uma thread por arquivo, todos os documentos em andamento são
+multiplexados num único event loop:
+- Supabase REST/Storage via httpx.AsyncClient (pool de conexões único)
+- OpenAI via AsyncOpenAI
+- Extração PDF/Excel continua no ProcessPoolExecutor (CPU)
+- Um único limitador (ASYNC_MAX_IN_FLIGHT) controla quantos documentos estão em andamento
+"""
+
+import asyncio
+import multiprocessing
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import quote
+import httpx
+from config import settings
+from openai_client import OpenAIClient
+from job_notifier import get_job_notifier, CHANNEL_PROCESSAR_AGORA
+from extraction import extract_file_cached_async, init_extraction_process, extraction_initargs, EXCEL_EXTENSIONS
+from document_stream import DownloadedDocument
+from result_exporter import get_result_exporter
+from worker import (
+    build_result, select_llm_text, load_prompt_from_file, prompt_file_version, prompt_cache, start_batch_mode,
+    track_claimed, release_claimed, claimed_ids, claim_rpc_available, disable_claim_rpc, is_missing_rpc_error,
+    WORKER_ID, BatchStats, export_output,
+)
+
+
+class AsyncSupabaseRest:
+    """Cliente mínimo para PostgREST e Storage do Supabase usando httpx assíncrono"""
+
+    def __init__(self, url: str, key: str, max_connections: int):
+        self.url = url.rstrip("/")
+        headers = {
+            "apikey": key,
+            "Authorization": f"Bearer {key}",
+        }
+        self.http = httpx.AsyncClient(
+            headers=headers,
+            timeout=httpx.Timeout(60.0, connect=10.0),
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        )
+
+    async def select(self, table: str, params: dict) -> list:
+        resp = await self.http.get(f"{self.url}/rest/v1/{table}", params=params)
+        resp.raise_for_status()
+        return resp.json()
+
+    async def insert(self, table: str, rows) -> list:
+        resp = await self.http.post(
+            f"{self.url}/rest/v1/{table}", json=rows,
+            headers={"Prefer": "return=representation"}
+        )
+        resp.raise_for_status()
+        return resp.json()
+
+    async def update(self, table: str, values: dict, params: dict) -> list:
+        resp = await self.http.patch(
+            f"{self.url}/rest/v1/{table}", json=values, params=params,
+            headers={"Prefer": "return=representation"}
+        )
+        resp.raise_for_status()
+        return resp.json()
+
+    async def delete(self, table: str, params: dict):
+        resp = await self.http.delete(f"{self.url}/rest/v1/{table}", params=params)
+        resp.raise_for_status()
+
+    async def rpc(self, function: str, params: dict):
+        resp = await self.http.post(f"{self.url}/rest/v1/rpc/{function}", json=params)
+        resp.raise_for_status()
+        return resp.json()
+
+    async def download_document(self, bucket: str, path: str, suffix: str = "") -> DownloadedDocument:
+        """Download em streaming: memória até STORAGE_SPOOL_MAX_MB, arquivo temporário acima disso"""
+        document = DownloadedDocument(suffix)
+        try:
+            async with self.http.stream("GET", f"{self.url}/storage/v1/object/{bucket}/{quote(path)}") as resp:
+                resp.raise_for_status()
+                async for chunk in resp.aiter_bytes(1024 * 1024):
+                    document.write(chunk)
+            return document.finish()
+        except BaseException:
+            document.close()
+            raise
+
+    async def remove(self, bucket: str, paths: list):
+        resp = await self.http.request(
+            "DELETE", f"{self.url}/storage/v1/object/{bucket}", json={"prefixes": paths}
+        )
+        resp.raise_for_status()
+
+    async def aclose(self):
+        await self.http.aclose()
+
+
+def _prompt_params(projeto_id, columns: str) -> dict:
+    if projeto_id:
+        return {"select": columns, "projeto_id": f"eq.{projeto_id}", "limit": 1}
+    return {"select": columns, "id": "eq.1", "limit": 1}
+
+
+async def load_prompt_async(rest: AsyncSupabaseRest, projeto_id=None) -> tuple:
+    """Equivalente assíncrono de worker.load_prompt_row: (prompt_text, versão)"""
+    try:
+        rows = await rest.select("prompt_config", _prompt_params(projeto_id, "prompt_text,updated_at"))
+        if rows and rows[0].get("prompt_text"):
+            return rows[0]["prompt_text"], rows[0].get("updated_at")
+    except Exception as e:
+        print(f"[AVISO] Erro ao carregar prompt do Supabase: {e}")
+    return load_prompt_from_file(), prompt_file_version()
+
+
+async def load_prompt_version_async(rest: AsyncSupabaseRest, projeto_id=None):
+    """Equivalente assíncrono de worker.load_prompt_version"""
+    rows = await rest.select("prompt_config", _prompt_params(projeto_id, "updated_at"))
+    if rows:
+        return rows[0].get("updated_at")
+    return prompt_file_version()
+
+
+async def claim_documents_async(rest: AsyncSupabaseRest, projeto_id, limit: int) -> list:
+    """Equivalente assíncrono de worker.claim_documents (RPC atômica com fallback select + update)"""
+    if claim_rpc_available():
+        try:
+            files = await rest.rpc("claim_documents", {
+                "p_projeto_id": projeto_id,
+                "p_limit": limit,
+                "p_worker_id": WORKER_ID,
+                "p_lease_seconds": settings.CLAIM_LEASE_SECONDS,
+            })
+            track_claimed(files)
+            return files
+        except httpx.HTTPStatusError as e:
+            # Só PGRST202 (função inexistente) desativa a RPC; outros 404 (URL, proxy) são erro
+            if e.response.status_code != 404 or not is_missing_rpc_error(e.response.text):
+                raise
+            disable_claim_rpc()
+
+    params = {"select": "*", "status": "eq.PENDENTE", "storage_path": "not.is.null", "limit": limit}
+    if projeto_id:
+        params["projeto_id"] = f"eq.{projeto_id}"
+    files = await rest.select(settings.TABLE_GERENCIAMENTO, params)
+    if not files:
+        return []
+    ids = ",".join(str(f['id']) for f in files)
+    # Só fica com as linhas que ainda estavam PENDENTE no momento do update
+    updated = await rest.update(
+        settings.TABLE_GERENCIAMENTO,
+        {"status": "PROCESSANDO", "started_at": "now()"},
+        {"id": f"in.({ids})", "status": "eq.PENDENTE"}
+    )
+    claimed = {r['id'] for r in updated}
+    files = [f for f in files if f['id'] in claimed]
+    track_claimed(files)
+    return files
+
+
+async def renew_leases_async(rest: AsyncSupabaseRest):
+    """Equivalente assíncrono de worker.renew_leases"""
+    ids = claimed_ids()
+    if not ids or not claim_rpc_available():
+        return
+    try:
+        await rest.rpc("renew_document_leases", {
+            "p_worker_id": WORKER_ID,
+            "p_ids": ids,
+            "p_lease_seconds": settings.CLAIM_LEASE_SECONDS,
+        })
+    except Exception as e:
+        print(f"[AVISO] Erro ao renovar leases: {e}")
+
+
+class AsyncWorker:
+    def __init__(self):
+        self.rest = AsyncSupabaseRest(settings.SUPABASE_URL, settings.SUPABASE_KEY, settings.ASYNC_HTTP_CONNECTIONS)
+        self.ai_client = OpenAIClient()
+        self.extraction_processes = settings.EXTRACTION_PROCESSES or os.cpu_count() or 1
+        self.process_pool = ProcessPoolExecutor(
+            max_workers=self.extraction_processes,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_extraction_process,
+            initargs=extraction_initargs(),
+        )
+        # Limitador único de documentos em andamento (substitui threads + semáforo)
+        self.max_in_flight = settings.ASYNC_MAX_IN_FLIGHT
+        self.limiter = asyncio.Semaphore(self.max_in_flight)
+        self.tasks = set()
+
+    async def mark_error(self, record, error: Exception):
+        print(f"[ERRO] Erro {record['filename']}: {str(error)}")
+        traceback.print_exc()
+        try:
+            await self.rest.update(
+                settings.TABLE_GERENCIAMENTO,
+                {"status": "ERRO", "error_message": str(error)[:500]},
+                {"id": f"eq.{record['id']}"}
+            )
+        except Exception as update_error:
+            print(f"[AVISO] Erro ao atualizar status: {update_error}")
+        finally:
+            release_claimed(record['id'])
+
+    async def process_document(self, record, batch=None, force_reprocess=False):
+        filename = record['filename']
+        storage_path = record.get('storage_path')
+        projeto_id = record.get('projeto_id')
+        async with self.limiter:
+            try:
+                if not storage_path:
+                    raise ValueError("Caminho do arquivo no storage não encontrado")
+                file_extension = os.path.splitext(storage_path)[1].lower()
+                print(f"Processando: {filename} ({file_extension})")
+
+                # 1. Download + extração (CPU no pool de processos)
+                with await self.rest.download_document("processos", storage_path, suffix=file_extension) as document:
+                    extracted, cache_hit = await extract_file_cached_async(document, file_extension, self.process_pool)
+                if batch is not None:
+                    batch.record_extraction(cache_hit)
+                raw_text = extracted["text"]
+
+                # 2. Prompt + IA
+                project_prompt = await prompt_cache.get_async(
+                    projeto_id,
+                    lambda: load_prompt_version_async(self.rest, projeto_id),
+                    lambda: load_prompt_async(self.rest, projeto_id),
+                )
+                if project_prompt is None:
+                    raise ValueError("Prompt não configurado. Configure no frontend ou crie prompt_custom.txt")
+
+                print(f"   Enviando para IA ({'Excel' if file_extension in EXCEL_EXTENSIONS else 'PDF'}): {filename}")
+                # Seleção por relevância (tokenização + BM25) fora do loop de eventos
+                llm_text = await asyncio.to_thread(
+                    select_llm_text, raw_text, project_prompt.schema_keys, file_extension in EXCEL_EXTENSIONS
+                )
+                json_text = await self.ai_client._call_openai_async(
+                    llm_text, project_prompt.prompt_final, projeto_id=projeto_id, use_cache=not force_reprocess
+                )
+                data_analise = build_result(
+                    record, raw_text, project_prompt.prompt_text, json_text,
+                    expected_keys=project_prompt.schema_keys
+                )
+
+                # 3. Salvar resultado e limpar Storage/fila
+                await self.finalize(record, data_analise)
+                print(f"[OK] Sucesso: {filename}")
+            except Exception as e:
+                await self.mark_error(record, e)
+            finally:
+                if batch is not None:
+                    batch.file_done()
+
+    async def finalize(self, record, data_analise: dict):
+        projeto_id = record.get('projeto_id')
+        exporter = get_result_exporter()
+        if exporter is not None:
+            # Normalmente só enfileira; a gravação em lote (ou reescrita do CSV) roda fora do loop
+            await asyncio.to_thread(exporter.add, data_analise)
+        try:
+            insert_payload = {'arquivo_original': record['filename'], 'dados_json': data_analise}
+            if projeto_id:
+                insert_payload['projeto_id'] = projeto_id
+            await self.rest.insert('resultados_analise', insert_payload)
+        except Exception as db_error:
+            print(f"[AVISO] Erro ao salvar no Supabase: {db_error}")
+
+        try:
+            await self.rest.remove("processos", [record['storage_path']])
+        except Exception as delete_error:
+            print(f"[AVISO] Erro ao remover do bucket (confira RLS DELETE em storage.objects): {delete_error}")
+
+        try:
+            await self.rest.delete(settings.TABLE_GERENCIAMENTO, {"id": f"eq.{record['id']}"})
+        except Exception as db_del_error:
+            try:
+                await self.rest.update(
+                    settings.TABLE_GERENCIAMENTO,
+                    {"status": "CONCLUIDO", "completed_at": "now()"},
+                    {"id": f"eq.{record['id']}"}
+                )
+                print(f"   [AVISO] Delete da fila falhou; status atualizado para CONCLUIDO: {db_del_error}")
+            except Exception as update_error:
+                print(f"[AVISO] Erro ao atualizar/remover da fila: {update_error}")
+        release_claimed(record['id'])
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def poll_once(self) -> bool:
+        """Consome os disparos de processar_agora. Retorna True se algo foi enfileirado."""
+        free_slots = self.max_in_flight - len(self.tasks)
+        if free_slots <= 0:
+            return False
+
+        triggers = await self.rest.select(settings.TABLE_PROCESSAR_AGORA, {"select": "*", "limit": settings.MAX_WORKERS})
+        if not triggers:
+            return False
+
+        dispatched = False
+        for trigger in triggers:
+            if free_slots <= 0:
+                break  # Disparos restantes ficam para o próximo poll
+            projeto_id = trigger.get("projeto_id")
+            force_reprocess = bool(trigger.get("forcar_reprocessamento"))
+            try:
+                if str(trigger.get("modo") or "").upper() == "BATCH":
+                    # Batch API usa o cliente Supabase síncrono numa thread própria
+                    await asyncio.to_thread(start_batch_mode, projeto_id, force_reprocess, self.process_pool)
+                    continue
+                # Reserva atômica: outros workers não recebem os mesmos documentos
+                files = await claim_documents_async(self.rest, projeto_id, free_slots)
+                if files:
+                    print(f"Processando {len(files)} arquivo(s) (projeto: {projeto_id or 'todos'}) | em andamento: {len(self.tasks)}")
+                    print(f"   Headroom OpenAI: {self.ai_client.rate_limiter.format_headroom()}")
+                    batch = BatchStats(f"projeto {projeto_id or 'todos'}", len(files))
+                    for record in files:
+                        self._spawn(self.process_document(record, batch, force_reprocess))
+                    free_slots -= len(files)
+                    dispatched = True
+            finally:
+                await self.rest.delete(settings.TABLE_PROCESSAR_AGORA, {"id": f"eq.{trigger['id']}"})
+        return dispatched
+
+    async def run(self):
+        print("[OK] Worker asyncio iniciado!")
+        print(f"   - Documentos simultâneos: {self.max_in_flight}")
+        print(f"   - Processos de extração: {self.extraction_processes}")
+        print(f"   - Arquivo de saída: {export_output()}")
+        print(f"   - Modelo: {self.ai_client.model_name}")
+        print()
+        notifier = get_job_notifier()
+        last_lease_renewal = time.monotonic()
+        try:
+            while True:
+                try:
+                    # Mantém as reservas dos documentos em andamento
+                    if time.monotonic() - last_lease_renewal >= settings.CLAIM_LEASE_RENEW_SECONDS:
+                        await renew_leases_async(self.rest)
+                        last_lease_renewal = time.monotonic()
+                    dispatched = await self.poll_once()
+                    if dispatched:
+                        await asyncio.sleep(2)
+                    else:
+                        # Aguarda o NOTIFY do insert em processar_agora (ou o próximo poll)
+                        await notifier.wait_async(CHANNEL_PROCESSAR_AGORA, notifier.idle_seconds(5))
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    print(f"[AVISO] Erro no loop: {e}")
+                    traceback.print_exc()
+                    await asyncio.sleep(5)
+        finally:
+            if self.tasks:
+                await asyncio.gather(*self.tasks, return_exceptions=True)
+            await self.rest.aclose()
+            self.process_pool.shutdown(wait=True)
+
+
+async def main_loop_async():
+    try:
+        worker = AsyncWorker()
+    except Exception as e:
+        print(f"[ERRO] Erro ao iniciar worker asyncio: {e}")
+        return
+    await worker.run()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main_loop_async())
+    except KeyboardInterrupt:
+        print("\nWorker interrompido pelo usuario")
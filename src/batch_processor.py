@@ -0,0 +1,482 @@
+"""
+Modo Batch API da OpenAI para reprocessamento em massa de um projeto.
+
+Quando a latência não importa (milhares de PENDENTE num projeto), o custo e os
+rate limits sim: a Batch API cobra metade e não consome o RPM/TPM síncrono.
+Fluxo:
+1. Reserva os documentos PENDENTE do projeto (claim_documents -> PROCESSANDO);
+   as leases são renovadas a cada CLAIM_LEASE_RENEW_SECONDS até o fim da coleta
+2. Baixa e extrai todos (mesmo estágio e pool de processos de extração do worker, com cache)
+3. Grava, à medida que os documentos ficam prontos, JSONLs com as MESMAS mensagens de
+   _call_openai (custom_id = id do documento); cada arquivo vai até BATCH_MAX_REQUESTS
+   requisições ou BATCH_MAX_FILE_MB, e um arquivo cheio é enviado como um batch próprio
+4. Acompanha cada batch até terminar
+5. Mapeia cada linha de saída de volta ao documento_gerenciamento e grava em resultados_analise
+
+Disparo: linha em processar_agora com modo = 'BATCH', ou
+    python src/batch_processor.py <projeto_id>
+
+Cada batch enviado é registrado em BATCH_STATE_PATH. Se o acompanhamento falhar
+(timeout, erro persistente da API), os documentos vão para ERRO e o batch (já pago)
+pode ser coletado depois:
+    python src/batch_processor.py --collect <batch_id>
+"""
+
+import io
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+import openai
+from config import settings
+from extraction import init_extraction_process, extraction_initargs
+from openai_client import SYSTEM_PROMPT
+from llm_cache import get_response_cache
+import worker
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+CUSTOM_ID_PREFIX = "doc-"
+# Falhas passageiras ao consultar o batch: continua acompanhando
+TRANSIENT_ERRORS = (openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError)
+
+
+def custom_id_for(doc_id) -> str:
+    return f"{CUSTOM_ID_PREFIX}{doc_id}"
+
+
+def batch_line(custom_id: str, body: dict) -> bytes:
+    """Uma linha do JSONL da Batch API (com a quebra de linha)"""
+    return (json.dumps({
+        "custom_id": custom_id,
+        "method": "POST",
+        "url": BATCH_ENDPOINT,
+        "body": body,
+    }, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+def build_batch_jsonl(requests: list) -> bytes:
+    """requests: lista de (custom_id, body) -> conteúdo do arquivo JSONL da Batch API"""
+    return b"".join(batch_line(custom_id, body) for custom_id, body in requests)
+
+
+class BatchFile:
+    """
+    JSONL de um batch gravado linha a linha em arquivo temporário (não fica na memória).
+    Cheio quando a próxima linha passaria de max_requests requisições ou max_bytes.
+    """
+
+    def __init__(self, max_requests: int = None, max_bytes: int = None):
+        self.max_requests = max_requests or settings.BATCH_MAX_REQUESTS
+        self.max_bytes = max_bytes or int(settings.BATCH_MAX_FILE_MB * 1024 * 1024)
+        self.file = tempfile.TemporaryFile()
+        self.size = 0
+        self.jobs = {}  # custom_id -> job
+
+    def __len__(self):
+        return len(self.jobs)
+
+    def fits(self, line: bytes) -> bool:
+        # Arquivo vazio aceita qualquer linha (uma requisição sozinha nunca é dividida)
+        return not self.jobs or (len(self.jobs) < self.max_requests and self.size + len(line) <= self.max_bytes)
+
+    def add(self, custom_id: str, line: bytes, job: dict):
+        self.file.write(line)
+        self.size += len(line)
+        self.jobs[custom_id] = job
+
+    def close(self):
+        self.file.close()
+
+
+class TextSpool:
+    """
+    Textos extraídos em arquivo temporário até a coleta do batch: build_result precisa
+    do texto bruto, mas guardar milhares de documentos na memória por até 24h não cabe.
+    """
+
+    def __init__(self):
+        self._file = tempfile.TemporaryFile()
+        self._index = {}  # chave -> (posição, tamanho)
+        self._lock = threading.Lock()
+
+    def put(self, key: str, text: str):
+        data = text.encode("utf-8")
+        with self._lock:
+            self._file.seek(0, os.SEEK_END)
+            self._index[key] = (self._file.tell(), len(data))
+            self._file.write(data)
+
+    def get(self, key: str) -> str:
+        with self._lock:
+            offset, size = self._index[key]
+            self._file.seek(offset)
+            return self._file.read(size).decode("utf-8")
+
+    def close(self):
+        self._file.close()
+
+
+def submit_batch(client, jsonl, metadata: dict = None) -> str:
+    """Envia o JSONL (bytes ou arquivo binário) e cria o batch. Retorna o id do batch."""
+    if isinstance(jsonl, bytes):
+        jsonl = io.BytesIO(jsonl)
+    input_file = client.files.create(
+        file=("batch_input.jsonl", jsonl),
+        purpose="batch",
+    )
+    batch = client.batches.create(
+        input_file_id=input_file.id,
+        endpoint=BATCH_ENDPOINT,
+        completion_window="24h",
+        metadata=metadata or None,
+    )
+    print(f"   [OK] Batch criado: {batch.id} (arquivo {input_file.id})")
+    return batch.id
+
+
+def wait_for_batch(client, batch_id: str, poll_seconds: float = None, timeout_seconds: float = None):
+    """Acompanha o batch até um status terminal. Retorna o objeto batch final."""
+    poll_seconds = settings.BATCH_POLL_SECONDS if poll_seconds is None else poll_seconds
+    timeout_seconds = settings.BATCH_TIMEOUT_HOURS * 3600 if timeout_seconds is None else timeout_seconds
+    started = time.time()
+    last_status = None
+    while True:
+        try:
+            batch = client.batches.retrieve(batch_id)
+        except TRANSIENT_ERRORS as e:
+            if time.time() - started > timeout_seconds:
+                raise TimeoutError(f"Batch {batch_id} não terminou em {timeout_seconds:.0f}s (último erro: {e})")
+            print(f"   [AVISO] Erro ao consultar batch {batch_id} ({e}); tentando de novo em {poll_seconds}s")
+            time.sleep(poll_seconds)
+            continue
+        if batch.status != last_status:
+            counts = getattr(batch, "request_counts", None)
+            progress = f" ({counts.completed}/{counts.total})" if counts else ""
+            print(f"   Batch {batch_id}: {batch.status}{progress}")
+            last_status = batch.status
+        if batch.status in TERMINAL_STATUSES:
+            return batch
+        if time.time() - started > timeout_seconds:
+            raise TimeoutError(f"Batch {batch_id} não terminou em {timeout_seconds:.0f}s (status: {batch.status})")
+        time.sleep(poll_seconds)
+
+
+def parse_batch_output(text: str) -> dict:
+    """
+    Converte o arquivo de saída (ou de erros) da Batch API em
+    {custom_id: {"content": str} | {"error": str}}.
+    """
+    results = {}
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        item = json.loads(line)
+        custom_id = item.get("custom_id")
+        response = item.get("response") or {}
+        error = item.get("error")
+        body = response.get("body") or {}
+        if error or response.get("status_code", 200) >= 400:
+            message = (error or {}).get("message") or (body.get("error") or {}).get("message") or "erro desconhecido"
+            results[custom_id] = {"error": message}
+            continue
+        try:
+            content = body["choices"][0]["message"]["content"]
+        except (KeyError, IndexError, TypeError):
+            content = None
+        results[custom_id] = {"content": content} if content else {"error": "Resposta vazia da OpenAI"}
+    return results
+
+
+def download_batch_results(client, batch) -> dict:
+    """Baixa os arquivos de saída e de erros do batch e junta num único mapeamento"""
+    results = {}
+    for file_id in (getattr(batch, "error_file_id", None), getattr(batch, "output_file_id", None)):
+        if file_id:
+            results.update(parse_batch_output(client.files.content(file_id).text))
+    return results
+
+
+def record_batch(batch_id: str, projeto_id, doc_ids: list, path: str = None):
+    """Registra o batch enviado (id, projeto e documentos) para poder coletar os resultados depois"""
+    path = path or settings.BATCH_STATE_PATH
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps({
+                "batch_id": batch_id, "projeto_id": projeto_id,
+                "doc_ids": [str(doc_id) for doc_id in doc_ids], "created_at": time.time(),
+            }) + "\n")
+    except Exception as e:
+        print(f"[AVISO] Erro ao registrar batch {batch_id} em {path}: {e}")
+
+
+def load_batch_record(batch_id: str, path: str = None):
+    """Registro de um batch enviado (o mais recente com esse id), ou None"""
+    path = path or settings.BATCH_STATE_PATH
+    found = None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    if entry.get("batch_id") == batch_id:
+                        found = entry
+    except FileNotFoundError:
+        pass
+    return found
+
+
+class BatchRunner:
+    """
+    process_pool: pool de extração do worker que disparou o batch (ExtractionPipeline /
+    AsyncWorker). Sem ele (linha de comando) o runner cria um pool próprio durante a execução.
+    """
+
+    def __init__(self, supabase_client, ai_client, process_pool=None):
+        self.supabase = supabase_client
+        self.ai_client = ai_client
+        self.process_pool = process_pool
+
+    def _claim_pending(self, projeto_id) -> list:
+        # Lease normal (CLAIM_LEASE_SECONDS), renovada por _renewing_leases: se o processo
+        # cair, os documentos voltam para a fila em minutos, não depois da janela do batch
+        return worker.claim_documents(self.supabase, projeto_id, settings.BATCH_MAX_DOCUMENTS)
+
+    @contextmanager
+    def _renewing_leases(self):
+        """Renova as leases dos documentos reservados enquanto o batch é extraído e acompanhado"""
+        stop = threading.Event()
+
+        def renew():
+            while not stop.wait(settings.CLAIM_LEASE_RENEW_SECONDS):
+                worker.renew_leases(self.supabase)
+
+        thread = threading.Thread(target=renew, name="batch-leases", daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
+
+    @contextmanager
+    def _extraction_pool(self):
+        if self.process_pool is not None:
+            yield self.process_pool
+            return
+        # Linha de comando: não há worker rodando neste processo, então não há pool para reaproveitar
+        with ProcessPoolExecutor(
+            max_workers=settings.EXTRACTION_PROCESSES or os.cpu_count() or 1,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_extraction_process,
+            initargs=extraction_initargs(),
+        ) as process_pool:
+            yield process_pool
+
+    def _extract_all(self, files: list, spool: TextSpool):
+        """
+        Baixa e extrai os documentos, gerando cada job extraído com sucesso assim que fica pronto.
+        O texto bruto vai para o spool (chave = custom_id); o job só guarda o texto para a IA.
+        """
+        with self._extraction_pool() as process_pool, \
+                ThreadPoolExecutor(max_workers=settings.BATCH_DOWNLOAD_WORKERS) as executor:
+            futures = {
+                executor.submit(worker.extract_file_task, record, process_pool): record
+                for record in files
+            }
+            for future in as_completed(futures):
+                record = futures.pop(future)  # Libera o resultado assim que consumido
+                try:
+                    job = future.result()
+                except Exception as e:
+                    worker.mark_error(record, e)
+                    continue
+                spool.put(custom_id_for(record['id']), job.pop('raw_text'))
+                yield job
+
+    def run_project(self, projeto_id=None, force_reprocess: bool = False):
+        started = time.time()
+        files = self._claim_pending(projeto_id)
+        if not files:
+            print(f"   Batch: nenhum PENDENTE no projeto {projeto_id or 'todos'}")
+            return
+        print(f"[BATCH] {len(files)} documento(s) do projeto {projeto_id or 'todos'}")
+
+        project_prompt = worker.get_project_prompt(projeto_id)
+        if project_prompt is None:
+            error = ValueError("Prompt não configurado. Configure no frontend ou crie prompt_custom.txt")
+            for record in files:
+                worker.mark_error(record, error)
+            return
+
+        spool = TextSpool()
+        try:
+            with self._renewing_leases():
+                submitted = self._submit_all(files, project_prompt, projeto_id, force_reprocess, spool)
+                for batch_id, jobs in submitted:
+                    self._collect(batch_id, jobs, project_prompt, projeto_id, started, spool)
+        finally:
+            spool.close()
+        if not submitted:
+            print(f"[OK] Batch: todos os documentos resolvidos pelo cache ({time.time() - started:.1f}s)")
+
+    def _submit_all(self, files: list, project_prompt, projeto_id, force_reprocess: bool, spool: TextSpool) -> list:
+        """Extrai, resolve o que já está em cache e envia o restante em batches. Retorna [(batch_id, jobs)]."""
+        prompt_final = project_prompt.prompt_final
+        response_cache = get_response_cache()
+        submitted = []
+        extracted = 0
+        batch_file = BatchFile()
+        try:
+            for job in self._extract_all(files, spool):
+                extracted += 1
+                record = job['record']
+                custom_id = custom_id_for(record['id'])
+                raw_text = spool.get(custom_id)
+                llm_text = worker.select_llm_text(raw_text, project_prompt.schema_keys, job['is_excel'])
+                # Respostas já em cache não vão para o batch
+                cache_key = None
+                if response_cache is not None:
+                    cache_key = response_cache.make_key(self.ai_client.model_name, SYSTEM_PROMPT, prompt_final, llm_text)
+                    cached = None if (force_reprocess or settings.LLM_CACHE_BYPASS) else response_cache.get(cache_key)
+                    if cached is not None:
+                        self._finish(job, project_prompt, cached, raw_text)
+                        continue
+                job['cache_key'] = cache_key
+                messages = self.ai_client.build_messages(llm_text, prompt_final)
+                line = batch_line(custom_id, self.ai_client.build_request_body(messages))
+                if not batch_file.fits(line):
+                    self._submit_file(batch_file, projeto_id, submitted)
+                    batch_file = BatchFile()
+                batch_file.add(custom_id, line, job)
+            if len(batch_file):
+                self._submit_file(batch_file, projeto_id, submitted)
+        finally:
+            batch_file.close()
+        print(f"   Extraídos: {extracted}/{len(files)} | {len(submitted)} batch(es) enviado(s)")
+        return submitted
+
+    def _submit_file(self, batch_file: BatchFile, projeto_id, submitted: list):
+        print(f"   Enviando {len(batch_file)} requisição(ões) para a Batch API "
+              f"({batch_file.size / 1024 / 1024:.1f} MB)...")
+        batch_file.file.seek(0)
+        try:
+            batch_id = submit_batch(
+                self.ai_client.client,
+                batch_file.file,
+                metadata={"projeto_id": str(projeto_id or "")},
+            )
+        except Exception as e:
+            self._fail_pending(batch_file.jobs, ValueError(f"Falha ao enviar batch: {e}"))
+            return
+        finally:
+            batch_file.close()
+        record_batch(batch_id, projeto_id, [job['record']['id'] for job in batch_file.jobs.values()])
+        submitted.append((batch_id, batch_file.jobs))
+
+    def _fail_pending(self, pending: dict, error: Exception):
+        """Documentos sem resposta: status ERRO e reserva liberada (não ficam presos em PROCESSANDO)"""
+        for job in pending.values():
+            worker.mark_error(job['record'], error)
+
+    def _collect(self, batch_id: str, pending: dict, project_prompt, projeto_id, started: float, spool: TextSpool):
+        """Acompanha o batch, baixa os resultados e grava cada documento"""
+        prompt_final = project_prompt.prompt_final
+        response_cache = get_response_cache()
+        try:
+            batch = wait_for_batch(self.ai_client.client, batch_id)
+            results = download_batch_results(self.ai_client.client, batch)
+        except Exception as e:
+            print(f"[ERRO] Batch {batch_id} não pôde ser coletado: {e}")
+            print(f"   Colete depois com: python src/batch_processor.py --collect {batch_id}")
+            self._fail_pending(pending, ValueError(f"Batch {batch_id} não coletado ({e}); use --collect {batch_id}"))
+            return
+
+        ok = failed = 0
+        for custom_id, job in pending.items():
+            result = results.get(custom_id)
+            if result is None:
+                worker.mark_error(job['record'], ValueError(f"Sem resposta no batch {batch_id} (status: {batch.status})"))
+                failed += 1
+                continue
+            if "error" in result:
+                worker.mark_error(job['record'], ValueError(f"Batch {batch_id}: {result['error']}"))
+                failed += 1
+                continue
+            if response_cache is not None and job.get('cache_key'):
+                try:
+                    response_cache.put(job['cache_key'], result['content'], self.ai_client.model_name, prompt_final, projeto_id)
+                except Exception as e:
+                    print(f"[AVISO] Erro ao gravar cache de respostas: {e}")
+            if self._finish(job, project_prompt, result['content'], spool.get(custom_id)):
+                ok += 1
+            else:
+                failed += 1
+
+        print(f"[OK] Batch {batch_id} concluído: {ok} sucesso, {failed} erro(s) em {time.time() - started:.1f}s")
+
+    def collect_batch(self, batch_id: str):
+        """Coleta um batch registrado (ex.: acompanhamento interrompido): reextrai (cache) e grava os resultados"""
+        started = time.time()
+        entry = load_batch_record(batch_id)
+        if entry is None:
+            print(f"[ERRO] Batch {batch_id} não encontrado em {settings.BATCH_STATE_PATH}")
+            return
+        project_prompt = worker.get_project_prompt(entry.get("projeto_id"))
+        if project_prompt is None:
+            print("[ERRO] Prompt não configurado. Configure no frontend ou crie prompt_custom.txt")
+            return
+        files = (
+            self.supabase.table(settings.TABLE_GERENCIAMENTO).select("*").in_("id", entry["doc_ids"]).execute().data
+            or []
+        )
+        if not files:
+            print(f"   Batch {batch_id}: nenhum documento do batch continua na fila")
+            return
+        worker.track_claimed(files)
+        spool = TextSpool()
+        try:
+            with self._renewing_leases():
+                pending = {custom_id_for(job['record']['id']): job for job in self._extract_all(files, spool)}
+                if pending:
+                    self._collect(batch_id, pending, project_prompt, entry.get("projeto_id"), started, spool)
+        finally:
+            spool.close()
+
+    def _finish(self, job: dict, project_prompt, json_text: str, raw_text: str) -> bool:
+        record = job['record']
+        try:
+            data_analise = worker.build_result(
+                record, raw_text, project_prompt.prompt_text, json_text,
+                expected_keys=project_prompt.schema_keys
+            )
+            worker.save_result(record, data_analise)
+            return True
+        except Exception as e:
+            worker.mark_error(record, e)
+            return False
+
+
+def main(projeto_id=None, force_reprocess: bool = False, process_pool=None):
+    if worker.supabase is None or worker.ai_client is None:
+        worker.init_clients()
+    BatchRunner(worker.supabase, worker.ai_client, process_pool).run_project(projeto_id, force_reprocess)
+
+
+def collect(batch_id: str):
+    if worker.supabase is None or worker.ai_client is None:
+        worker.init_clients()
+    BatchRunner(worker.supabase, worker.ai_client).collect_batch(batch_id)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 2 and sys.argv[1] == "--collect":
+        collect(sys.argv[2])
+    else:
+        main(sys.argv[1] if len(sys.argv) > 1 else None)
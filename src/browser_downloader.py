@@ -1,194 +1,460 @@
 """
 Browser-based file downloader for Salesforce pages that require JavaScript execution.
 Uses Playwright to handle pages that need button clicks or form submissions.
+
+A single headless Chromium stays alive for the whole process (BrowserPool) and is
+shared by every pipeline thread through a pool of reusable browser contexts.
+Playwright objects are bound to the thread/event loop that created them, so the
+browser lives on a dedicated asyncio loop thread and callers submit work to it.
 """
 
+import asyncio
+import atexit
+import concurrent.futures
 import tempfile
 import os
+import threading
 import time
-from playwright.sync_api import sync_playwright, TimeoutError as PlaywrightTimeoutError
+from urllib.parse import urlparse
+from playwright.async_api import async_playwright, TimeoutError as PlaywrightTimeoutError
 from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
 from config import settings
+from http_downloader import copy_to_spooled, stream_to_file, file_size, zip_signature_error
 import requests
 
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+BROWSER_ARGS = ['--disable-blink-features=AutomationControlled']  # Avoid detection
+
+# Salesforce-specific selectors first (most specific)
+DOWNLOAD_SELECTORS = [
+    'button.downloadbutton',  # Exact class from Salesforce
+    'button[title="Fazer download"]',  # Exact title
+    'button.bare.downloadbutton',  # Full class chain
+    'button[aria-label*="download"]',
+    'button:has-text("Fazer download")',
+    # Generic download selectors
+    'button:has-text("Download")',
+    'a:has-text("Download")',
+    'button:has-text("Baixar")',
+    'a:has-text("Baixar")',
+    'button[title*="Download"]',
+    'a[title*="Download"]',
+    'button[aria-label*="Download"]',
+    'a[download]',
+    '.downloadButton',
+    '#downloadButton',
+    'a[href*="download"]',
+    'button[onclick*="download"]',
+    'input[type="button"][value*="Download"]',
+    'input[type="submit"][value*="Download"]',
+    # Generic button/link if nothing else works
+    'button',
+    'a[href]'
+]
+GENERIC_SELECTORS = {'button', 'a[href]'}
+
+# Selector that produced a download last time, per host (tried first next time)
+_host_selectors = {}
+_host_selectors_lock = threading.Lock()
+
+
+def remember_selector(host: str, selector: str):
+    with _host_selectors_lock:
+        _host_selectors[host] = selector
+
+
+def ordered_selectors(host: str) -> list:
+    """DOWNLOAD_SELECTORS with the selector that worked for this host moved to the front"""
+    with _host_selectors_lock:
+        preferred = _host_selectors.get(host)
+    if not preferred:
+        return list(DOWNLOAD_SELECTORS)
+    return [preferred] + [sel for sel in DOWNLOAD_SELECTORS if sel != preferred]
+
+
+class _PooledContext:
+    def __init__(self, context, generation: int):
+        self.context = context
+        self.generation = generation
+        self.uses = 0
+
+
+class BrowserPool:
+    """
+    Long-lived headless Chromium with a pool of reusable contexts.
+    - Up to `size` contexts leased at the same time (one per concurrent download)
+    - A context is closed and replaced after `context_max_uses` downloads or any error
+    - The browser is relaunched if it disconnects (health check on every checkout)
+      and recycled after `browser_max_downloads` downloads (drains leased contexts first)
+    """
+
+    def __init__(self, size: int, context_max_uses: int, browser_max_downloads: int):
+        self.size = max(1, size)
+        self.context_max_uses = max(1, context_max_uses)
+        self.browser_max_downloads = browser_max_downloads
+        self._playwright = None
+        self._browser = None
+        self._generation = 0
+        self._idle = []
+        self._leased = 0
+        self._downloads_since_launch = 0
+        self._condition = None
+        self.stats = {"launches": 0, "contexts_created": 0, "contexts_recycled": 0, "downloads": 0}
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="browser-pool", daemon=True)
+        self._thread.start()
+        try:
+            self.run(self._start())
+        except Exception:
+            self._stop_loop()
+            raise
+
+    def run(self, coro, timeout: float = None):
+        """Executa uma corrotina no loop do navegador e aguarda o resultado (chamável de qualquer thread)"""
+        future = asyncio.run_coroutine_threadsafe(coro, self._loop)
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise
+
+    async def _start(self):
+        self._condition = asyncio.Condition()
+        self._playwright = await async_playwright().start()
+        await self._launch()
+
+    async def _launch(self):
+        if self._browser is not None:
+            try:
+                await self._browser.close()
+            except Exception:
+                pass
+        print(f"   🌐 Iniciando navegador headless (pool de {self.size} contextos)...")
+        self._browser = await self._playwright.chromium.launch(headless=True, args=BROWSER_ARGS)
+        # Contextos do navegador anterior são descartados quando devolvidos
+        self._generation += 1
+        self._idle = []
+        self._downloads_since_launch = 0
+        self.stats["launches"] += 1
+
+    async def _new_context(self):
+        context = await self._browser.new_context(accept_downloads=True, user_agent=USER_AGENT)
+        self.stats["contexts_created"] += 1
+        return context
+
+    async def _acquire(self) -> _PooledContext:
+        async with self._condition:
+            while True:
+                if not self._browser.is_connected():
+                    print("   [AVISO] Navegador desconectado, reiniciando...")
+                    await self._launch()
+                if self.browser_max_downloads and self._downloads_since_launch >= self.browser_max_downloads:
+                    if self._leased == 0:
+                        print(f"   ♻️ Reciclando navegador após {self._downloads_since_launch} downloads")
+                        await self._launch()
+                    else:
+                        # Aguarda os downloads em andamento para reciclar
+                        await self._condition.wait()
+                        continue
+                if self._idle:
+                    entry = self._idle.pop()
+                    break
+                if self._leased < self.size:
+                    entry = _PooledContext(await self._new_context(), self._generation)
+                    break
+                await self._condition.wait()
+            self._leased += 1
+            return entry
+
+    async def _release(self, entry: _PooledContext, healthy: bool):
+        async with self._condition:
+            self._leased -= 1
+            self._downloads_since_launch += 1
+            self.stats["downloads"] += 1
+            entry.uses += 1
+            if entry.generation == self._generation:
+                if healthy and entry.uses < self.context_max_uses:
+                    self._idle.append(entry)
+                else:
+                    self.stats["contexts_recycled"] += 1
+                    try:
+                        await entry.context.close()
+                    except Exception:
+                        pass
+            self._condition.notify_all()
+
+    def run_with_context(self, fn, timeout: float = None):
+        """Executa fn(context) (corrotina) com um contexto do pool e o devolve ao final"""
+        async def task():
+            entry = await self._acquire()
+            healthy = False
+            try:
+                result = await fn(entry.context)
+                healthy = True
+                return result
+            finally:
+                await self._release(entry, healthy)
+        return self.run(task(), timeout)
+
+    async def _close(self):
+        for entry in self._idle:
+            try:
+                await entry.context.close()
+            except Exception:
+                pass
+        self._idle = []
+        if self._browser is not None:
+            await self._browser.close()
+        if self._playwright is not None:
+            await self._playwright.stop()
+
+    def _stop_loop(self):
+        """Para o loop do navegador, aguarda a thread e fecha o loop"""
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=5)
+        if not self._thread.is_alive():
+            self._loop.close()
+
+    def close(self):
+        """Fecha contextos, navegador e a thread do loop (chamadas repetidas, ex.: atexit, não fazem nada)"""
+        if self._loop.is_closed() or not self._thread.is_alive():
+            return
+        try:
+            self.run(self._close(), timeout=30)
+        except Exception as e:
+            print(f"[AVISO] Erro ao fechar navegador: {e}")
+        finally:
+            self._stop_loop()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_browser_pool() -> BrowserPool:
+    """Navegador global do processo, compartilhado pelas threads do pipeline"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = BrowserPool(
+                    settings.BROWSER_POOL_SIZE,
+                    settings.BROWSER_CONTEXT_MAX_USES,
+                    settings.BROWSER_MAX_DOWNLOADS,
+                )
+                atexit.register(_pool.close)
+    return _pool
+
+
 class BrowserDownloader:
     """
     Downloads files from pages that require browser interaction.
     Specifically designed for Salesforce download pages that use JavaScript redirects.
     """
-    
+
+    def __init__(self, pool: BrowserPool = None):
+        self._pool = pool
+
+    @property
+    def pool(self) -> BrowserPool:
+        if self._pool is None:
+            self._pool = get_browser_pool()
+        return self._pool
+
     @retry(
         stop=stop_after_attempt(3),
         wait=wait_exponential(multiplier=2, min=4, max=30),
         retry=retry_if_exception_type((requests.exceptions.ConnectionError, Exception)),
         reraise=True
     )
-    def download_file(self, url: str, timeout_ms: int = 60000) -> bytes:
+    def download_to_file(self, url: str, timeout_ms: int = 60000):
         """
         Downloads a file using a headless browser.
-        
+
         Args:
             url: The Salesforce download page URL
             timeout_ms: Maximum time to wait for download (default 60s)
-            
+
         Returns:
-            bytes: The downloaded file content
-            
+            A spooled temp file with the downloaded content (rewound); the caller closes it
+
         Raises:
             Exception: If download fails or times out
         """
-        print(f"   🌐 Iniciando navegador headless...")
-        
-        with sync_playwright() as p:
-            # Launch browser in headless mode
-            browser = p.chromium.launch(
-                headless=True,
-                args=['--disable-blink-features=AutomationControlled']  # Avoid detection
+        print(f"   🌐 Usando navegador headless compartilhado...")
+        result = self.pool.run_with_context(
+            lambda context: self._download_in_context(context, url, timeout_ms),
+            timeout=timeout_ms / 1000 + 180,
+        )
+        if not isinstance(result, str):
+            return result
+
+        # Download URL captured from network: fetch it directly, outside the browser loop
+        print(f"   🌐 URL de download capturada via rede: {result[:50]}...")
+        @retry(
+            stop=stop_after_attempt(3),
+            wait=wait_exponential(multiplier=2, min=4, max=30),
+            reraise=True
+        )
+        def download_with_retry(url):
+            print(f"   ⬇️ Tentando download...")
+            # Streamed in chunks: the ZIP never sits whole in memory
+            with requests.get(url, timeout=300, stream=True) as resp:  # Increased from 60s to 5min
+                resp.raise_for_status()
+                return stream_to_file(resp.iter_content(chunk_size=1024 * 1024))
+
+        return download_with_retry(result)
+
+    async def _find_download_button(self, page, host: str, got_result):
+        """
+        Waits (up to BROWSER_SELECTOR_WAIT_MS) for a specific download button,
+        trying the selector that worked last time for this host first; the
+        generic selectors are only tried after that wait.
+        Returns (selector, locator), or (None, None) if the page started the download by itself.
+        """
+        specific = [sel for sel in ordered_selectors(host) if sel not in GENERIC_SELECTORS]
+        deadline = time.monotonic() + settings.BROWSER_SELECTOR_WAIT_MS / 1000
+        while True:
+            if got_result():
+                return None, None
+            for selector in specific:
+                try:
+                    if await page.locator(selector).count() > 0:
+                        return selector, page.locator(selector)
+                except Exception:
+                    continue
+            if time.monotonic() >= deadline:
+                break
+            await page.wait_for_timeout(150)
+        for selector in DOWNLOAD_SELECTORS:
+            if selector in GENERIC_SELECTORS:
+                try:
+                    if await page.locator(selector).count() > 0:
+                        return selector, page.locator(selector)
+                except Exception:
+                    continue
+        return None, None
+
+    async def _download_in_context(self, context, url: str, timeout_ms: int):
+        """
+        Runs on the browser loop. Returns the downloaded file (spooled), or the download URL
+        captured from the network (str) when the browser did not start a download.
+        Waits on the actual download / content-disposition events instead of fixed sleeps.
+        """
+        host = urlparse(url).netloc
+        page = await context.new_page()
+        try:
+            loop = asyncio.get_running_loop()
+            download_future = loop.create_future()
+            network_event = asyncio.Event()
+            download_url_from_network = None
+
+            def handle_download(download):
+                if not download_future.done():
+                    download_future.set_result(download)
+
+            def handle_response(response):
+                nonlocal download_url_from_network
+                # Look for responses that might be the actual file
+                if response.status == 200 and 'content-disposition' in response.headers:
+                    download_url_from_network = response.url
+                    network_event.set()
+
+            page.on('download', handle_download)
+            page.on('response', handle_response)
+
+            # Navigate to the page (this triggers the automatic POST)
+            print(f"   📄 Carregando página Salesforce...")
+            try:
+                await page.goto(url, wait_until='domcontentloaded', timeout=timeout_ms)
+            except Exception as nav_error:
+                # Navigation that turns into a download aborts goto()
+                if not download_future.done() and not network_event.is_set():
+                    raise nav_error
+
+            # Try to find and click download button (as soon as it is rendered)
+            print(f"   🔍 Procurando botão de download...")
+            selector, locator = await self._find_download_button(
+                page, host, lambda: download_future.done() or network_event.is_set()
             )
-            
+
+            if selector is None and not (download_future.done() or network_event.is_set()):
+                # Take screenshot for debugging
+                screenshot_path = os.path.join(tempfile.gettempdir(), f"salesforce_no_button_{int(time.time())}.png")
+                await page.screenshot(path=screenshot_path)
+                print(f"   📸 Screenshot salvo: {screenshot_path}")
+                raise Exception(f"Nenhum botão de download encontrado na página.")
+
+            if selector is not None:
+                count = await locator.count()
+                print(f"   [OK] Elemento encontrado: {selector} ({count} elementos)")
+                await locator.first.click(timeout=5000)
+                print(f"   🖱️ Clique executado, aguardando download...")
+
+            # Wait for the download event (or a content-disposition response), not a fixed 10s
+            network_wait = asyncio.ensure_future(network_event.wait())
             try:
-                context = browser.new_context(
-                    accept_downloads=True,
-                    user_agent='Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+                await asyncio.wait(
+                    [download_future, network_wait],
+                    timeout=settings.BROWSER_DOWNLOAD_START_TIMEOUT_MS / 1000,
+                    return_when=asyncio.FIRST_COMPLETED,
                 )
-                page = context.new_page()
-                
-                # Set up download handler
-                download_promise = None
-                
-                def handle_download(download):
-                    nonlocal download_promise
-                    download_promise = download
-                
-                page.on('download', handle_download)
-                
-                # Navigate to the page (this triggers the automatic POST)
-                print(f"   📄 Carregando página Salesforce...")
-                
-                # Set up network monitoring to catch download redirects
-                download_url_from_network = None
-                
-                def handle_response(response):
-                    nonlocal download_url_from_network
-                    # Look for responses that might be the actual file
-                    if response.status == 200 and 'content-disposition' in response.headers:
-                        download_url_from_network = response.url
-                
-                page.on('response', handle_response)
-                
-                page.goto(url, wait_until='networkidle', timeout=timeout_ms)
-                
-                # Wait for page to fully load
-                print(f"   ⏳ Aguardando página carregar...")
-                page.wait_for_timeout(3000)
-                
-                # Try to find and click download button
-                print(f"   🔍 Procurando botão de download...")
-                
-                # Salesforce-specific selectors first (most specific)
-                selectors = [
-                    'button.downloadbutton',  # Exact class from Salesforce
-                    'button[title="Fazer download"]',  # Exact title
-                    'button.bare.downloadbutton',  # Full class chain
-                    'button[aria-label*="download"]',
-                    'button:has-text("Fazer download")',
-                    # Generic download selectors
-                    'button:has-text("Download")',
-                    'a:has-text("Download")',
-                    'button:has-text("Baixar")',
-                    'a:has-text("Baixar")',
-                    'button[title*="Download"]',
-                    'a[title*="Download"]',
-                    'button[aria-label*="Download"]',
-                    'a[download]',
-                    '.downloadButton',
-                    '#downloadButton',
-                    'a[href*="download"]',
-                    'button[onclick*="download"]',
-                    'input[type="button"][value*="Download"]',
-                    'input[type="submit"][value*="Download"]',
-                    # Generic button/link if nothing else works
-                    'button',
-                    'a[href]'
-                ]
-                
-                button_clicked = False
-                for selector in selectors:
-                    try:
-                        count = page.locator(selector).count()
-                        if count > 0:
-                            print(f"   [OK] Elemento encontrado: {selector} ({count} elementos)")
-                            # Click the first one
-                            page.locator(selector).first.click(timeout=5000)
-                            button_clicked = True
-                            print(f"   🖱️ Clique executado, aguardando download...")
-                            page.wait_for_timeout(10000)  # Wait for download to start
-                            break
-                    except Exception as e:
-                        continue
-                
-                if not button_clicked:
-                    # Take screenshot for debugging
-                    screenshot_path = os.path.join(tempfile.gettempdir(), f"salesforce_no_button_{int(time.time())}.png")
-                    page.screenshot(path=screenshot_path)
-                    print(f"   📸 Screenshot salvo: {screenshot_path}")
-                    raise Exception(f"Nenhum botão de download encontrado na página.")
-                
-                # Check if we got a download from network monitoring
-                if download_url_from_network and not download_promise:
-                    print(f"   🌐 URL de download capturada via rede: {download_url_from_network[:50]}...")
-                    # Try to download directly with retry
-                    @retry(
-                        stop=stop_after_attempt(3),
-                        wait=wait_exponential(multiplier=2, min=4, max=30),
-                        reraise=True
-                    )
-                    def download_with_retry(url):
-                        print(f"   ⬇️ Tentando download...")
-                        resp = requests.get(url, timeout=300)  # Increased from 60s to 5min
-                        resp.raise_for_status()
-                        return resp.content
-                    
-                    return download_with_retry(download_url_from_network)
-                
-                # Wait for download to complete
-                if download_promise:
-                    print(f"   ⬇️ Download iniciado, aguardando conclusão...")
-                    
-                    # Save to temp file
-                    temp_dir = tempfile.mkdtemp()
-                    file_path = os.path.join(temp_dir, download_promise.suggested_filename)
-                    download_promise.save_as(file_path)
-                    
-                    # Read file bytes
-                    with open(file_path, 'rb') as f:
-                        file_bytes = f.read()
-                    
-                    # Debug: Check file signature
-                    if len(file_bytes) > 0:
-                        # ZIP files start with 'PK' (0x50 0x4B)
-                        if file_bytes[:2] != b'PK':
-                            # Not a ZIP, might be HTML
-                            preview = file_bytes[:500].decode('utf-8', errors='ignore')
-                            print(f"   [AVISO] Arquivo baixado nao e ZIP. Primeiros bytes: {preview[:100]}")
-                            raise Exception(f"Arquivo baixado não é ZIP válido. Pode ser HTML ou erro da Salesforce.")
-                    
-                    # Cleanup
+                if network_event.is_set() and not download_future.done():
+                    # The file response usually becomes a download event right after
+                    await asyncio.wait([download_future], timeout=1.0)
+            finally:
+                network_wait.cancel()
+
+            if selector is not None and (download_future.done() or network_event.is_set()):
+                remember_selector(host, selector)
+
+            # Check if we got a download from network monitoring
+            if download_url_from_network and not download_future.done():
+                return download_url_from_network
+
+            # Wait for download to complete
+            if download_future.done():
+                download = download_future.result()
+                print(f"   ⬇️ Download iniciado, aguardando conclusão...")
+
+                # Save to temp file
+                temp_dir = tempfile.mkdtemp()
+                file_path = os.path.join(temp_dir, download.suggested_filename)
+                await download.save_as(file_path)
+
+                # Copy to a spooled temp file in chunks (off the browser loop)
+                try:
+                    zip_file = await asyncio.to_thread(copy_to_spooled, file_path)
+                finally:
                     os.remove(file_path)
                     os.rmdir(temp_dir)
-                    
-                    print(f"   [OK] Download concluido: {len(file_bytes)} bytes")
-                    return file_bytes
-                else:
-                    # No download detected - save page screenshot for debugging
-                    screenshot_path = os.path.join(tempfile.gettempdir(), f"salesforce_debug_{int(time.time())}.png")
-                    page.screenshot(path=screenshot_path)
-                    print(f"   📸 Screenshot salvo em: {screenshot_path}")
-                    raise Exception("Nenhum download foi iniciado. A página pode ter mudado de estrutura.")
-                    
-            except PlaywrightTimeoutError as e:
-                raise Exception(f"Timeout ao carregar página Salesforce: {e}")
-            except Exception as e:
-                raise Exception(f"Erro no download via navegador: {e}")
-            finally:
-                browser.close()
+
+                # Debug: Check file signature
+                size = file_size(zip_file)
+                if size > 0:
+                    # ZIP files start with 'PK' (0x50 0x4B)
+                    preview = zip_signature_error(zip_file)
+                    if preview is not None:
+                        # Not a ZIP, might be HTML
+                        zip_file.close()
+                        print(f"   [AVISO] Arquivo baixado nao e ZIP. Primeiros bytes: {preview[:100]}")
+                        raise Exception(f"Arquivo baixado não é ZIP válido. Pode ser HTML ou erro da Salesforce.")
+
+                print(f"   [OK] Download concluido: {size} bytes")
+                return zip_file
+            else:
+                # No download detected - save page screenshot for debugging
+                screenshot_path = os.path.join(tempfile.gettempdir(), f"salesforce_debug_{int(time.time())}.png")
+                await page.screenshot(path=screenshot_path)
+                print(f"   📸 Screenshot salvo em: {screenshot_path}")
+                raise Exception("Nenhum download foi iniciado. A página pode ter mudado de estrutura.")
+
+        except PlaywrightTimeoutError as e:
+            raise Exception(f"Timeout ao carregar página Salesforce: {e}")
+        except Exception as e:
+            raise Exception(f"Erro no download via navegador: {e}")
+        finally:
+            try:
+                await page.close()
+            except Exception:
+                pass
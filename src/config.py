@@ -6,6 +6,10 @@ class Settings(BaseSettings):
     SUPABASE_URL: str
     SUPABASE_KEY: str
     SUPABASE_SERVICE_ROLE_KEY: str = ""  # Opcional - apenas para criar buckets programaticamente
+    SUPABASE_POOL_SIZE: int = 20  # Conexões HTTP (keep-alive) compartilhadas por todos os clientes Supabase
+    SUPABASE_KEEPALIVE_SECONDS: int = 30  # Conexão ociosa fechada após N segundos
+    SUPABASE_TIMEOUT_SECONDS: int = 60  # Timeout de leitura/escrita por chamada
+    SUPABASE_CONNECT_TIMEOUT_SECONDS: int = 10
     GOOGLE_API_KEY: str  # Para análise com Gemini 1.5 Flash
     
     # Modelos
@@ -19,7 +23,71 @@ class Settings(BaseSettings):
     CHUNK_SIZE: int = 2000
     CHUNK_OVERLAP: int = 0  # Zero overlap para evitar repetição de conteúdo
     MAX_WORKERS: int = 50  # Tier 5 detectado! Modo Turbo ativado. (Ajuste para menos se o PC ficar lento)
+    EXTRACTION_PROCESSES: int = 0  # Processos de extração PDF/Excel (0 = número de núcleos da CPU)
+    EXTRACTION_QUEUE_SIZE: int = 100  # Textos extraídos aguardando a IA (backpressure)
+    LLM_WORKERS: int = 50  # Threads fazendo chamadas à IA
+    # Limites iniciais da OpenAI (ajustados em tempo real pelos headers x-ratelimit-*)
+    OPENAI_RPM_LIMIT: int = 5000
+    OPENAI_TPM_LIMIT: int = 4000000
+    OPENAI_EXPECTED_OUTPUT_TOKENS: int = 1500  # Reserva de saída por chamada no balde de tokens
+    # Batch API (processar_agora.modo = 'BATCH')
+    BATCH_MAX_DOCUMENTS: int = 50000  # Documentos reservados por execução do modo batch (divididos em vários batches)
+    BATCH_MAX_REQUESTS: int = 50000  # Limite de requisições por arquivo de batch da OpenAI
+    BATCH_MAX_FILE_MB: float = 190  # Tamanho máximo do JSONL por batch (limite da OpenAI: 200 MB)
+    BATCH_DOWNLOAD_WORKERS: int = 16  # Downloads/extrações simultâneos antes do envio
+    BATCH_POLL_SECONDS: int = 30
+    BATCH_TIMEOUT_HOURS: int = 25  # Janela de 24h da OpenAI + folga
+    BATCH_STATE_PATH: str = ".cache/openai_batches.jsonl"  # Batches enviados (id + documentos), para coletar depois
+    # Reserva de documentos (RPC claim_documents, ver sql/migrations/add_claim_documents.sql)
+    WORKER_ID: str = ""  # Identificação do worker nas leases (vazio = host:pid)
+    CLAIM_LEASE_SECONDS: int = 900  # Documento PROCESSANDO volta a ser reservável após a lease
+    CLAIM_LEASE_RENEW_SECONDS: int = 300  # Intervalo de renovação das leases em andamento
+    # Acordar por LISTEN/NOTIFY (ver sql/migrations/add_notify_triggers.sql)
+    DATABASE_URL: str = ""  # Conexão direta Postgres do Supabase (vazio = só polling)
+    JOB_POLL_FALLBACK_SECONDS: int = 30  # Polling de segurança quando o LISTEN está ativo
+    WORKER_MODE: str = "threads"  # "threads" ou "async" (event loop único, ver async_worker.py)
+    ASYNC_MAX_IN_FLIGHT: int = 500  # Modo async: documentos em andamento ao mesmo tempo
+    ASYNC_HTTP_CONNECTIONS: int = 100  # Modo async: conexões HTTP simultâneas (Supabase)
     MAX_TEXT_TOKENS: int = 30000  # Limite para decidir entre Texto Puro vs File API
+    # Gravação em lote dos resultados (insert + Storage + fila a cada N documentos ou T ms)
+    RESULT_SINK_ENABLED: bool = True
+    RESULT_SINK_BATCH_SIZE: int = 50
+    RESULT_SINK_FLUSH_MS: int = 500
+    # Exportação local dos resultados (além do Supabase)
+    RESULT_EXPORT_FORMAT: str = "csv"  # "csv", "parquet" (requer pyarrow) ou "" para desativar
+    RESULT_EXPORT_PATH: str = "resultados_analise"  # Sem extensão: .csv ou diretório _parquet/
+    RESULT_EXPORT_BATCH_SIZE: int = 50  # Linhas por gravação
+    RESULT_EXPORT_FLUSH_SECONDS: int = 10  # Grava o buffer pelo menos a cada N segundos
+    EXCEL_SERIALIZER_FORMAT: str = "csv"  # Planilhas no prompt: "csv" ou "markdown"
+    EXCEL_MAX_TOKENS: int = 20000  # Orçamento de tokens da planilha serializada (todas as abas)
+    DOCLING_POOL_SIZE: int = 4  # Máximo de conversores Docling (sem OCR) por processo, inclusive nos de extração (criados sob demanda)
+    DOCLING_VLM_POOL_SIZE: int = 1  # Conversores Docling VLM (fallback OCR via gpt-4o)
+    PDF_SHARD_ENABLED: bool = True  # PDFs grandes convertidos em fatias de páginas em paralelo (pool de processos)
+    PDF_SHARD_PAGES: int = 8  # Páginas por fatia (1 = tempo exato de cada página)
+    PDF_SHARD_MIN_PAGES: int = 24  # Só divide PDFs com pelo menos N páginas
+    PDF_SHARD_PROCESSES: int = 0  # Processos do pool próprio de fatias, quando não há executor (0 = núcleos da CPU)
+    
+    # Cache de extração (PDF/Excel -> markdown), chave = SHA-256 do arquivo + pipeline
+    EXTRACTION_CACHE_ENABLED: bool = True
+    EXTRACTION_CACHE_DIR: str = ".cache/extraction"
+    EXTRACTION_CACHE_MAX_MB: int = 2048
+    STORAGE_SPOOL_MAX_MB: int = 32  # Download do Storage fica em memória até N MB; acima disso vai para arquivo temporário
+    
+    # Cache de respostas da IA (SQLite), chave = modelo + prompts + texto do documento
+    LLM_CACHE_ENABLED: bool = True
+    LLM_CACHE_PATH: str = ".cache/llm_responses.sqlite3"
+    LLM_CACHE_TTL_HOURS: int = 720  # 30 dias
+    LLM_CACHE_BYPASS: bool = False  # True = sempre chamar a IA (reprocessamento forçado)
+    
+    # Seleção por relevância (BM25 contra as chaves do schema) do texto de PDFs longos enviado à IA
+    LLM_PRUNE_ENABLED: bool = True
+    LLM_PRUNE_MIN_TOKENS: int = 12000  # Documentos até N tokens vão inteiros
+    LLM_PRUNE_MAX_TOKENS: int = 8000  # Orçamento de tokens dos trechos selecionados
+    LLM_PRUNE_CHUNK_TOKENS: int = 400  # Tamanho máximo de cada trecho (seções por título)
+    LLM_PRUNE_MIN_KEY_COVERAGE: float = 0.6  # Abaixo disso (chaves do schema cobertas), vai o documento inteiro
+    
+    # Cache do prompt por projeto (verifica prompt_config.updated_at a cada N segundos)
+    PROMPT_CACHE_CHECK_SECONDS: int = 10
     
     # Tabelas
     TABLE_EMBEDDINGS: str = "documento_chunks"
@@ -32,6 +100,29 @@ class Settings(BaseSettings):
     SALESFORCE_API_URL: str = "https://c22093r8uj.execute-api.us-east-1.amazonaws.com/producao/salesforce/v1/integracoes/obterArquivos/caso/{case_number}"
     SALESFORCE_API_KEY: str = "" # Adicione no .env
     SALESFORCE_PROJECT_ID: str = "00000000-0000-0000-0000-000000000001"  # ID fixo para importações Salesforce
+    SALESFORCE_POOL_SIZE: int = 10  # Conexões keep-alive com a API Salesforce
+    SALESFORCE_CACHE_TTL_SECONDS: int = 300  # Cache caso -> lista de ZIPs (casos recolocados na fila não chamam a API)
+    SALESFORCE_ERROR_CACHE_SECONDS: int = 30  # Erro da API para o caso é repetido sem nova chamada por N segundos
+    SALESFORCE_LOOKUP_CONCURRENCY: int = 5  # Consultas simultâneas no modo em lote
+    # Download direto via HTTP (sem navegador) antes do BrowserDownloader
+    DIRECT_DOWNLOAD_ENABLED: bool = True
+    DIRECT_DOWNLOAD_MAX_HOPS: int = 5  # Formulários/redirects seguidos até o arquivo
+    DIRECT_DOWNLOAD_POOL_SIZE: int = 10  # Conexões HTTP mantidas por host
+    DIRECT_DOWNLOAD_MIN_ATTEMPTS: int = 10  # Tentativas antes de avaliar a taxa de sucesso do host
+    DIRECT_DOWNLOAD_MIN_SUCCESS: float = 0.2  # Abaixo disso o host vai direto para o navegador
+    ZIP_SPOOL_MAX_MB: int = 8  # ZIP baixado fica em memória até este tamanho, depois vai para disco
+    ZIP_RANGE_ENABLED: bool = True  # Lê só o diretório central e os membros filtrados via HTTP Range
+    ZIP_RANGE_MIN_MB: float = 5  # ZIPs menores que isso são baixados inteiros (menos requisições)
+    ZIP_RANGE_BLOCK_KB: int = 256  # Tamanho mínimo de cada leitura por Range
+    PDF_TEXT_DENSE_CHARS: int = 300  # Caracteres/página a partir dos quais o PDF tem texto real (não é digitalizado)
+    CASE_ZIP_CONCURRENCY: int = 3  # ZIPs de um mesmo caso baixados/analisados em paralelo
+    ZIP_DOWNLOAD_CONCURRENCY: int = 8  # Limite global de ZIPs em processamento (todos os casos)
+    # Navegador headless compartilhado (BrowserDownloader)
+    BROWSER_POOL_SIZE: int = 5  # Contextos simultâneos (= threads do pipeline Salesforce)
+    BROWSER_CONTEXT_MAX_USES: int = 25  # Recria o contexto após N downloads
+    BROWSER_MAX_DOWNLOADS: int = 500  # Reinicia o Chromium após N downloads (0 = nunca)
+    BROWSER_SELECTOR_WAIT_MS: int = 3000  # Espera máxima pelo botão de download antes dos seletores genéricos
+    BROWSER_DOWNLOAD_START_TIMEOUT_MS: int = 10000  # Espera máxima pelo evento de download após o clique
     
     class Config:
         env_file = ".env"
@@ -0,0 +1,207 @@
+"""
+Pool de conversores Docling reutilizáveis (process-wide).
+
+Criar um DocumentConverter carrega os modelos de layout/tabela, o que domina a
+latência por documento quando feito a cada PDF. Este módulo mantém conversores
+já aquecidos, separados por tipo de pipeline ("no_ocr" e "vlm"), que são
+emprestados por documento e devolvidos ao final.
+"""
+
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from config import settings
+
+# Tipos de pipeline suportados
+PIPELINE_NO_OCR = "no_ocr"
+PIPELINE_VLM = "vlm"
+
+
+def _build_no_ocr_converter():
+    """Conversão padrão SEM OCR local (rápida)."""
+    from docling.document_converter import DocumentConverter, PdfFormatOption
+    from docling.datamodel.base_models import InputFormat
+    from docling.datamodel.pipeline_options import PdfPipelineOptions
+
+    pipeline_options_no_ocr = PdfPipelineOptions()
+    pipeline_options_no_ocr.do_ocr = False  # Desabilitar OCR local
+
+    return DocumentConverter(
+        format_options={
+            InputFormat.PDF: PdfFormatOption(pipeline_options=pipeline_options_no_ocr)
+        }
+    )
+
+
+def _build_vlm_converter():
+    """Pipeline VLM com OpenAI gpt-4o (sem OCR local)."""
+    from docling.document_converter import DocumentConverter, PdfFormatOption
+    from docling.datamodel.base_models import InputFormat
+    from docling.datamodel.pipeline_options import PdfPipelineOptions, VlmPipelineOptions, ApiVlmOptions
+
+    pipeline_options = PdfPipelineOptions()
+    pipeline_options.do_ocr = False  # Não usar OCR local (RapidOCR)
+    pipeline_options.do_table_structure = True
+    pipeline_options.table_structure_options.do_cell_matching = True
+
+    # Configurar VLM para usar OpenAI gpt-4o
+    pipeline_options.vlm_options = VlmPipelineOptions(
+        api_options=ApiVlmOptions(
+            api_key=settings.OPENAI_API_KEY,
+            model="gpt-4o",
+            prompt="Extract all text from this document.",
+            response_format="markdown"
+        )
+    )
+
+    return DocumentConverter(
+        format_options={
+            InputFormat.PDF: PdfFormatOption(pipeline_options=pipeline_options)
+        }
+    )
+
+
+_BUILDERS = {
+    PIPELINE_NO_OCR: _build_no_ocr_converter,
+    PIPELINE_VLM: _build_vlm_converter,
+}
+
+
+class ConverterPool:
+    """
+    Pool de DocumentConverter por tipo de pipeline.
+    - warm_up(): cria e inicializa os conversores (normalmente no start do worker)
+    - checkout(): empresta um conversor; bloqueia se todos estiverem em uso
+    - stats(): tempo de aquecimento, ocupação atual e pico de ocupação
+    """
+
+    def __init__(self, sizes: dict):
+        self.sizes = dict(sizes)
+        self._queues = {kind: queue.Queue() for kind in self.sizes}
+        self._created = {kind: 0 for kind in self.sizes}
+        self._in_use = {kind: 0 for kind in self.sizes}
+        self._peak_in_use = {kind: 0 for kind in self.sizes}
+        self._warmup_seconds = {kind: 0.0 for kind in self.sizes}
+        self._lock = threading.Lock()
+
+    def _create(self, kind: str):
+        """Cria um conversor e já inicializa o pipeline de PDF (carrega os modelos)."""
+        start = time.perf_counter()
+        try:
+            converter = _BUILDERS[kind]()
+            try:
+                from docling.datamodel.base_models import InputFormat
+                converter.initialize_pipeline(InputFormat.PDF)
+            except AttributeError:
+                pass  # Versões antigas do Docling inicializam no primeiro convert()
+        except Exception:
+            with self._lock:
+                self._created[kind] -= 1  # Liberar a vaga reservada
+            raise
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self._warmup_seconds[kind] += elapsed
+        return converter
+
+    def _reserve(self, kind: str) -> bool:
+        """Reserva uma vaga para novo conversor (False se o pool já está cheio)."""
+        with self._lock:
+            if self._created[kind] >= self.sizes[kind]:
+                return False
+            self._created[kind] += 1
+            return True
+
+    def warm_up(self, kinds=None, count: int = None):
+        """Cria os conversores dos tipos pedidos (padrão: todos), até count por tipo (padrão: o pool inteiro)."""
+        for kind in kinds or list(self.sizes):
+            while (count is None or self._created[kind] < count) and self._reserve(kind):
+                self._queues[kind].put(self._create(kind))
+            print(f"   [OK] Docling '{kind}': {self._created[kind]} conversor(es) aquecido(s) "
+                  f"em {self._warmup_seconds[kind]:.1f}s")
+
+    @contextmanager
+    def checkout(self, kind: str):
+        """Empresta um conversor do pool. Cria sob demanda até o tamanho máximo."""
+        if kind not in self._queues:
+            raise ValueError(f"Pipeline Docling desconhecido: {kind}")
+
+        converter = None
+        try:
+            converter = self._queues[kind].get_nowait()
+        except queue.Empty:
+            if self._reserve(kind):
+                converter = self._create(kind)
+            else:
+                converter = self._queues[kind].get()
+
+        with self._lock:
+            self._in_use[kind] += 1
+            self._peak_in_use[kind] = max(self._peak_in_use[kind], self._in_use[kind])
+        try:
+            yield converter
+        finally:
+            with self._lock:
+                self._in_use[kind] -= 1
+            self._queues[kind].put(converter)
+
+    def stats(self) -> dict:
+        """Ocupação e tempo de aquecimento por tipo de pipeline."""
+        with self._lock:
+            return {
+                kind: {
+                    "size": self.sizes[kind],
+                    "created": self._created[kind],
+                    "in_use": self._in_use[kind],
+                    "peak_in_use": self._peak_in_use[kind],
+                    "idle": self._queues[kind].qsize(),
+                    "warmup_seconds": round(self._warmup_seconds[kind], 2),
+                }
+                for kind in self.sizes
+            }
+
+
+def summarize_stats(process_stats: list) -> str:
+    """Resumo combinado dos pools de vários processos (lista com o stats() de cada processo)"""
+    lines = []
+    for kind in (PIPELINE_NO_OCR, PIPELINE_VLM):
+        pools = [stats[kind] for stats in process_stats if kind in stats]
+        if not pools:
+            continue
+        lines.append(
+            f"   Docling '{kind}': {len(pools)} processo(s), "
+            f"{sum(s['created'] for s in pools)}/{sum(s['size'] for s in pools)} conversor(es) criado(s), "
+            f"{sum(s['in_use'] for s in pools)} em uso (pico {sum(s['peak_in_use'] for s in pools)}), "
+            f"aquecimento {sum(s['warmup_seconds'] for s in pools):.1f}s"
+        )
+    return "\n".join(lines) or "   Docling: nenhuma conversão neste processo"
+
+
+# Pool global do processo (criado sob demanda)
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def configured_sizes() -> dict:
+    """Tamanhos do pool por tipo de pipeline (DOCLING_POOL_SIZE / DOCLING_VLM_POOL_SIZE)"""
+    return {
+        PIPELINE_NO_OCR: settings.DOCLING_POOL_SIZE,
+        PIPELINE_VLM: settings.DOCLING_VLM_POOL_SIZE,
+    }
+
+
+def init_converter_pool(sizes: dict) -> ConverterPool:
+    """Substitui o pool do processo (ex.: processos de extração usam pools menores)."""
+    global _pool
+    with _pool_lock:
+        _pool = ConverterPool(sizes)
+    return _pool
+
+
+def get_converter_pool() -> ConverterPool:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConverterPool(configured_sizes())
+    return _pool
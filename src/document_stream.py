@@ -0,0 +1,111 @@
+"""
+Documento baixado do Storage sem cópias desnecessárias.
+
+O download é lido em blocos: até STORAGE_SPOOL_MAX_MB os blocos ficam em memória
+(juntados uma única vez no fim), acima disso vão para um arquivo temporário com
+nome, que o Docling abre direto pelo caminho. O SHA-256 (chave do cache de
+extração) é calculado durante o download, sem reler o conteúdo.
+
+`source` é o que o extrator recebe: bytes (PDF vira DocumentStream em memória)
+ou o caminho do arquivo temporário (só para documentos grandes).
+"""
+
+import hashlib
+import os
+import tempfile
+from config import settings
+
+
+class DownloadedDocument:
+    """Bytes em memória até o limite, arquivo temporário acima dele; use com `with`"""
+
+    def __init__(self, suffix: str = "", max_memory_bytes: int = None):
+        self.suffix = suffix
+        self.max_memory_bytes = (
+            max_memory_bytes if max_memory_bytes is not None else int(settings.STORAGE_SPOOL_MAX_MB * 1024 * 1024)
+        )
+        self.size = 0
+        self.path = None
+        self._chunks = []
+        self._file = None
+        self._data = None
+        self._hash = hashlib.sha256()
+
+    @classmethod
+    def from_bytes(cls, data: bytes, suffix: str = ""):
+        """Documento já em memória (ex.: resposta inteira); nunca vai para disco"""
+        document = cls(suffix, max_memory_bytes=len(data))
+        document.write(data)
+        return document.finish()
+
+    def write(self, chunk: bytes):
+        if not chunk:
+            return
+        self._hash.update(chunk)
+        self.size += len(chunk)
+        if self._file is not None:
+            self._file.write(chunk)
+            return
+        self._chunks.append(chunk)
+        if self.size > self.max_memory_bytes:
+            self._spill()
+
+    def _spill(self):
+        """Passou do limite: grava o que está em memória e segue escrevendo em disco"""
+        self._file = tempfile.NamedTemporaryFile(delete=False, suffix=self.suffix)
+        self.path = self._file.name
+        for chunk in self._chunks:
+            self._file.write(chunk)
+        self._chunks = []
+
+    def finish(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        elif self._data is None:
+            self._data = b"".join(self._chunks)
+            self._chunks = []
+        return self
+
+    @property
+    def in_memory(self) -> bool:
+        return self.path is None
+
+    @property
+    def source(self):
+        """bytes (em memória) ou caminho do arquivo temporário"""
+        return self._data if self.path is None else self.path
+
+    def content_hash(self):
+        """Cópia do SHA-256 do conteúdo (pode receber mais update() sem afetar o documento)"""
+        return self._hash.copy()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self.path and os.path.exists(self.path):
+            try:
+                os.remove(self.path)
+            except Exception as cleanup_error:
+                print(f"[AVISO] Erro ao limpar arquivo temporário: {cleanup_error}")
+        self._data = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+def download_document(chunks, suffix: str = "") -> DownloadedDocument:
+    """Consome um iterador de blocos (download em streaming) em um DownloadedDocument"""
+    document = DownloadedDocument(suffix)
+    try:
+        for chunk in chunks:
+            document.write(chunk)
+        return document.finish()
+    except BaseException:
+        document.close()
+        raise
@@ -0,0 +1,106 @@
+"""
+Serialização de planilhas Excel para o prompt.
+
+Lê todas as abas, remove linhas/colunas vazias (operações vetorizadas do pandas)
+e gera UMA representação compacta por aba (CSV ou tabela markdown), limitada a
+um orçamento de tokens medido com tiktoken. As primeiras abas têm prioridade;
+linhas que não cabem no orçamento são omitidas com um aviso no texto.
+"""
+
+import io
+from itertools import accumulate
+from bisect import bisect_right
+from config import settings
+from token_utils import count_tokens, count_tokens_batch
+
+FORMATS = ("csv", "markdown")
+
+
+def read_sheets(data) -> dict:
+    """Todas as abas da planilha (bytes ou caminho), com tipos inferidos e sem linhas/colunas vazias"""
+    import pandas as pd
+
+    sheets = pd.read_excel(io.BytesIO(data) if isinstance(data, bytes) else data, sheet_name=None)
+    cleaned = {}
+    for name, df in sheets.items():
+        # Células só com espaços contam como vazias
+        df = df.replace(r"^\s*$", pd.NA, regex=True)
+        df = df.dropna(axis=0, how="all").dropna(axis=1, how="all")
+        if df.empty:
+            continue
+        # Tabela começando abaixo da linha 1: a primeira linha não vazia é o cabeçalho
+        if all(str(c).startswith("Unnamed:") for c in df.columns) and len(df) > 1:
+            df.columns = ["" if pd.isna(v) else str(v) for v in df.iloc[0]]
+            df = df.iloc[1:].dropna(axis=1, how="all")
+        # Inteiros continuam inteiros (1234, não 1234.0) mesmo com células vazias
+        df = df.convert_dtypes()
+        df.columns = ["" if str(c).startswith("Unnamed:") else str(c) for c in df.columns]
+        cleaned[str(name)] = df
+    return cleaned
+
+
+def sheet_lines(df, fmt: str) -> tuple:
+    """(linhas de cabeçalho, linhas de dados) da aba no formato pedido"""
+    if fmt == "csv":
+        lines = df.to_csv(index=False, lineterminator="\n").rstrip("\n").split("\n")
+        return lines[:1], lines[1:]
+
+    # Tabela markdown: células como texto, '|' escapado, linhas unidas coluna a coluna (vetorizado)
+    cells = df.astype("string").fillna("")
+    cells = cells.apply(lambda col: col.str.replace("|", "\\|", regex=False).str.replace("\n", " ", regex=False))
+    columns = [cells.iloc[:, i] for i in range(cells.shape[1])]
+    rows = columns[0].str.cat(columns[1:], sep=" | ") if len(columns) > 1 else columns[0]
+    header = " | ".join(str(c).replace("|", "\\|") for c in df.columns)
+    return [f"| {header} |", "|" + " --- |" * len(columns)], ("| " + rows + " |").tolist()
+
+
+def _fit_rows(rows: list, budget: int, model: str) -> tuple:
+    """(linhas que cabem no orçamento, tokens usados); cada linha conta +1 token da quebra"""
+    if budget <= 0 or not rows:
+        return 0, 0
+    totals = list(accumulate(tokens + 1 for tokens in count_tokens_batch(rows, model)))
+    kept = bisect_right(totals, budget)
+    return kept, totals[kept - 1] if kept else 0
+
+
+def serialize_excel(data, fmt: str = None, max_tokens: int = None, model: str = None) -> str:
+    """Converte a planilha (todas as abas) em texto compacto de no máximo ~`max_tokens` tokens"""
+    fmt = fmt or settings.EXCEL_SERIALIZER_FORMAT
+    if fmt not in FORMATS:
+        raise ValueError(f"Formato de planilha inválido: {fmt} (use {' ou '.join(FORMATS)})")
+    max_tokens = max_tokens or settings.EXCEL_MAX_TOKENS
+    model = model or settings.MODEL_OPENAI
+
+    sheets = read_sheets(data)
+    if not sheets:
+        return "## Planilha vazia"
+
+    remaining = max_tokens
+    parts = []
+    names = list(sheets)
+    for index, name in enumerate(names):
+        df = sheets[name]
+        header_lines, rows = sheet_lines(df, fmt)
+        title = f"## Planilha: {name} ({len(df)} linhas x {len(df.columns)} colunas)"
+        head = "\n".join([title, ""] + header_lines)
+        remaining -= count_tokens(head, model) + 2
+        if remaining <= 0:
+            omitted = names[index:]
+            break
+
+        kept, used = _fit_rows(rows, remaining, model)
+        remaining -= used
+        text = "\n".join([head] + rows[:kept])
+        if kept < len(rows):
+            text += f"\n... {len(rows) - kept} linha(s) omitida(s) (limite de {max_tokens} tokens)"
+            print(f"   [AVISO] Planilha '{name}': {len(rows) - kept} de {len(rows)} linhas omitidas pelo limite de tokens")
+        parts.append(text)
+        if kept < len(rows):
+            omitted = names[index + 1:]
+            break
+    else:
+        omitted = []
+
+    if omitted:
+        parts.append(f"## Abas omitidas (limite de {max_tokens} tokens): {', '.join(omitted)}")
+    return "\n\n".join(parts)
@@ -0,0 +1,399 @@
+"""
+Extração de texto (PDF/Excel -> markdown) isolada do cliente de IA.
+
+As funções de nível de módulo deste arquivo são "picklable" e podem rodar
+dentro de um ProcessPoolExecutor, fora do GIL das threads que aguardam a
+OpenAI. Cada processo filho mantém seu próprio pool de conversores Docling.
+"""
+
+import io
+import os
+import threading
+import time
+from config import settings
+from document_stream import DownloadedDocument
+from excel_serializer import serialize_excel
+from extraction_cache import get_extraction_cache
+from pdf_shards import split_pdf, merge_shards, slowest_pages
+from docling_pool import (
+    get_converter_pool, init_converter_pool, configured_sizes, summarize_stats, PIPELINE_NO_OCR, PIPELINE_VLM,
+)
+
+EXCEL_EXTENSIONS = ['.xlsx', '.xls']
+
+# Abaixo disso (documento inteiro), o PDF é tratado como digitalizado e vai para o OCR via VLM
+MIN_TEXT_CHARS = 50
+
+# Assinaturas dos pipelines de extração (fazem parte da chave do cache).
+# Altere a versão sempre que a saída da extração mudar.
+PIPELINE_SIGNATURE_PDF = "pdf:docling-no_ocr+vlm-gpt-4o:v1"
+PIPELINE_SIGNATURE_EXCEL = "excel:all-sheets-compact:v2"
+
+
+def pipeline_signature(file_extension: str) -> str:
+    if file_extension in EXCEL_EXTENSIONS:
+        # Formato e orçamento de tokens mudam a saída da planilha
+        return f"{PIPELINE_SIGNATURE_EXCEL}:{settings.EXCEL_SERIALIZER_FORMAT}:{settings.EXCEL_MAX_TOKENS}"
+    if settings.PDF_SHARD_ENABLED:
+        # PDFs grandes são convertidos em fatias: o tamanho da fatia muda o markdown
+        return f"{PIPELINE_SIGNATURE_PDF}:shards-v2-{settings.PDF_SHARD_PAGES}-min{settings.PDF_SHARD_MIN_PAGES}"
+    return PIPELINE_SIGNATURE_PDF
+
+
+def extraction_initargs() -> tuple:
+    """initargs de init_extraction_process: tamanhos do pool Docling configurados no processo pai"""
+    return (configured_sizes(),)
+
+
+def init_extraction_process(sizes: dict = None):
+    """
+    Initializer dos processos de extração: pool Docling com os tamanhos configurados
+    (sizes, vindos do processo pai via extraction_initargs) e um conversor sem OCR já aquecido;
+    os demais são criados sob demanda até o tamanho do pool.
+    """
+    try:
+        # Perfil por página do Docling (ConversionResult.timings) para os tempos por página das fatias
+        from docling.datamodel.settings import settings as docling_settings
+        docling_settings.debug.profile_pipeline_timings = True
+    except Exception:
+        pass
+    init_converter_pool(sizes or configured_sizes())
+    try:
+        get_converter_pool().warm_up([PIPELINE_NO_OCR], count=1)
+    except Exception as e:
+        print(f"[AVISO] Falha ao aquecer Docling no processo {os.getpid()}: {e}")
+
+
+def docling_source(source):
+    """Entrada do Docling: caminho do arquivo, ou bytes como DocumentStream em memória (sem arquivo temporário)"""
+    if isinstance(source, str):
+        return source
+    from docling.datamodel.base_models import DocumentStream
+    # Stream novo a cada conversão (o Docling consome o stream)
+    return DocumentStream(name="documento.pdf", stream=io.BytesIO(source))
+
+
+def _convert_no_ocr(source) -> tuple:
+    """Conversão padrão SEM OCR (rápida/local). Retorna (markdown, ConversionResult)."""
+    with get_converter_pool().checkout(PIPELINE_NO_OCR) as converter:
+        result = converter.convert(docling_source(source))
+    return result.document.export_to_markdown(), result
+
+
+def _convert_vlm(source) -> tuple:
+    """Conversor VLM com OpenAI gpt-4o (DESABILITA OCR LOCAL!) vindo do pool. Retorna (markdown, ConversionResult)."""
+    print(f"   👁️ Iniciando OCR com OpenAI Vision (gpt-4o)...")
+    with get_converter_pool().checkout(PIPELINE_VLM) as converter_vlm:
+        result = converter_vlm.convert(docling_source(source))
+    print("   ✅ OCR com OpenAI Vision concluído.")
+    return result.document.export_to_markdown(), result
+
+
+def _convert_pdf(source) -> tuple:
+    """
+    Conversão Docling sem OCR local, com fallback para o pipeline VLM (OpenAI Vision).
+    Retorna (markdown, ocr_activated, ConversionResult).
+    """
+    text_content = None
+    ocr_activated = False
+    result = None
+
+    # Tentativa 1: Conversão Padrão SEM OCR (Rápida/Local)
+    try:
+        text_content, result = _convert_no_ocr(source)
+    except Exception as extraction_error:
+        print(f"   ⚠️ Erro na extração padrão: {extraction_error}")
+        print("   🔄 Ativando OpenAI Vision devido ao erro...")
+        ocr_activated = True
+
+    # Validação: Se não há texto suficiente OU houve erro, tentar OCR via OpenAI (VLM)
+    if ocr_activated or (text_content and len(text_content.strip()) < MIN_TEXT_CHARS):
+        if not ocr_activated:
+            print(f"   [AVISO] Texto insuficiente (< {MIN_TEXT_CHARS} chars). Ativando OpenAI Vision...")
+            ocr_activated = True
+        text_content, result = _convert_vlm(source)
+
+    return text_content, ocr_activated, result
+
+
+def extract_pdf_markdown(source) -> tuple:
+    """
+    Converte PDF para Markdown estruturado com Docling.
+    source: caminho do arquivo ou bytes do PDF.
+    OCR: Usa APENAS OpenAI Vision (gpt-4o) via pipeline VLM, não usa OCR local.
+    Retorna (markdown, ocr_activated).
+    """
+    try:
+        origin = source if isinstance(source, str) else f"{len(source)} bytes em memória"
+        print(f"   🚀 Iniciando conversão padrão com Docling (SEM OCR local): {origin}")
+        text_content, ocr_activated, _ = _convert_pdf(source)
+
+        # Estimativa básica de tokens
+        token_est = len(text_content) // 4
+        print(f"   📄 Markdown extraído: {token_est} tokens (aprox.)")
+
+        # DEBUG CRÍTICO
+        print("\n   🔍 --- INÍCIO DO MARKDOWN EXTRAÍDO (DEBUG) ---")
+        print(text_content[:600])
+        print("   🔍 --- FIM DO DEBUG ---\n")
+
+    except Exception as e:
+        print(f"[ERRO] Falha na extração com Docling (incluindo OCR): {e}")
+        raise ValueError(f"Erro ao processar PDF com Docling: {e}")
+
+    return text_content, ocr_activated
+
+
+# Último stats() do pool de conversores de cada processo de extração (pid -> stats)
+_process_pool_stats = {}
+_process_pool_stats_lock = threading.Lock()
+
+
+def _pool_stats() -> tuple:
+    """(pid, stats do pool de conversores) deste processo, devolvido junto com a extração"""
+    return os.getpid(), get_converter_pool().stats()
+
+
+def _record_pool_stats(extracted: dict):
+    """Guarda o stats() do processo que fez a extração (fora do resultado que vai para o cache)"""
+    pool_stats = extracted.pop("pool_stats", None)
+    if pool_stats:
+        pid, stats = pool_stats
+        with _process_pool_stats_lock:
+            _process_pool_stats[pid] = stats
+
+
+def converter_pool_summary() -> str:
+    """Ocupação e aquecimento dos pools Docling de todos os processos de extração (para o log do lote)"""
+    with _process_pool_stats_lock:
+        process_stats = list(_process_pool_stats.values())
+    return summarize_stats(process_stats)
+
+
+def _page_seconds(result, pages: int, elapsed: float) -> list:
+    """
+    Tempo de cada página da fatia: soma das etapas por página do perfil do Docling
+    (quando o perfil cobre todas as páginas); senão, o tempo da fatia dividido igualmente.
+    """
+    per_page = [0.0] * pages
+    profiled = False
+    for item in (getattr(result, "timings", None) or {}).values():
+        scope = getattr(getattr(item, "scope", None), "value", None)
+        times = getattr(item, "times", None) or []
+        if scope == "page" and len(times) == pages:
+            for index, seconds in enumerate(times):
+                per_page[index] += seconds
+            profiled = True
+    if profiled:
+        return [(seconds, False) for seconds in per_page]
+    return [(elapsed / pages, True)] * pages
+
+
+def extract_pdf_shard(data: bytes, first_page: int, pages: int) -> dict:
+    """
+    Converte uma fatia de páginas do PDF (roda no ProcessPoolExecutor).
+    Fatia com pouco texto (capa, anexo, separador) NÃO vai para o VLM aqui: o
+    fallback por texto insuficiente é decidido no documento inteiro, depois de
+    remontar as fatias. Só erro na conversão da fatia usa o VLM nela.
+    """
+    started = time.perf_counter()
+    ocr_activated = False
+    try:
+        text, result = _convert_no_ocr(data)
+    except Exception as extraction_error:
+        print(f"   ⚠️ Erro na extração padrão (páginas {first_page}-{first_page + pages - 1}): {extraction_error}")
+        text, result = _convert_vlm(data)
+        ocr_activated = True
+    elapsed = time.perf_counter() - started
+    return {
+        "first_page": first_page,
+        "text": text,
+        "ocr": ocr_activated,
+        "seconds": elapsed,
+        "page_timings": [
+            {"page": first_page + offset, "seconds": round(seconds, 3), "estimated": estimated}
+            for offset, (seconds, estimated) in enumerate(_page_seconds(result, pages, elapsed))
+        ],
+        "pool_stats": _pool_stats(),
+    }
+
+
+def pdf_shards(source, file_extension: str):
+    """Fatias de páginas para extração paralela, ou None (Excel, PDF pequeno ou fatiamento desativado)"""
+    if file_extension in EXCEL_EXTENSIONS or not settings.PDF_SHARD_ENABLED:
+        return None
+    try:
+        return split_pdf(source, settings.PDF_SHARD_PAGES, settings.PDF_SHARD_MIN_PAGES)
+    except Exception as e:
+        print(f"[AVISO] Não foi possível dividir o PDF em fatias ({e}); convertendo inteiro")
+        return None
+
+
+def extract_pdf_vlm(source) -> dict:
+    """OCR via VLM do PDF inteiro (roda no ProcessPoolExecutor)"""
+    text, _ = _convert_vlm(source)
+    return {"text": text, "ocr": True, "pool_stats": _pool_stats()}
+
+
+def _needs_document_ocr(extracted: dict) -> bool:
+    """Documento remontado com texto insuficiente: é digitalizado, vai inteiro para o VLM"""
+    if len(extracted["text"].strip()) >= MIN_TEXT_CHARS:
+        return False
+    print(f"   [AVISO] Texto insuficiente no documento (< {MIN_TEXT_CHARS} chars). Ativando OpenAI Vision...")
+    return True
+
+
+def _apply_document_ocr(extracted: dict, ocr: dict) -> dict:
+    _record_pool_stats(ocr)
+    extracted.update(text=ocr["text"], ocr=True)
+    return extracted
+
+
+def _merge_pdf_shards(results: list, started: float) -> dict:
+    for result in results:
+        _record_pool_stats(result)
+    extracted = merge_shards(results)
+    pages = len(extracted["page_timings"])
+    print(f"   📄 PDF convertido em {len(results)} fatia(s) / {pages} páginas em "
+          f"{time.perf_counter() - started:.1f}s (soma das fatias: {sum(r['seconds'] for r in results):.1f}s)")
+    print(f"   ⏱️ Páginas mais lentas: {slowest_pages(extracted['page_timings'])}")
+    return extracted
+
+
+def extract_pdf_sharded(shards: list, source, executor) -> dict:
+    """Converte as fatias em paralelo no pool de processos e remonta o markdown na ordem"""
+    started = time.perf_counter()
+    futures = [executor.submit(extract_pdf_shard, data, first_page, pages) for first_page, pages, data in shards]
+    extracted = _merge_pdf_shards([future.result() for future in futures], started)
+    if _needs_document_ocr(extracted):
+        extracted = _apply_document_ocr(extracted, executor.submit(extract_pdf_vlm, source).result())
+    return extracted
+
+
+async def extract_pdf_sharded_async(shards: list, source, executor) -> dict:
+    import asyncio
+
+    started = time.perf_counter()
+    loop = asyncio.get_running_loop()
+    results = await asyncio.gather(*(
+        loop.run_in_executor(executor, extract_pdf_shard, data, first_page, pages)
+        for first_page, pages, data in shards
+    ))
+    extracted = _merge_pdf_shards(list(results), started)
+    if _needs_document_ocr(extracted):
+        ocr = await loop.run_in_executor(executor, extract_pdf_vlm, source)
+        extracted = _apply_document_ocr(extracted, ocr)
+    return extracted
+
+
+_shard_executor = None
+_shard_executor_lock = threading.Lock()
+
+
+def get_shard_executor():
+    """Pool de processos para fatias quando o chamador não tem um (ex.: OpenAIClient.analyze_document)"""
+    global _shard_executor
+    with _shard_executor_lock:
+        if _shard_executor is None:
+            import atexit
+            from concurrent.futures import ProcessPoolExecutor
+
+            _shard_executor = ProcessPoolExecutor(
+                max_workers=settings.PDF_SHARD_PROCESSES or os.cpu_count() or 1,
+                initializer=init_extraction_process,
+                initargs=extraction_initargs(),
+            )
+            atexit.register(_shard_executor.shutdown)
+        return _shard_executor
+
+
+def excel_to_text(data) -> str:
+    """Converte planilha Excel (todas as abas) em texto compacto para o prompt."""
+    print(f"   Processando Excel...")
+    return serialize_excel(data)
+
+
+def extract_file(source, file_extension: str) -> dict:
+    """
+    Ponto de entrada do estágio de extração (roda no ProcessPoolExecutor).
+    source: bytes do arquivo ou caminho (documentos grandes já estão em disco).
+    Retorna {"text": markdown/texto, "ocr": bool, "pool_stats": (pid, stats do pool Docling)};
+    pool_stats é retirado por extract_file_cached antes de gravar no cache.
+    """
+    if file_extension in EXCEL_EXTENSIONS:
+        return {"text": excel_to_text(source), "ocr": False, "pool_stats": _pool_stats()}
+
+    # PDF: bytes vão para o Docling como stream; sem arquivo temporário
+    text, ocr_activated = extract_pdf_markdown(source)
+    return {"text": text, "ocr": ocr_activated, "pool_stats": _pool_stats()}
+
+
+def _as_document(data, file_extension: str) -> DownloadedDocument:
+    if isinstance(data, DownloadedDocument):
+        return data
+    return DownloadedDocument.from_bytes(data, suffix=file_extension)
+
+
+def extract_file_cached(data, file_extension: str, executor=None) -> tuple:
+    """
+    extract_file() com o cache de extração na frente.
+    data: bytes ou DownloadedDocument (download em streaming, hash já calculado).
+    Retorna (resultado, cache_hit). Com executor, a extração roda no pool de processos.
+    """
+    document = _as_document(data, file_extension)
+    cache = get_extraction_cache()
+    key = None
+    if cache is not None:
+        key = cache.make_key(None, pipeline_signature(file_extension), content_hash=document.content_hash())
+        cached = cache.get(key)
+        if cached is not None:
+            print(f"   ♻️ Extração reaproveitada do cache ({key[:12]}...)")
+            return cached, True
+
+    shards = pdf_shards(document.source, file_extension)
+    if shards:
+        extracted = extract_pdf_sharded(shards, document.source, executor or get_shard_executor())
+    elif executor is not None:
+        extracted = executor.submit(extract_file, document.source, file_extension).result()
+    else:
+        extracted = extract_file(document.source, file_extension)
+    _record_pool_stats(extracted)
+
+    if cache is not None:
+        try:
+            cache.put(key, extracted)
+        except Exception as e:
+            print(f"[AVISO] Erro ao gravar cache de extração: {e}")
+    return extracted, False
+
+
+async def extract_file_cached_async(data, file_extension: str, executor) -> tuple:
+    """Versão asyncio de extract_file_cached: a extração roda no executor sem bloquear o loop."""
+    import asyncio
+
+    document = _as_document(data, file_extension)
+    cache = get_extraction_cache()
+    key = None
+    if cache is not None:
+        key = cache.make_key(None, pipeline_signature(file_extension), content_hash=document.content_hash())
+        # Cache em disco (leitura/escrita de arquivo) fora do loop de eventos
+        cached = await asyncio.to_thread(cache.get, key)
+        if cached is not None:
+            print(f"   ♻️ Extração reaproveitada do cache ({key[:12]}...)")
+            return cached, True
+
+    loop = asyncio.get_running_loop()
+    # Dividir o PDF (PyMuPDF) fora do loop de eventos
+    shards = await asyncio.to_thread(pdf_shards, document.source, file_extension)
+    if shards:
+        extracted = await extract_pdf_sharded_async(shards, document.source, executor)
+    else:
+        extracted = await loop.run_in_executor(executor, extract_file, document.source, file_extension)
+    _record_pool_stats(extracted)
+
+    if cache is not None:
+        try:
+            await asyncio.to_thread(cache.put, key, extracted)
+        except Exception as e:
+            print(f"[AVISO] Erro ao gravar cache de extração: {e}")
+    return extracted, False
@@ -0,0 +1,148 @@
+"""
+Cache local (em disco) de extrações PDF/Excel -> markdown.
+
+Chave: SHA-256 dos bytes do arquivo + assinatura do pipeline de extração, então
+o mesmo formulário reenviado (upload ou Salesforce) não passa de novo pelo
+Docling/VLM. Cada entrada é um JSON {"text", "ocr"}; a eviction é LRU pelo
+mtime do arquivo (atualizado a cada hit) até caber em EXTRACTION_CACHE_MAX_MB.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from config import settings
+
+
+class ExtractionCache:
+    def __init__(self, cache_dir: str, max_bytes: int):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._total_bytes = sum(size for _, size, _ in self._entries())
+
+    @staticmethod
+    def make_key(data: bytes, pipeline_signature: str, content_hash=None) -> str:
+        """SHA-256(conteúdo + pipeline). content_hash: sha256 já calculado do conteúdo (download em streaming)"""
+        h = content_hash.copy() if content_hash is not None else hashlib.sha256(data)
+        h.update(b"\0")
+        h.update(pipeline_signature.encode("utf-8"))
+        return h.hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def _entries(self):
+        """(path, tamanho, mtime) de cada entrada do cache"""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((path, st.st_size, st.st_mtime))
+        return entries
+
+    def get(self, key: str):
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                value = json.load(f)
+            os.utime(path, None)  # Marca como usado recentemente (LRU)
+        except ValueError:
+            # Entrada corrompida (JSON/UTF-8 inválido): remove para ser regravada na próxima extração
+            self._discard(path)
+            with self._lock:
+                self.misses += 1
+            return None
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return value
+
+    def put(self, key: str, value: dict):
+        path = self._path(key)
+        payload = json.dumps(value, ensure_ascii=False).encode("utf-8")
+        if len(payload) > self.max_bytes:
+            return
+        # Escrita atômica: outro processo nunca lê um JSON pela metade
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(payload)
+            try:
+                previous_size = os.path.getsize(path)
+            except OSError:
+                previous_size = 0
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        with self._lock:
+            self._total_bytes += len(payload) - previous_size
+            over_limit = self._total_bytes > self.max_bytes
+        if over_limit:
+            self._evict()
+
+    def _discard(self, path: str):
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except OSError:
+            return
+        with self._lock:
+            self._total_bytes -= size
+
+    def _evict(self):
+        """Remove as entradas menos usadas até ficar abaixo de 90% do limite"""
+        with self._lock:
+            entries = sorted(self._entries(), key=lambda e: e[2])
+            total = sum(size for _, size, _ in entries)
+            target = int(self.max_bytes * 0.9)
+            removed = 0
+            for path, size, _ in entries:
+                if total <= target:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                    removed += 1
+                except FileNotFoundError:
+                    pass
+            self._total_bytes = total
+        if removed:
+            print(f"   Cache de extração: {removed} entrada(s) antiga(s) removida(s)")
+
+    def snapshot(self) -> tuple:
+        with self._lock:
+            return self.hits, self.misses
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_extraction_cache():
+    """Cache global do processo, ou None se desativado em settings"""
+    global _cache
+    if not settings.EXTRACTION_CACHE_ENABLED:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ExtractionCache(
+                    settings.EXTRACTION_CACHE_DIR,
+                    settings.EXTRACTION_CACHE_MAX_MB * 1024 * 1024,
+                )
+    return _cache
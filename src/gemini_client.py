@@ -4,6 +4,7 @@ import time
 import os
 import fitz  # PyMuPDF
 from tenacity import retry, stop_after_attempt, wait_exponential
+from llm_cache import get_response_cache
 
 # Configuração Global
 try:
@@ -11,6 +12,9 @@ try:
 except Exception as e:
     print(f"⚠️ Erro ao configurar Gemini API: {e}")
 
+# Parte "system prompt" da chave do cache de respostas: separa as entradas do Gemini das da OpenAI
+CACHE_NAMESPACE = "gemini"
+
 class GeminiClient:
     def __init__(self):
         # Verificar se a API key está configurada
@@ -52,9 +56,7 @@ class GeminiClient:
         # 1. Tentar ler texto para estimar tamanho
         try:
             doc = fitz.open(file_path)
-            text_content = ""
-            for page in doc:
-                text_content += page.get_text()
+            text_content = "".join(page.get_text() for page in doc)
             doc.close()
             # Estimativa grosseira: 1 token ~= 4 caracteres
             token_count = len(text_content) // 4
@@ -71,8 +73,29 @@ class GeminiClient:
             print(f"🐘 [ROTA HEAVY] Arquivo grande ({token_count} tokens). Usando File API...")
             return self._call_gemini_file(file_path, prompt_text)
 
+    def _call_gemini_text(self, text: str, prompt: str, projeto_id=None, use_cache: bool = True) -> str:
+        """Chama o Gemini com o cache de respostas na frente (mesma regra do OpenAIClient)"""
+        cache = get_response_cache()
+        cache_key = None
+        if cache is not None:
+            cache_key = cache.make_key(self.model_name, CACHE_NAMESPACE, prompt, text)
+            if use_cache and not settings.LLM_CACHE_BYPASS:
+                cached = cache.get(cache_key)
+                if cached is not None:
+                    print(f"♻️ Resposta do Gemini reaproveitada do cache ({cache_key[:12]}...)")
+                    return cached
+
+        content = self._generate_text(text, prompt)
+
+        if cache is not None:
+            try:
+                cache.put(cache_key, content, self.model_name, prompt, projeto_id)
+            except Exception as e:
+                print(f"⚠️ Erro ao gravar cache de respostas: {e}")
+        return content
+
     @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10))
-    def _call_gemini_text(self, text: str, prompt: str) -> str:
+    def _generate_text(self, text: str, prompt: str) -> str:
         try:
             response = self.model.generate_content(
                 f"{prompt}\n\nDOCUMENTO:\n{text}",
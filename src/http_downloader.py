@@ -0,0 +1,414 @@
+"""
+Direct-HTTP fast path for Salesforce ZIP downloads.
+
+Most download pages only auto-POST a hidden form (or redirect) to the real file,
+so a pooled requests.Session can follow the flow without a browser:
+page -> auto-submit form / meta refresh / JS location redirect -> ZIP.
+ZipDownloader tries this first and falls back to BrowserDownloader, keeping
+per-host success rates so hosts that always need the browser skip the fast path.
+When the final file URL supports HTTP Range, the ZIP is not downloaded at all:
+HttpRangeFile lets zipfile read the central directory and only the members it opens.
+"""
+
+import io
+import os
+import re
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from html.parser import HTMLParser
+from urllib.parse import urljoin, urlparse
+import requests
+from requests.adapters import HTTPAdapter
+from config import settings
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+ZIP_CONTENT_TYPES = ('application/zip', 'application/x-zip-compressed', 'application/octet-stream')
+JS_REDIRECT_PATTERNS = [
+    re.compile(r"""location\.replace\(\s*['"]([^'"]+)['"]\s*\)"""),
+    re.compile(r"""(?:window\.|document\.)?location(?:\.href)?\s*=\s*['"]([^'"]+)['"]"""),
+]
+
+
+class DirectDownloadError(Exception):
+    """The page needs a real browser (no auto-submit form/redirect found) or did not return a ZIP"""
+
+
+def spooled_file():
+    """Temp file kept in memory up to ZIP_SPOOL_MAX_MB, then rolled over to disk"""
+    return tempfile.SpooledTemporaryFile(max_size=settings.ZIP_SPOOL_MAX_MB * 1024 * 1024)
+
+
+def stream_to_file(chunks, fileobj=None):
+    """Writes an iterator of byte chunks to a spooled temp file (rewound). Memory stays bounded."""
+    fileobj = fileobj or spooled_file()
+    for chunk in chunks:
+        if chunk:
+            fileobj.write(chunk)
+    fileobj.seek(0)
+    return fileobj
+
+
+def copy_to_spooled(path: str):
+    """Copies a file on disk (e.g. a browser download) into a spooled temp file, in chunks"""
+    fileobj = spooled_file()
+    with open(path, 'rb') as f:
+        shutil.copyfileobj(f, fileobj, length=1024 * 1024)
+    fileobj.seek(0)
+    return fileobj
+
+
+def file_size(fileobj) -> int:
+    position = fileobj.tell()
+    fileobj.seek(0, os.SEEK_END)
+    size = fileobj.tell()
+    fileobj.seek(position)
+    return size
+
+
+def zip_signature_error(fileobj):
+    """None if the file starts with the ZIP signature ('PK'), else a preview of its first bytes"""
+    head = fileobj.read(100)
+    fileobj.seek(0)
+    if head[:2] == b'PK':
+        return None
+    return head.decode('utf-8', errors='ignore')
+
+
+class HttpRangeFile(io.RawIOBase):
+    """
+    Read-only seekable file over HTTP Range requests. zipfile only touches the end of
+    central directory, the central directory and the members that are opened, so only
+    those byte ranges are transferred. Reads are aligned to ZIP_RANGE_BLOCK_KB blocks
+    (a few kept cached); larger reads are fetched in a single request.
+    """
+
+    MAX_CACHED_BLOCKS = 8
+
+    def __init__(self, session, url: str, size: int, timeout: float = 60, block_size: int = None):
+        super().__init__()
+        self.session = session
+        self.url = url
+        self.size = size
+        self.timeout = timeout
+        self.block_size = block_size or settings.ZIP_RANGE_BLOCK_KB * 1024
+        self.bytes_fetched = 0
+        self.requests = 0
+        self._pos = 0
+        self._blocks = OrderedDict()
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_SET:
+            position = offset
+        elif whence == os.SEEK_CUR:
+            position = self._pos + offset
+        elif whence == os.SEEK_END:
+            position = self.size + offset
+        else:
+            raise ValueError(f"whence inválido: {whence}")
+        if position < 0:
+            raise ValueError("posição negativa")
+        self._pos = position
+        return position
+
+    def _fetch(self, start: int, end: int) -> bytes:
+        """Bytes [start, end] (inclusive) of the remote file"""
+        resp = self.session.get(
+            self.url, headers={'Range': f'bytes={start}-{end}'}, timeout=(10, max(self.timeout, 300)),
+        )
+        if resp.status_code != 206:
+            raise DirectDownloadError(f"Servidor ignorou o Range (HTTP {resp.status_code})")
+        data = resp.content
+        if len(data) != end - start + 1:
+            raise DirectDownloadError(f"Range incompleto: {len(data)} de {end - start + 1} bytes")
+        self.requests += 1
+        self.bytes_fetched += len(data)
+        return data
+
+    def _block(self, index: int) -> bytes:
+        block = self._blocks.get(index)
+        if block is None:
+            start = index * self.block_size
+            block = self._fetch(start, min(self.size, start + self.block_size) - 1)
+            self._blocks[index] = block
+            if len(self._blocks) > self.MAX_CACHED_BLOCKS:
+                self._blocks.popitem(last=False)
+        else:
+            self._blocks.move_to_end(index)
+        return block
+
+    def readinto(self, buffer):
+        n = min(len(buffer), self.size - self._pos)
+        if n <= 0:
+            return 0
+        out = memoryview(buffer)
+        if n > self.block_size:
+            # Member data: one request for the whole span
+            out[:n] = self._fetch(self._pos, self._pos + n - 1)
+            self._pos += n
+            return n
+        copied = 0
+        while copied < n:
+            index, offset = divmod(self._pos, self.block_size)
+            chunk = self._block(index)[offset:offset + n - copied]
+            out[copied:copied + len(chunk)] = chunk
+            copied += len(chunk)
+            self._pos += len(chunk)
+        return copied
+
+    def close(self):
+        self._blocks.clear()
+        super().close()
+
+    def summary(self) -> str:
+        return (f"{self.bytes_fetched / 1024:.0f} KB de {self.size / (1024 * 1024):.1f} MB "
+                f"em {self.requests} requisições Range")
+
+
+class _PageParser(HTMLParser):
+    """Collects forms (with their fields), meta refresh and inline scripts of a download page"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.forms = []
+        self.meta_refresh = None
+        self.scripts = []
+        self.onload = []
+        self._in_script = False
+        self._form = None
+
+    def handle_starttag(self, tag, attrs):
+        attrs = {k.lower(): (v or '') for k, v in attrs}
+        if tag == 'form':
+            self._form = {
+                'action': attrs.get('action', ''),
+                'method': attrs.get('method', 'get').lower(),
+                'id': attrs.get('id') or attrs.get('name') or '',
+                'fields': {},
+            }
+            self.forms.append(self._form)
+        elif tag in ('input', 'textarea', 'select') and self._form is not None:
+            name = attrs.get('name')
+            if name and attrs.get('type', '').lower() not in ('submit', 'button', 'image', 'reset'):
+                self._form['fields'][name] = attrs.get('value', '')
+        elif tag == 'meta' and attrs.get('http-equiv', '').lower() == 'refresh':
+            match = re.search(r'url\s*=\s*[\'"]?([^\'";]+)', attrs.get('content', ''), re.IGNORECASE)
+            if match:
+                self.meta_refresh = match.group(1).strip()
+        elif tag == 'script':
+            self._in_script = True
+        if tag == 'body' and attrs.get('onload'):
+            self.onload.append(attrs['onload'])
+
+    def handle_endtag(self, tag):
+        if tag == 'form':
+            self._form = None
+        elif tag == 'script':
+            self._in_script = False
+
+    def handle_data(self, data):
+        if self._in_script:
+            self.scripts.append(data)
+
+
+def find_next_step(html: str, base_url: str):
+    """
+    Returns the next request of an auto-download page:
+    ('post'|'get', url, form_fields) or None if the page needs user interaction.
+    """
+    parser = _PageParser()
+    parser.feed(html)
+    script = "\n".join(parser.scripts + parser.onload)
+
+    # Auto-submit form: only submitted when the page itself submits it (no button click)
+    if parser.forms and '.submit()' in script:
+        form = parser.forms[0]
+        for candidate in parser.forms:
+            if candidate['id'] and candidate['id'] in script:
+                form = candidate
+                break
+        action = urljoin(base_url, form['action'] or base_url)
+        return ('post' if form['method'] == 'post' else 'get', action, form['fields'])
+
+    if parser.meta_refresh:
+        return ('get', urljoin(base_url, parser.meta_refresh), None)
+
+    for pattern in JS_REDIRECT_PATTERNS:
+        match = pattern.search(script)
+        if match:
+            return ('get', urljoin(base_url, match.group(1)), None)
+    return None
+
+
+def _supports_range(resp) -> bool:
+    """GET file responses that advertise byte ranges and are big enough to be worth it"""
+    if not settings.ZIP_RANGE_ENABLED or resp.request.method != 'GET':
+        return False
+    if resp.headers.get('accept-ranges', '').lower() != 'bytes':
+        return False
+    if 'content-encoding' in resp.headers:
+        return False
+    size = resp.headers.get('content-length', '')
+    return size.isdigit() and int(size) >= settings.ZIP_RANGE_MIN_MB * 1024 * 1024
+
+
+def _is_file_response(resp) -> bool:
+    content_type = resp.headers.get('content-type', '').split(';')[0].strip().lower()
+    if 'attachment' in resp.headers.get('content-disposition', '').lower():
+        return True
+    return content_type in ZIP_CONTENT_TYPES
+
+
+class DirectDownloader:
+    """Follows the download page flow over plain HTTP with a pooled session"""
+
+    def __init__(self, max_hops: int = None, pool_size: int = None):
+        self.max_hops = max_hops or settings.DIRECT_DOWNLOAD_MAX_HOPS
+        pool_size = pool_size or settings.DIRECT_DOWNLOAD_POOL_SIZE
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers['User-Agent'] = USER_AGENT
+
+    def download_to_file(self, url: str, timeout: float = 60):
+        """Follows the page flow and streams the ZIP into a spooled temp file (caller closes it)"""
+        method, current_url, data = 'get', url, None
+        for _ in range(self.max_hops + 1):
+            resp = self.session.request(
+                method, current_url, data=data,
+                timeout=(10, max(timeout, 300)), stream=True, allow_redirects=True,
+            )
+            try:
+                resp.raise_for_status()
+                if _is_file_response(resp):
+                    if _supports_range(resp):
+                        remote = self._open_remote_zip(resp.url, int(resp.headers['content-length']), timeout)
+                        if remote is not None:
+                            return remote
+                    return self._read_zip(resp)
+                html = resp.text
+                base_url = resp.url
+            finally:
+                resp.close()
+
+            step = find_next_step(html, base_url)
+            if step is None:
+                raise DirectDownloadError("Página exige navegador (nenhum formulário automático ou redirect encontrado)")
+            method, current_url, data = step
+        raise DirectDownloadError(f"Mais de {self.max_hops} redirecionamentos sem chegar ao arquivo")
+
+    def _open_remote_zip(self, url: str, size: int, timeout: float):
+        """HttpRangeFile over the final URL, or None if the server does not honour the Range"""
+        remote = HttpRangeFile(self.session, url, size, timeout=timeout)
+        try:
+            # The tail holds the end of central directory record (22 bytes + comment up to 64 KB):
+            # one read validates Range support and the ZIP at once, and stays cached for zipfile
+            remote.seek(-min(size, 22 + 64 * 1024), os.SEEK_END)
+            if b'PK\x05\x06' not in remote.read():
+                raise DirectDownloadError("Fim do diretório central do ZIP não encontrado")
+            remote.seek(0)
+            return remote
+        except (requests.RequestException, DirectDownloadError) as e:
+            remote.close()
+            print(f"   Range indisponível ({e}); baixando o ZIP inteiro...")
+            return None
+
+    @staticmethod
+    def _read_zip(resp):
+        zip_file = stream_to_file(resp.iter_content(chunk_size=1024 * 1024))
+        # ZIP files start with 'PK' (0x50 0x4B)
+        preview = zip_signature_error(zip_file)
+        if preview is not None:
+            zip_file.close()
+            raise DirectDownloadError(f"Arquivo baixado não é ZIP válido. Primeiros bytes: {preview}")
+        return zip_file
+
+
+class DownloadStats:
+    """Per-host success counters of each download method (direct / browser)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._hosts = {}
+
+    def record(self, host: str, method: str, ok: bool):
+        with self._lock:
+            counters = self._hosts.setdefault(host, {}).setdefault(method, [0, 0])
+            counters[0 if ok else 1] += 1
+
+    def attempts(self, host: str, method: str) -> int:
+        with self._lock:
+            ok, failed = self._hosts.get(host, {}).get(method, [0, 0])
+            return ok + failed
+
+    def success_rate(self, host: str, method: str):
+        with self._lock:
+            ok, failed = self._hosts.get(host, {}).get(method, [0, 0])
+        return ok / (ok + failed) if ok + failed else None
+
+    def summary(self) -> str:
+        with self._lock:
+            parts = []
+            for host, methods in self._hosts.items():
+                rates = ", ".join(
+                    f"{method} {ok}/{ok + failed}" for method, (ok, failed) in sorted(methods.items())
+                )
+                parts.append(f"{host}: {rates}")
+        return "; ".join(parts) or "sem downloads"
+
+
+class ZipDownloader:
+    """
+    Direct HTTP first, browser as fallback. A host whose direct success rate stays
+    below DIRECT_DOWNLOAD_MIN_SUCCESS after DIRECT_DOWNLOAD_MIN_ATTEMPTS goes straight to the browser.
+    """
+
+    def __init__(self, browser_downloader, direct_downloader: DirectDownloader = None, stats: DownloadStats = None):
+        self.browser = browser_downloader
+        self.direct = direct_downloader or DirectDownloader()
+        self.stats = stats or DownloadStats()
+
+    def _direct_worth_trying(self, host: str) -> bool:
+        if not settings.DIRECT_DOWNLOAD_ENABLED:
+            return False
+        if self.stats.attempts(host, 'direct') < settings.DIRECT_DOWNLOAD_MIN_ATTEMPTS:
+            return True
+        return self.stats.success_rate(host, 'direct') >= settings.DIRECT_DOWNLOAD_MIN_SUCCESS
+
+    def download_to_file(self, url: str, timeout_ms: int = 60000):
+        """
+        Returns the ZIP as a spooled temp file (rewound), or an HttpRangeFile when the
+        server supports Range; both are seekable file objects the caller closes.
+        """
+        host = urlparse(url).netloc
+        if self._direct_worth_trying(host):
+            try:
+                zip_file = self.direct.download_to_file(url, timeout=timeout_ms / 1000)
+                self.stats.record(host, 'direct', True)
+                if isinstance(zip_file, HttpRangeFile):
+                    print(f"   ⚡ ZIP remoto lido por HTTP Range ({zip_file.size} bytes)")
+                else:
+                    print(f"   ⚡ ZIP baixado via HTTP direto ({file_size(zip_file)} bytes)")
+                return zip_file
+            except Exception as e:
+                self.stats.record(host, 'direct', False)
+                print(f"   HTTP direto falhou ({e}); usando navegador...")
+
+        try:
+            zip_file = self.browser.download_to_file(url, timeout_ms=timeout_ms)
+        except Exception:
+            self.stats.record(host, 'browser', False)
+            raise
+        self.stats.record(host, 'browser', True)
+        return zip_file
@@ -0,0 +1,130 @@
+"""
+Acorda os loops do worker/pipeline quando chega trabalho novo (LISTEN/NOTIFY).
+
+Os triggers de sql/migrations/add_notify_triggers.sql fazem pg_notify nos canais
+'processar_agora' e 'casos_processamento' a cada insert. Uma thread mantém uma
+conexão direta com o Postgres (DATABASE_URL) escutando esses canais e sinaliza
+quem estiver esperando em wait(); o polling continua como fallback lento.
+
+Dependência opcional: psycopg (3.2+). Sem DATABASE_URL ou sem psycopg, wait()
+apenas dorme o timeout (comportamento de polling anterior).
+
+Obs.: use a conexão direta ou o pooler em modo "session" do Supabase;
+o modo "transaction" não suporta LISTEN.
+"""
+
+import asyncio
+import threading
+import time
+from config import settings
+
+CHANNEL_PROCESSAR_AGORA = "processar_agora"
+CHANNEL_CASOS = "casos_processamento"
+
+
+class JobNotifier:
+    def __init__(self, dsn: str, channels: list):
+        self.dsn = dsn
+        self.channels = list(channels)
+        self._events = {channel: threading.Event() for channel in self.channels}
+        self._stop = threading.Event()
+        self._thread = None
+        self.enabled = False
+        self.connected = False
+        self.notifications = 0
+
+    def start(self) -> bool:
+        """Inicia a thread de LISTEN. Retorna False se ficar no modo polling."""
+        if not self.dsn:
+            return False
+        try:
+            import psycopg  # noqa: F401
+        except ImportError:
+            print("[AVISO] DATABASE_URL configurada mas psycopg não instalado; usando polling (pip install 'psycopg[binary]')")
+            return False
+        self.enabled = True
+        self._thread = threading.Thread(target=self._run, name="job-notifier", daemon=True)
+        self._thread.start()
+        return True
+
+    def stop(self):
+        self._stop.set()
+        for event in self._events.values():
+            event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def _signal_all(self):
+        for event in self._events.values():
+            event.set()
+
+    def _run(self):
+        import psycopg
+        from psycopg import sql
+
+        backoff = 1
+        while not self._stop.is_set():
+            try:
+                with psycopg.connect(self.dsn, autocommit=True, connect_timeout=10) as conn:
+                    for channel in self.channels:
+                        conn.execute(sql.SQL("LISTEN {}").format(sql.Identifier(channel)))
+                    self.connected = True
+                    backoff = 1
+                    print(f"[OK] LISTEN ativo: {', '.join(self.channels)}")
+                    # Notificações perdidas enquanto estava desconectado: força um poll
+                    self._signal_all()
+                    while not self._stop.is_set():
+                        for notify in conn.notifies(timeout=1.0):
+                            event = self._events.get(notify.channel)
+                            if event is not None:
+                                self.notifications += 1
+                                event.set()
+            except Exception as e:
+                if self._stop.is_set():
+                    break
+                print(f"[AVISO] LISTEN/NOTIFY desconectado ({e}); reconectando em {backoff}s (polling continua)")
+            finally:
+                self.connected = False
+            self._stop.wait(backoff)
+            backoff = min(backoff * 2, 60)
+
+    def wait(self, channel: str, timeout: float) -> bool:
+        """Bloqueia até chegar notificação no canal ou o timeout. True se foi notificado."""
+        event = self._events[channel]
+        notified = event.wait(timeout)
+        event.clear()
+        return notified
+
+    async def wait_async(self, channel: str, timeout: float) -> bool:
+        """Versão asyncio de wait(): verifica o sinal a cada 50ms sem bloquear o loop"""
+        event = self._events[channel]
+        deadline = time.monotonic() + timeout
+        while not event.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            await asyncio.sleep(min(0.05, remaining))
+        event.clear()
+        return True
+
+    def idle_seconds(self, polling_seconds: float) -> float:
+        """
+        Espera quando não há trabalho: fallback lento com LISTEN conectado, polling
+        normal sem ele (inclusive enquanto a thread tenta reconectar)
+        """
+        return settings.JOB_POLL_FALLBACK_SECONDS if self.connected else polling_seconds
+
+
+_notifier = None
+_notifier_lock = threading.Lock()
+
+
+def get_job_notifier() -> JobNotifier:
+    """Notifier global do processo (worker e pipeline_manager compartilham a conexão)"""
+    global _notifier
+    if _notifier is None:
+        with _notifier_lock:
+            if _notifier is None:
+                _notifier = JobNotifier(settings.DATABASE_URL, [CHANNEL_PROCESSAR_AGORA, CHANNEL_CASOS])
+                _notifier.start()
+    return _notifier
@@ -0,0 +1,154 @@
+"""
+Cache persistente (SQLite) de respostas da IA.
+
+As chamadas rodam com temperature=0.0 e JSON forçado, então o mesmo
+(modelo, system prompt, prompt do projeto, texto do documento) produz a mesma
+resposta. Reprocessar um projeto sem mudar o prompt não precisa pagar de novo.
+
+- TTL: entradas mais antigas que LLM_CACHE_TTL_HOURS são ignoradas/removidas
+- Invalidação por projeto: quando o prompt do projeto muda, as respostas
+  geradas com o prompt antigo são apagadas (sync_project_prompt)
+- Bypass: LLM_CACHE_BYPASS no .env ou use_cache=False por chamada
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from config import settings
+
+
+def hash_text(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, path: str, ttl_seconds: int):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS llm_responses (
+                    cache_key TEXT PRIMARY KEY,
+                    projeto_id TEXT,
+                    prompt_hash TEXT NOT NULL,
+                    model TEXT NOT NULL,
+                    response TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                )
+            """)
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_llm_responses_projeto ON llm_responses(projeto_id)"
+            )
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS project_prompts (
+                    projeto_id TEXT PRIMARY KEY,
+                    prompt_hash TEXT NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+            self._conn.commit()
+
+    @staticmethod
+    def make_key(model: str, system_prompt: str, prompt: str, text: str) -> str:
+        h = hashlib.sha256()
+        for part in (model, system_prompt, prompt, text):
+            h.update(part.encode("utf-8"))
+            h.update(b"\0")
+        return h.hexdigest()
+
+    def get(self, key: str):
+        min_created = time.time() - self.ttl_seconds
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response FROM llm_responses WHERE cache_key = ? AND created_at >= ?",
+                (key, min_created),
+            ).fetchone()
+            if row:
+                self.hits += 1
+                return row[0]
+            self.misses += 1
+            return None
+
+    def put(self, key: str, response: str, model: str, prompt: str, projeto_id=None):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_responses "
+                "(cache_key, projeto_id, prompt_hash, model, response, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, str(projeto_id) if projeto_id else None, hash_text(prompt), model, response, time.time()),
+            )
+            self._conn.commit()
+
+    def sync_project_prompt(self, projeto_id, prompt: str) -> int:
+        """
+        Registra o prompt atual do projeto. Se mudou desde a última vez,
+        apaga as respostas geradas com prompts antigos. Retorna quantas foram removidas.
+        """
+        projeto_key = str(projeto_id) if projeto_id else ""
+        prompt_hash = hash_text(prompt)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT prompt_hash FROM project_prompts WHERE projeto_id = ?", (projeto_key,)
+            ).fetchone()
+            if row and row[0] == prompt_hash:
+                return 0
+            removed = 0
+            if row:
+                cur = self._conn.execute(
+                    "DELETE FROM llm_responses WHERE COALESCE(projeto_id, '') = ? AND prompt_hash != ?",
+                    (projeto_key, prompt_hash),
+                )
+                removed = cur.rowcount
+            self._conn.execute(
+                "INSERT OR REPLACE INTO project_prompts (projeto_id, prompt_hash, updated_at) VALUES (?, ?, ?)",
+                (projeto_key, prompt_hash, time.time()),
+            )
+            self._conn.commit()
+        if removed:
+            print(f"   Prompt do projeto {projeto_key or 'legado'} mudou: {removed} resposta(s) em cache invalidada(s)")
+        return removed
+
+    def invalidate_project(self, projeto_id) -> int:
+        projeto_key = str(projeto_id) if projeto_id else ""
+        with self._lock:
+            cur = self._conn.execute(
+                "DELETE FROM llm_responses WHERE COALESCE(projeto_id, '') = ?", (projeto_key,)
+            )
+            self._conn.commit()
+            return cur.rowcount
+
+    def purge_expired(self) -> int:
+        with self._lock:
+            cur = self._conn.execute(
+                "DELETE FROM llm_responses WHERE created_at < ?", (time.time() - self.ttl_seconds,)
+            )
+            self._conn.commit()
+            return cur.rowcount
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache():
+    """Cache global do processo, ou None se desativado em settings"""
+    global _cache
+    if not settings.LLM_CACHE_ENABLED:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ResponseCache(settings.LLM_CACHE_PATH, settings.LLM_CACHE_TTL_HOURS * 3600)
+                removed = _cache.purge_expired()
+                if removed:
+                    print(f"   Cache de respostas: {removed} entrada(s) expirada(s) removida(s)")
+    return _cache
@@ -1,7 +1,34 @@
 import openai
 from config import settings
+from extraction import extract_file_cached
 # import fitz  # PyMuPDF (Removed)
 from tenacity import retry, stop_after_attempt, wait_exponential
+from llm_cache import get_response_cache
+from rate_limiter import get_rate_limiter
+from token_utils import count_message_tokens
+
+_backoff = wait_exponential(multiplier=1, min=2, max=10)
+
+
+def wait_between_attempts(retry_state) -> float:
+    """
+    Espera do tenacity entre tentativas: depois de um 429 a próxima tentativa espera
+    no limitador (ajustado pelos headers de reset); outros erros usam backoff exponencial.
+    """
+    error = retry_state.outcome.exception()
+    if isinstance(getattr(error, "__cause__", None), openai.RateLimitError):
+        return 0.0
+    return _backoff(retry_state)
+
+
+SYSTEM_PROMPT = """Você é um assistente jurídico especializado em análise de documentos. 
+
+REGRAS ESTRITAS:
+1. Responda estritamente em JSON.
+2. Extraia APENAS informações que estão EXPLICITAMENTE presentes no documento.
+3. NUNCA invente, deduza, ou presuma informações.
+4. Se uma informação não estiver no documento, deixe o campo em branco ("" ou null).
+5. Seja literal - copie exatamente o que está escrito, não interprete."""
 
 class OpenAIClient:
     def __init__(self):
@@ -10,6 +37,8 @@ class OpenAIClient:
         
         self.client = openai.OpenAI(api_key=settings.OPENAI_API_KEY)
         self.model_name = settings.MODEL_OPENAI
+        self._async_client = None
+        self.rate_limiter = get_rate_limiter(self.model_name)
         print(f"[OK] Cliente OpenAI inicializado: {self.model_name}")
 
     def analyze_document(self, file_path: str, prompt_text: str) -> str:
@@ -19,173 +48,139 @@ class OpenAIClient:
         OCR: Usa APENAS OpenAI Vision (gpt-4o), não usa OCR local.
         """
         
-        # 1. Extrair texto estruturado do PDF com Docling
-        text_content = None
-        ocr_activated = False
-        
-        try:
-            print(f"   🚀 Iniciando conversão padrão com Docling (SEM OCR local): {file_path}")
-            from docling.document_converter import DocumentConverter, PdfFormatOption
-            from docling.datamodel.base_models import InputFormat
-            from docling.datamodel.pipeline_options import PdfPipelineOptions, VlmPipelineOptions, ApiVlmOptions
-            
-            # Tentativa 1: Conversão Padrão SEM OCR (Rápida/Local)
-            try:
-                # Configurar para NÃO usar OCR local
-                pipeline_options_no_ocr = PdfPipelineOptions()
-                pipeline_options_no_ocr.do_ocr = False  # Desabilitar OCR local
-                
-                converter = DocumentConverter(
-                    format_options={
-                        InputFormat.PDF: PdfFormatOption(pipeline_options=pipeline_options_no_ocr)
-                    }
-                )
-                result = converter.convert(file_path)
-                text_content = result.document.export_to_markdown()
-            except Exception as extraction_error:
-                print(f"   ⚠️ Erro na extração padrão: {extraction_error}")
-                print("   🔄 Ativando OpenAI Vision devido ao erro...")
-                ocr_activated = True
-            
-            # Validação: Se não há texto suficiente OU houve erro, tentar OCR via OpenAI (VLM)
-            if ocr_activated or (text_content and len(text_content.strip()) < 50):
-                if not ocr_activated:
-                    print("   [AVISO] Texto insuficiente (< 50 chars). Ativando OpenAI Vision...")
-                
-                # Configurar Pipeline VLM com OpenAI (DESABILITA OCR LOCAL!)
-                pipeline_options = PdfPipelineOptions()
-                pipeline_options.do_ocr = False  # Não usar OCR local (RapidOCR)
-                pipeline_options.do_table_structure = True
-                pipeline_options.table_structure_options.do_cell_matching = True
-                
-                # Configurar VLM para usar OpenAI gpt-4o
-                pipeline_options.vlm_options = VlmPipelineOptions(
-                    api_options=ApiVlmOptions(
-                        api_key=settings.OPENAI_API_KEY,
-                        model="gpt-4o",
-                        prompt="Extract all text from this document.",
-                        response_format="markdown"
-                    )
-                )
-                
-                # Re-instanciar conversor com opções VLM
-                converter_vlm = DocumentConverter(
-                    format_options={
-                        InputFormat.PDF: PdfFormatOption(pipeline_options=pipeline_options)
-                    }
-                )
-                
-                print(f"   👁️ Iniciando OCR com OpenAI Vision (gpt-4o)...")
-                result_vlm = converter_vlm.convert(file_path)
-                text_content = result_vlm.document.export_to_markdown()
-                print("   ✅ OCR com OpenAI Vision concluído.")
-
-            # Estimativa básica de tokens
-            token_est = len(text_content) // 4
-            print(f"   📄 Markdown extraído: {token_est} tokens (aprox.)")
-            
-            # DEBUG CRÍTICO
-            print("\n   🔍 --- INÍCIO DO MARKDOWN EXTRAÍDO (DEBUG) ---")
-            print(text_content[:600])
-            print("   🔍 --- FIM DO DEBUG ---\n")
-                
-        except Exception as e:
-            print(f"[ERRO] Falha na extração com Docling (incluindo OCR): {e}")
-            raise ValueError(f"Erro ao processar PDF com Docling: {e}")
+        # 1. Extrair texto estruturado do PDF com Docling (pool de conversores + cache;
+        #    PDFs grandes são convertidos em fatias de páginas em paralelo)
+        with open(file_path, "rb") as f:
+            extracted, _ = extract_file_cached(f.read(), ".pdf")
+        text_content = extracted["text"]
 
         # 2. Enviar para OpenAI
         json_resp = self._call_openai(text_content, prompt_text)
         return json_resp, text_content
 
-    @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=2, max=10))
-    def _call_openai(self, text: str, prompt: str) -> str:
-        try:
-            response = self.client.chat.completions.create(
-                model=self.model_name,
-                messages=[
-                    {
-                        "role": "system", 
-                        "content": """Você é um assistente jurídico especializado em análise de documentos. 
+    def build_messages(self, text: str, prompt: str) -> list:
+        """Mensagens enviadas ao chat completions (system + prompt do projeto + documento)"""
+        return [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": f"{prompt}\n\nDOCUMENTO:\n{text}"}
+        ]
 
-REGRAS ESTRITAS:
-1. Responda estritamente em JSON.
-2. Extraia APENAS informações que estão EXPLICITAMENTE presentes no documento.
-3. NUNCA invente, deduza, ou presuma informações.
-4. Se uma informação não estiver no documento, deixe o campo em branco ("" ou null).
-5. Seja literal - copie exatamente o que está escrito, não interprete."""
-                    },
-                    {"role": "user", "content": f"{prompt}\n\nDOCUMENTO:\n{text}"}
-                ],
-                response_format={"type": "json_object"},
-                temperature=0.0  # Zero temperature for maximum determinism
+    def build_request_body(self, messages: list) -> dict:
+        """Corpo do chat completions (usado nas chamadas diretas e nas linhas da Batch API)"""
+        return {
+            "model": self.model_name,
+            "messages": messages,
+            "response_format": {"type": "json_object"},
+            "temperature": 0.0  # Zero temperature for maximum determinism
+        }
+
+    def _call_openai(self, text: str, prompt: str, projeto_id=None, use_cache: bool = True) -> str:
+        """
+        Chama a OpenAI com o cache de respostas na frente.
+        use_cache=False (ou LLM_CACHE_BYPASS) força nova chamada e sobrescreve o cache.
+        """
+        cache = get_response_cache()
+        cache_key = None
+        if cache is not None:
+            cache_key = cache.make_key(self.model_name, SYSTEM_PROMPT, prompt, text)
+            if use_cache and not settings.LLM_CACHE_BYPASS:
+                cached = cache.get(cache_key)
+                if cached is not None:
+                    print(f"   ♻️ Resposta da IA reaproveitada do cache ({cache_key[:12]}...)")
+                    return cached
+
+        content = self._request_completion(self.build_messages(text, prompt))
+
+        if cache is not None:
+            try:
+                cache.put(cache_key, content, self.model_name, prompt, projeto_id)
+            except Exception as e:
+                print(f"[AVISO] Erro ao gravar cache de respostas: {e}")
+        return content
+
+    async def _call_openai_async(self, text: str, prompt: str, projeto_id=None, use_cache: bool = True) -> str:
+        """
+        Versão asyncio de _call_openai (mesmo cache, cliente AsyncOpenAI).
+        O cache é SQLite (bloqueante): get/put rodam em thread, fora do loop de eventos.
+        """
+        import asyncio
+
+        cache = get_response_cache()
+        cache_key = None
+        if cache is not None:
+            cache_key = cache.make_key(self.model_name, SYSTEM_PROMPT, prompt, text)
+            if use_cache and not settings.LLM_CACHE_BYPASS:
+                cached = await asyncio.to_thread(cache.get, cache_key)
+                if cached is not None:
+                    print(f"   ♻️ Resposta da IA reaproveitada do cache ({cache_key[:12]}...)")
+                    return cached
+
+        content = await self._request_completion_async(self.build_messages(text, prompt))
+
+        if cache is not None:
+            try:
+                await asyncio.to_thread(cache.put, cache_key, content, self.model_name, prompt, projeto_id)
+            except Exception as e:
+                print(f"[AVISO] Erro ao gravar cache de respostas: {e}")
+        return content
+
+    @property
+    def async_client(self):
+        """Cliente AsyncOpenAI criado sob demanda (modo asyncio do worker)"""
+        if self._async_client is None:
+            self._async_client = openai.AsyncOpenAI(api_key=settings.OPENAI_API_KEY)
+        return self._async_client
+
+    @retry(stop=stop_after_attempt(3), wait=wait_between_attempts)
+    async def _request_completion_async(self, messages: list) -> str:
+        tokens = self._estimate_request_tokens(messages)
+        await self.rate_limiter.acquire_async(tokens)
+        try:
+            raw = await self.async_client.chat.completions.with_raw_response.create(
+                **self.build_request_body(messages)
             )
-            
-            content = response.choices[0].message.content
-            if not content:
-                raise ValueError("Resposta vazia da OpenAI")
-            
-            return content
-            
         except Exception as e:
-            # Tratamento básico de erros
-            raise ValueError(f"Erro na OpenAI API: {e}")
+            self._handle_request_error(e, tokens)
+            raise ValueError(f"Erro na OpenAI API: {e}") from e
+        self.rate_limiter.update_from_headers(raw.headers)
+        return self._response_content(raw)
+
+    def _estimate_request_tokens(self, messages: list) -> int:
+        """Tokens de entrada (tiktoken) + saída esperada, como a OpenAI contabiliza no TPM"""
+        return count_message_tokens(messages, self.model_name) + settings.OPENAI_EXPECTED_OUTPUT_TOKENS
 
-    def extract_text_with_vision(self, pdf_path: str) -> str:
+    def _handle_request_error(self, error: Exception, tokens: int):
         """
-        Extract text from PDF using OpenAI Vision API directly (gpt-4o-mini).
-        Converts PDF first page to image since Vision API only accepts images.
-        Returns plain text without JSON formatting.
+        A API não processou a chamada: devolve a reserva ao limitador (a nova tentativa
+        reserva de novo). 429: o limitador passa a seguir os headers de saldo/reset.
         """
+        self.rate_limiter.refund(tokens)
+        if not isinstance(error, openai.RateLimitError):
+            return
+        headers = getattr(getattr(error, "response", None), "headers", None) or {}
+        pause = self.rate_limiter.on_rate_limited(headers)
+        print(f"   [AVISO] Rate limit (429) da OpenAI. Saldo ajustado pelos headers (reset em {pause:.1f}s)")
+
+    @staticmethod
+    def _response_content(raw) -> str:
+        response = raw.parse()
+        content = response.choices[0].message.content
+        if not content:
+            raise ValueError("Resposta vazia da OpenAI")
+        return content
+
+    @retry(stop=stop_after_attempt(3), wait=wait_between_attempts)
+    def _request_completion(self, messages: list) -> str:
+        # Reserva saldo no limitador antes de chamar (evita 429 em picos); devolvida se a chamada falhar
+        tokens = self._estimate_request_tokens(messages)
+        self.rate_limiter.acquire(tokens)
         try:
-            import base64
-            import fitz  # PyMuPDF
-            import io
-            from PIL import Image
-            
-            # Convert first page of PDF to image
-            print(f"   🖼️ [DEBUG] Convertendo PDF para imagem...")
-            doc = fitz.open(pdf_path)
-            if len(doc) < 1:
-                raise ValueError("PDF vazio ou sem páginas")
-            
-            # Render first page to pixmap (image)
-            page = doc[0]
-            pix = page.get_pixmap(matrix=fitz.Matrix(2, 2))  # 2x resolution for better OCR
-            
-            # Convert pixmap to PNG bytes
-            img_bytes = pix.pil_tobytes(format="PNG")
-            
-            # Convert to base64
-            img_base64 = base64.b64encode(img_bytes).decode('utf-8')
-            print(f"   ✅ [DEBUG] Imagem criada: {len(img_base64)} chars base64")
-            
-            # Use Vision API with image input
-            response = self.client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[
-                    {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "text",
-                                "text": "Extraia TODO o texto desta imagem. Retorne APENAS o texto bruto, exatamente como aparece, sem formatação adicional."
-                            },
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": f"data:image/png;base64,{img_base64}"
-                                }
-                            }
-                        ]
-                    }
-                ],
-                max_tokens=4000,
-                temperature=0.0
+            raw = self.client.chat.completions.with_raw_response.create(
+                **self.build_request_body(messages)
             )
-            
-            extracted_text = response.choices[0].message.content
-            return extracted_text if extracted_text else ""
-            
         except Exception as e:
-            print(f"   ❌ [DEBUG] Erro na extração Vision API: {type(e).__name__}: {e}")
-            raise ValueError(f"Erro ao extrair texto com Vision API: {e}")
+            self._handle_request_error(e, tokens)
+            # Tratamento básico de erros
+            raise ValueError(f"Erro na OpenAI API: {e}") from e
+        self.rate_limiter.update_from_headers(raw.headers)
+        return self._response_content(raw)
@@ -1,23 +1,77 @@
 import time
 import threading
-from concurrent.futures import ThreadPoolExecutor
-from supabase import create_client
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from supabase_pool import get_supabase_client
 from config import settings
 from salesforce_client import SalesforceClient
-from zip_processor import ZipProcessor
+from zip_processor import ZipProcessor, CaseZipScan, ALREADY_FOUND
+from job_notifier import get_job_notifier, CHANNEL_CASOS
 
 # Globals
 supabase = None
 sf_client = None
 zip_processor = None
 semaphore = None
+download_semaphore = None
 
-def process_case_task(case_record):
+# Casos já entregues ao executor (ainda PENDENTE no banco até process_case_task marcar)
+_dispatched_cases = set()
+_dispatched_lock = threading.Lock()
+
+
+def process_zip_task(case_number, zip_url, case_id, projeto_id, scan):
+    """
+    Processa um ZIP do caso respeitando o limite global de downloads. Se outro ZIP do
+    caso já registrou o formulário (antes ou durante a espera pelo limite), nem baixa:
+    a tarefa pode ter começado antes de process_case_task cancelar as pendentes.
     """
-    1. Fetch URL from Salesforce
+    skipped = {"success": False, "skipped": True, "error": ALREADY_FOUND}
+    if scan.done:
+        return skipped
+    with download_semaphore:
+        if scan.done:
+            return skipped
+        return zip_processor.process_zip_url(case_number, zip_url, case_id, projeto_id=projeto_id, scan=scan)
+
+
+def reserve_dispatch(cases: list) -> list:
+    """Casos ainda não entregues ao executor (os demais já estão na fila de um poll anterior)"""
+    with _dispatched_lock:
+        new_cases = [case for case in cases if case['id'] not in _dispatched_cases]
+        _dispatched_cases.update(case['id'] for case in new_cases)
+    return new_cases
+
+
+def dispatch_cases(cases: list, executor):
+    """
+    Resolve os ZIPs dos casos em lote e entrega a cada process_case_task a sua lista
+    (ou o erro da consulta). Roda fora do loop de polling: uma consulta lenta ao
+    Salesforce não atrasa a busca de novos casos.
+    """
+    try:
+        lookups = sf_client.get_many_case_zip_urls([case['numero_caso'] for case in cases])
+        for case in cases:
+            executor.submit(process_case_task, case, lookups.get(case['numero_caso']))
+    except Exception as e:
+        print(f"[AVISO] Erro ao despachar casos: {e}")
+        with _dispatched_lock:
+            _dispatched_cases.difference_update(case['id'] for case in cases)
+
+
+def process_case_task(case_record, zip_urls=None):
+    """
+    1. Fetch URL from Salesforce (zip_urls: lista já resolvida em lote, ou o erro da consulta)
     2. Process ZIP
     3. Update Status
     """
+    try:
+        _process_case(case_record, zip_urls)
+    finally:
+        with _dispatched_lock:
+            _dispatched_cases.discard(case_record['id'])
+
+
+def _process_case(case_record, zip_urls=None):
     case_id = case_record['id']
     case_number = case_record['numero_caso']
     
@@ -35,9 +89,12 @@ def process_case_task(case_record):
                 print(f"   Caso {case_number} ja esta sendo processado por outra thread, pulando.")
                 return
             
-            # 1. Fetch ALL ZIP URLs
-            print(f"   Buscando caso {case_number} na API...")
-            zip_urls = sf_client.get_case_zip_urls(case_number)
+            # 1. Fetch ALL ZIP URLs (já resolvidas em lote por dispatch_cases, quando possível)
+            if isinstance(zip_urls, Exception):
+                raise zip_urls
+            if zip_urls is None:
+                print(f"   Buscando caso {case_number} na API...")
+                zip_urls = sf_client.get_case_zip_urls(case_number)
             
             if not zip_urls:
                 print(f"   [AVISO] Nenhum ZIP encontrado para caso {case_number}.")
@@ -53,49 +110,63 @@ def process_case_task(case_record):
             # Use dedicated Salesforce project ID if none provided
             projeto_id = case_record.get('projeto_id') or settings.SALESFORCE_PROJECT_ID
             
-            # 2. Process each ZIP
+            # 2. Process the case ZIPs in parallel (per-case limit + global download limit)
             total_processed = 0
             total_failed = 0
             total_skipped = 0
             errors = []
             
-            for idx, zip_url in enumerate(zip_urls, 1):
-                try:
-                    print(f"\n   === Processando ZIP {idx}/{len(zip_urls)} ===")
-                    print(f"   URL: {zip_url[:50]}...")
-                    
-                    # Update DB status
-                    supabase.table(settings.TABLE_CASOS).update({
-                        "zip_url": zip_url,
-                        "status": "PROCESSA_ZIP"
-                    }).eq("id", case_id).execute()
-                    
-                    result = zip_processor.process_zip_url(
-                        case_number,
-                        zip_url,
-                        case_id,
-                        projeto_id=projeto_id
-                    )
-                    
-                    if result['success']:
-                        print(f"   [OK] ZIP {idx} processado com sucesso!")
-                        total_processed += 1
-                    else:
+            supabase.table(settings.TABLE_CASOS).update({
+                "zip_url": zip_urls[0],
+                "status": "PROCESSA_ZIP"
+            }).eq("id", case_id).execute()
+            
+            # O primeiro ZIP com formulário válido registrado encerra os demais
+            scan = CaseZipScan()
+            max_workers = min(settings.CASE_ZIP_CONCURRENCY, len(zip_urls))
+            with ThreadPoolExecutor(max_workers=max_workers) as zip_executor:
+                futures = {}
+                for idx, zip_url in enumerate(zip_urls, 1):
+                    print(f"   ZIP {idx}/{len(zip_urls)}: {zip_url[:50]}...")
+                    future = zip_executor.submit(process_zip_task, case_number, zip_url, case_id, projeto_id, scan)
+                    futures[future] = idx
+                
+                for future in as_completed(futures):
+                    idx = futures[future]
+                    if future.cancelled():
+                        total_skipped += 1
+                        continue
+                    try:
+                        result = future.result()
+                        
+                        if result['success']:
+                            print(f"   [OK] ZIP {idx} processado com sucesso!")
+                            total_processed += 1
+                            # Formulário registrado: ZIPs ainda não iniciados não precisam rodar
+                            for pending in futures:
+                                pending.cancel()
+                            continue
+                        
                         error_msg = result.get('error', 'Erro desconhecido')
                         
                         # Distinguish between real errors and "no files found" warnings
-                        if "Nenhum arquivo" in error_msg and ("ANALISE" in error_msg or "PDF ou Excel" in error_msg):
+                        if result.get('skipped'):
+                            print(f"   ZIP {idx}: {error_msg}")
+                            total_skipped += 1
+                        elif "Nenhum arquivo" in error_msg and ("ANALISE" in error_msg or "PDF ou Excel" in error_msg):
                             print(f"   [AVISO] ZIP {idx}: {error_msg}")
                             total_skipped += 1
                         else:
                             print(f"   [ERRO] ZIP {idx} falhou: {error_msg}")
                             total_failed += 1
                             errors.append(f"ZIP {idx}: {error_msg}")
-                        
-                except Exception as zip_error:
-                    print(f"[ERRO] Erro processando ZIP {idx}: {zip_error}")
-                    total_failed += 1
-                    errors.append(f"ZIP {idx}: {str(zip_error)}")
+                            
+                    except Exception as zip_error:
+                        print(f"[ERRO] Erro processando ZIP {idx}: {zip_error}")
+                        total_failed += 1
+                        errors.append(f"ZIP {idx}: {str(zip_error)}")
+            
+            print(f"   Downloads por host: {zip_processor.zip_downloader.stats.summary()}")
             
             # 3. Update final status
             if total_failed == 0:
@@ -157,10 +228,10 @@ def process_case_task(case_record):
                 print(f"   [OK] Status de erro registrado.")
 
 def main_loop():
-    global supabase, sf_client, zip_processor, semaphore
+    global supabase, sf_client, zip_processor, semaphore, download_semaphore
     
     # Initialize
-    supabase = create_client(settings.SUPABASE_URL, settings.SUPABASE_KEY)
+    supabase = get_supabase_client()
     sf_client = SalesforceClient()
     zip_processor = ZipProcessor()
     
@@ -168,16 +239,20 @@ def main_loop():
     # 5-10 is reasonable.
     start_workers = 5 
     semaphore = threading.Semaphore(start_workers)
+    download_semaphore = threading.BoundedSemaphore(settings.ZIP_DOWNLOAD_CONCURRENCY)
     executor = ThreadPoolExecutor(max_workers=start_workers)
+    # Consulta em lote ao Salesforce fora do loop de polling
+    lookup_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sf-lookup")
     
     print(f"[OK] Pipeline Salesforce Iniciado! ({start_workers} threads)")
     
     # Iniciar Worker de Análise em paralelo
     import worker
     print("Iniciando Worker de Analise (AI) em background...")
-    ai_thread = threading.Thread(target=worker.main_loop, daemon=True)
+    ai_thread = threading.Thread(target=worker.run, daemon=True)
     ai_thread.start()
     
+    notifier = get_job_notifier()
     print(f"   Aguardando casos na tabela '{settings.TABLE_CASOS}'...")
 
     while True:
@@ -192,17 +267,20 @@ def main_loop():
             cases = response.data if response.data else []
             
             if not cases:
-                time.sleep(5)
+                # Aguarda o NOTIFY de caso novo/PENDENTE (ou o próximo poll)
+                notifier.wait(CHANNEL_CASOS, notifier.idle_seconds(5))
                 continue
             
-            print(f"Encontrados {len(cases)} casos pendentes.")
-            for case in cases:
-                executor.submit(process_case_task, case)
+            new_cases = reserve_dispatch(cases)
+            if new_cases:
+                print(f"Encontrados {len(new_cases)} casos pendentes.")
+                lookup_executor.submit(dispatch_cases, new_cases, executor)
             
             time.sleep(2)
             
         except KeyboardInterrupt:
             print("\nPipeline interrompido.")
+            lookup_executor.shutdown(wait=True)
             executor.shutdown(wait=True)
             break
         except Exception as e:
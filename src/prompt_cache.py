@@ -0,0 +1,158 @@
+"""
+Cache em memória do prompt de cada projeto.
+
+Um disparo costuma trazer centenas de arquivos do mesmo projeto; carregar o
+prompt do Supabase e extrair as chaves do schema a cada arquivo é trabalho
+repetido. Cada entrada guarda o texto do prompt, o prompt final (com as regras
+de extração) e a lista de chaves do schema.
+
+Invalidação: a cada PROMPT_CACHE_CHECK_SECONDS consulta apenas
+prompt_config.updated_at (o frontend atualiza a coluna a cada salvamento);
+o prompt completo só é recarregado quando a versão muda.
+"""
+
+import asyncio
+import threading
+import time
+from config import settings
+
+
+class ProjectPrompt:
+    """Prompt de um projeto já processado (texto, prompt final e chaves do schema)"""
+
+    def __init__(self, prompt_text: str, prompt_final: str, schema_keys: list, version):
+        self.prompt_text = prompt_text
+        self.prompt_final = prompt_final
+        self.schema_keys = schema_keys
+        self.version = version
+        self.checked_at = time.monotonic()
+
+
+class PromptCache:
+    def __init__(self, compose, parse_keys, on_change=None, check_seconds: float = None):
+        """
+        compose(prompt_text) -> prompt final; parse_keys(prompt_text) -> chaves do schema;
+        on_change(projeto_id, prompt_final) é chamado quando o prompt de um projeto muda.
+        """
+        self.compose = compose
+        self.parse_keys = parse_keys
+        self.on_change = on_change
+        self.check_seconds = settings.PROMPT_CACHE_CHECK_SECONDS if check_seconds is None else check_seconds
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._project_locks = {}
+        self._async_locks = {}
+        self.loads = 0
+
+    @staticmethod
+    def _key(projeto_id) -> str:
+        return str(projeto_id) if projeto_id else ""
+
+    def _fresh(self, key: str):
+        entry = self._entries.get(key)
+        if entry is not None and time.monotonic() - entry.checked_at < self.check_seconds:
+            return entry
+        return None
+
+    def _store(self, key: str, projeto_id, prompt_text, version):
+        if not prompt_text:
+            self._entries.pop(key, None)
+            return None
+        previous = self._entries.get(key)
+        if previous is not None and previous.prompt_text == prompt_text:
+            # Salvo de novo sem mudanças: só atualiza a versão
+            previous.version = version
+            previous.checked_at = time.monotonic()
+            return previous
+        entry = ProjectPrompt(prompt_text, self.compose(prompt_text), self.parse_keys(prompt_text), version)
+        self._entries[key] = entry
+        self.loads += 1
+        if self.on_change is not None:
+            try:
+                self.on_change(projeto_id, entry.prompt_final)
+            except Exception as e:
+                print(f"[AVISO] Erro ao sincronizar prompt do projeto {key or 'legado'}: {e}")
+        return entry
+
+    @staticmethod
+    def _last_good(key: str, entry, error: Exception):
+        """Falha ao recarregar o prompt: mantém o último válido (nova tentativa após check_seconds)"""
+        if entry is None:
+            raise error
+        print(f"[AVISO] Erro ao recarregar prompt do projeto {key or 'legado'}, usando o último válido: {error}")
+        entry.checked_at = time.monotonic()
+        return entry
+
+    def _lock_for(self, key: str) -> threading.Lock:
+        with self._lock:
+            lock = self._project_locks.get(key)
+            if lock is None:
+                lock = self._project_locks[key] = threading.Lock()
+            return lock
+
+    def get(self, projeto_id, fetch_version, fetch_prompt):
+        """
+        Retorna o ProjectPrompt do projeto (ou None se não houver prompt configurado).
+        fetch_version() -> versão atual; fetch_prompt() -> (prompt_text, versão).
+        """
+        key = self._key(projeto_id)
+        entry = self._fresh(key)
+        if entry is not None:
+            return entry
+        with self._lock_for(key):
+            entry = self._fresh(key)  # Outra thread pode ter acabado de verificar
+            if entry is not None:
+                return entry
+            entry = self._entries.get(key)
+            if entry is not None:
+                try:
+                    version = fetch_version()
+                except Exception as e:
+                    print(f"[AVISO] Erro ao verificar versão do prompt: {e}")
+                    version = entry.version
+                if version == entry.version:
+                    entry.checked_at = time.monotonic()
+                    return entry
+            try:
+                prompt_text, version = fetch_prompt()
+            except Exception as e:
+                return self._last_good(key, entry, e)
+            return self._store(key, projeto_id, prompt_text, version)
+
+    async def get_async(self, projeto_id, fetch_version, fetch_prompt):
+        """Versão asyncio de get(): fetch_version/fetch_prompt são funções assíncronas"""
+        key = self._key(projeto_id)
+        entry = self._fresh(key)
+        if entry is not None:
+            return entry
+        lock = self._async_locks.get(key)
+        if lock is None:
+            lock = self._async_locks[key] = asyncio.Lock()
+        async with lock:
+            entry = self._fresh(key)
+            if entry is not None:
+                return entry
+            entry = self._entries.get(key)
+            if entry is not None:
+                try:
+                    version = await fetch_version()
+                except Exception as e:
+                    print(f"[AVISO] Erro ao verificar versão do prompt: {e}")
+                    version = entry.version
+                if version == entry.version:
+                    entry.checked_at = time.monotonic()
+                    return entry
+            try:
+                prompt_text, version = await fetch_prompt()
+            except Exception as e:
+                return self._last_good(key, entry, e)
+            return self._store(key, projeto_id, prompt_text, version)
+
+    def invalidate(self, projeto_id):
+        """Descarta o prompt de um projeto (recarregado no próximo uso)"""
+        with self._lock:
+            self._entries.pop(self._key(projeto_id), None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
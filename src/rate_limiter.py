@@ -0,0 +1,201 @@
+"""
+Limitador adaptativo de requisições à OpenAI (token bucket).
+
+Dois baldes por modelo: requisições/minuto e tokens/minuto. Cada chamada
+reserva 1 requisição + os tokens estimados localmente (tiktoken + saída
+esperada) ANTES de ir para a API; se não houver saldo, a thread espera o
+reabastecimento em vez de tomar um 429.
+
+Os limites reais vêm dos headers x-ratelimit-* de cada resposta, então os
+valores do .env são só o ponto de partida. Uma chamada que falha devolve a
+reserva (refund), então as novas tentativas não cobram os tokens de novo. Um
+429 ajusta os baldes pelos headers x-ratelimit-remaining/reset-* (o balde
+volta a encher no tempo informado pela API) e retry-after pausa todas as
+chamadas do modelo.
+"""
+
+import asyncio
+import re
+import threading
+import time
+from config import settings
+
+_DURATION_RE = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_UNIT_SECONDS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+def parse_reset_duration(value) -> float:
+    """Converte '6m0s', '1s', '20ms' (formato dos headers x-ratelimit-reset-*) em segundos"""
+    if value is None:
+        return 0.0
+    value = str(value).strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    return sum(float(n) * _UNIT_SECONDS[u] for n, u in _DURATION_RE.findall(value))
+
+
+class _Bucket:
+    def __init__(self, limit_per_minute: float):
+        self.limit = float(limit_per_minute)
+        self.available = float(limit_per_minute)
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        rate = self.limit / 60.0
+        self.available = min(self.limit, self.available + (now - self.updated) * rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        # Pedido maior que a capacidade do balde: espera encher por completo
+        amount = min(amount, self.limit)
+        if self.available >= amount:
+            return 0.0
+        return (amount - self.available) / (self.limit / 60.0)
+
+
+class RateLimiter:
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int):
+        self.requests = _Bucket(requests_per_minute)
+        self.tokens = _Bucket(tokens_per_minute)
+        self.blocked_until = 0.0
+        self.throttled_seconds = 0.0
+        self.throttled_calls = 0
+        self._lock = threading.Lock()
+
+    def _try_acquire(self, tokens: int) -> float:
+        """Reserva se houver saldo; senão retorna quanto esperar (segundos)"""
+        with self._lock:
+            now = time.monotonic()
+            if now < self.blocked_until:
+                return self.blocked_until - now
+            self.requests.refill(now)
+            self.tokens.refill(now)
+            wait = max(self.requests.wait_time(1), self.tokens.wait_time(tokens))
+            if wait <= 0:
+                self.requests.available -= 1
+                self.tokens.available -= min(tokens, self.tokens.limit)
+            return wait
+
+    def acquire(self, tokens: int):
+        """Bloqueia a thread até haver saldo para 1 requisição + tokens"""
+        waited = 0.0
+        while True:
+            wait = self._try_acquire(tokens)
+            if wait <= 0:
+                break
+            wait = min(wait, 5.0)
+            time.sleep(wait)
+            waited += wait
+        self._record_wait(waited)
+
+    async def acquire_async(self, tokens: int):
+        """Versão asyncio de acquire (não bloqueia o event loop)"""
+        waited = 0.0
+        while True:
+            wait = self._try_acquire(tokens)
+            if wait <= 0:
+                break
+            wait = min(wait, 5.0)
+            await asyncio.sleep(wait)
+            waited += wait
+        self._record_wait(waited)
+
+    def _record_wait(self, waited: float):
+        if waited > 0:
+            with self._lock:
+                self.throttled_calls += 1
+                self.throttled_seconds += waited
+
+    def update_from_headers(self, headers):
+        """Ajusta limites e saldo com os headers x-ratelimit-* da resposta"""
+        if not headers:
+            return
+        with self._lock:
+            now = time.monotonic()
+            for bucket, kind in ((self.requests, "requests"), (self.tokens, "tokens")):
+                limit = headers.get(f"x-ratelimit-limit-{kind}")
+                remaining = headers.get(f"x-ratelimit-remaining-{kind}")
+                try:
+                    if limit is not None:
+                        bucket.refill(now)
+                        bucket.limit = float(limit)
+                    if remaining is not None:
+                        # A API é a fonte da verdade: nunca acreditar em mais saldo do que ela informa
+                        bucket.refill(now)
+                        bucket.available = min(bucket.available, float(remaining))
+                except ValueError:
+                    continue
+
+    def refund(self, tokens: int):
+        """Chamada falhou sem ser processada: devolve 1 requisição + tokens reservados em acquire"""
+        with self._lock:
+            now = time.monotonic()
+            self.requests.refill(now)
+            self.tokens.refill(now)
+            self.requests.available = min(self.requests.limit, self.requests.available + 1)
+            self.tokens.available = min(self.tokens.limit, self.tokens.available + min(tokens, self.tokens.limit))
+
+    def on_rate_limited(self, headers) -> float:
+        """
+        Recebeu 429: saldo e limites pelos headers x-ratelimit-*; cada balde com
+        x-ratelimit-reset-* fica cheio só depois desse tempo; retry-after pausa
+        todas as chamadas. Sem nenhum header, pausa 1s. Retorna a pausa estimada (segundos).
+        """
+        headers = headers or {}
+        self.update_from_headers(headers)
+        retry_after = parse_reset_duration(headers.get("retry-after"))
+        with self._lock:
+            now = time.monotonic()
+            pause = retry_after
+            for bucket, kind in ((self.requests, "requests"), (self.tokens, "tokens")):
+                reset = parse_reset_duration(headers.get(f"x-ratelimit-reset-{kind}"))
+                if reset <= 0:
+                    continue
+                bucket.refill(now)
+                # Reabastecimento linear: cheio de novo exatamente em `reset` segundos
+                # (prevalece sobre x-ratelimit-remaining, que no 429 costuma vir 0)
+                bucket.available = bucket.limit - reset * bucket.limit / 60.0
+                pause = max(pause, reset)
+            if pause <= 0:
+                retry_after = pause = 1.0
+            if retry_after > 0:
+                self.blocked_until = max(self.blocked_until, now + retry_after)
+        return pause
+
+    def headroom(self) -> dict:
+        """Saldo atual dos baldes (métrica)"""
+        with self._lock:
+            now = time.monotonic()
+            self.requests.refill(now)
+            self.tokens.refill(now)
+            return {
+                "requests_available": int(self.requests.available),
+                "requests_limit": int(self.requests.limit),
+                "tokens_available": int(self.tokens.available),
+                "tokens_limit": int(self.tokens.limit),
+                "requests_pct": round(100 * self.requests.available / self.requests.limit, 1) if self.requests.limit else 0.0,
+                "tokens_pct": round(100 * self.tokens.available / self.tokens.limit, 1) if self.tokens.limit else 0.0,
+                "throttled_calls": self.throttled_calls,
+                "throttled_seconds": round(self.throttled_seconds, 1),
+                "blocked": now < self.blocked_until,
+            }
+
+    def format_headroom(self) -> str:
+        h = self.headroom()
+        return (f"RPM {h['requests_available']}/{h['requests_limit']} ({h['requests_pct']}%) | "
+                f"TPM {h['tokens_available']}/{h['tokens_limit']} ({h['tokens_pct']}%) | "
+                f"esperas: {h['throttled_calls']} ({h['throttled_seconds']}s)")
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(model: str) -> RateLimiter:
+    """Limitador compartilhado por modelo (limites da OpenAI são por modelo)"""
+    with _limiters_lock:
+        if model not in _limiters:
+            _limiters[model] = RateLimiter(settings.OPENAI_RPM_LIMIT, settings.OPENAI_TPM_LIMIT)
+        return _limiters[model]
@@ -0,0 +1,162 @@
+"""
+Seleção por relevância do texto enviado à IA.
+
+Documentos longos iam inteiros para o _call_openai, mas as chaves do schema do
+prompt costumam estar em poucas páginas. Aqui o markdown é dividido em trechos
+(seções por título, limitados a LLM_PRUNE_CHUNK_TOKENS), cada trecho recebe uma
+nota BM25 contra os termos das chaves do schema e só os melhores trechos, até
+LLM_PRUNE_MAX_TOKENS, vão para a IA (na ordem original do documento).
+
+Sempre entram: o início do documento (cabeçalho com número do processo e partes)
+e os trechos com as âncoras do regex fix. Quando a confiança é baixa (poucas
+chaves aparecem no documento ou na seleção), o documento vai inteiro.
+"""
+
+import math
+import re
+import unicodedata
+from collections import Counter
+from token_utils import count_tokens, count_tokens_batch
+
+OMITTED_MARKER = "[... trechos omitidos ...]"
+
+# Parâmetros do BM25 (valores usuais)
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+STOPWORDS = {
+    "a", "o", "as", "os", "de", "da", "do", "das", "dos", "e", "em", "no", "na", "nos", "nas",
+    "um", "uma", "para", "por", "com", "se", "que", "ao", "aos", "ou", "the", "of",
+}
+
+_WORD = re.compile(r"\w+")
+_BLANK_LINES = re.compile(r"\n\s*\n")
+
+
+def normalize_terms(text: str) -> list:
+    """Termos em minúsculas, sem acento, sem stopwords e sem plural simples ('processos' -> 'processo')"""
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    terms = []
+    for word in _WORD.findall(text.replace("_", " ")):
+        if len(word) < 2 or word in STOPWORDS:
+            continue
+        if len(word) > 4 and word.endswith("s"):
+            word = word[:-1]
+        terms.append(word)
+    return terms
+
+
+def key_terms(schema_keys: list) -> list:
+    """Termos de cada chave do schema ('numero_processo' -> {'numero', 'processo'}); ignora chaves sem termos"""
+    return [terms for terms in (set(normalize_terms(key)) for key in schema_keys) if terms]
+
+
+def split_sections(text: str, chunk_tokens: int) -> list:
+    """
+    Divide o markdown em trechos [(texto, tokens)]: cada título começa um trecho novo
+    e parágrafos são agrupados até chunk_tokens.
+    """
+    blocks = [b.strip() for b in _BLANK_LINES.split(text) if b.strip()]
+    if not blocks:
+        return []
+    sections = []
+    current, current_tokens = [], 0
+    for block, tokens in zip(blocks, count_tokens_batch(blocks)):
+        starts_section = block.startswith("#")
+        if current and (starts_section or current_tokens + tokens > chunk_tokens):
+            sections.append(("\n\n".join(current), current_tokens))
+            current, current_tokens = [], 0
+        current.append(block)
+        current_tokens += tokens
+    sections.append(("\n\n".join(current), current_tokens))
+    return sections
+
+
+def bm25_scores(documents: list, query: set) -> list:
+    """Nota BM25 de cada documento (lista de termos) para o conjunto de termos da consulta"""
+    total = len(documents)
+    average_length = sum(len(d) for d in documents) / total or 1
+    frequencies = [Counter(d) for d in documents]
+    idf = {}
+    for term in query:
+        containing = sum(1 for f in frequencies if term in f)
+        idf[term] = math.log(1 + (total - containing + 0.5) / (containing + 0.5))
+    scores = []
+    for doc, freq in zip(documents, frequencies):
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * len(doc) / average_length)
+        scores.append(sum(
+            idf[term] * freq[term] * (BM25_K1 + 1) / (freq[term] + norm)
+            for term in query if term in freq
+        ))
+    return scores
+
+
+def prune_document(text: str, schema_keys: list, anchors=(), max_tokens: int = 8000,
+                   min_tokens: int = 12000, chunk_tokens: int = 400, min_coverage: float = 0.6) -> tuple:
+    """
+    Texto para a IA: os trechos mais relevantes para as chaves do schema, até max_tokens.
+    anchors: regexes cujos trechos sempre entram (ex.: rótulos lidos pelo regex fix).
+    Retorna (texto, info); info["pruned"] é False quando o documento vai inteiro (info["reason"]).
+    """
+    total_tokens = count_tokens(text)
+    info = {"pruned": False, "tokens": total_tokens, "total_tokens": total_tokens}
+    if total_tokens <= min_tokens:
+        info["reason"] = "documento pequeno"
+        return text, info
+
+    keys = key_terms(schema_keys or [])
+    if not keys:
+        info["reason"] = "sem chaves no schema"
+        return text, info
+
+    sections = split_sections(text, chunk_tokens)
+    section_terms = [set(normalize_terms(section)) for section, _ in sections]
+
+    # Confiança 1: o vocabulário do schema aparece no documento?
+    document_terms = set().union(*section_terms)
+    present = [terms for terms in keys if terms & document_terms]
+    if not present or len(present) < min_coverage * len(keys):
+        info["reason"] = f"só {len(present)}/{len(keys)} chaves aparecem no documento"
+        return text, info
+
+    query = set().union(*keys)
+    scores = bm25_scores([normalize_terms(section) for section, _ in sections], query)
+    anchor_patterns = [re.compile(anchor, re.IGNORECASE) for anchor in anchors]
+    required = {0} | {
+        index for index, (section, _) in enumerate(sections)
+        if any(pattern.search(section) for pattern in anchor_patterns)
+    }
+
+    selected, used = set(), 0
+    ranked = sorted(required) + sorted(
+        (i for i in range(len(sections)) if i not in required and scores[i] > 0),
+        key=lambda i: scores[i], reverse=True,
+    )
+    for index in ranked:
+        tokens = sections[index][1]
+        if used + tokens > max_tokens and index not in required:
+            continue
+        selected.add(index)
+        used += tokens
+
+    # Confiança 2: as chaves presentes no documento continuam presentes na seleção?
+    selected_terms = set().union(*(section_terms[i] for i in selected))
+    covered = sum(1 for terms in present if terms & selected_terms)
+    coverage = covered / len(present)
+    info["coverage"] = coverage
+    if coverage < min_coverage:
+        info["reason"] = f"cobertura baixa ({covered}/{len(present)} chaves)"
+        return text, info
+
+    parts, previous = [], -1
+    for index in sorted(selected):
+        if index != previous + 1:
+            parts.append(OMITTED_MARKER)
+        parts.append(sections[index][0])
+        previous = index
+    if previous != len(sections) - 1:
+        parts.append(OMITTED_MARKER)
+
+    info.update(pruned=True, tokens=used, sections=len(selected), total_sections=len(sections))
+    return "\n\n".join(parts), info
@@ -0,0 +1,196 @@
+"""
+Exportação local incremental dos resultados (CSV ou Parquet).
+
+Substitui o antigo save_to_csv, que reabria o arquivo e relia o cabeçalho a cada
+linha e, quando surgia uma chave nova, gravava linhas com um cabeçalho diferente
+do que estava no arquivo. Aqui:
+- as linhas achatadas ficam em buffer e são gravadas em lote (tamanho ou tempo);
+- o exportador mantém a união das colunas, na ordem do cabeçalho existente (colunas
+  novas no fim); o CSV só é reescrito (com o cabeçalho novo) quando o schema cresce,
+  senão as linhas são apenas acrescentadas;
+- Parquet grava um arquivo part-*.parquet por lote, sempre com todas as colunas
+  conhecidas (texto), de modo que o part mais recente tem o schema completo;
+- add/flush são seguros com várias threads gravando ao mesmo tempo.
+"""
+
+import atexit
+import csv
+import os
+import tempfile
+import threading
+import time
+from config import settings
+
+FORMATS = ("csv", "parquet")
+
+
+def flatten_dict(d: dict, parent_key: str = '', sep: str = '_') -> dict:
+    """
+    Achata um dicionário aninhado para formato CSV
+    Ex: {"partes": {"autor": "João"}} -> {"partes_autor": "João"}
+    """
+    items = []
+    for k, v in d.items():
+        new_key = f"{parent_key}{sep}{k}" if parent_key else k
+        if isinstance(v, dict):
+            items.extend(flatten_dict(v, new_key, sep=sep).items())
+        elif isinstance(v, list):
+            # Se for lista, converter para string separada por vírgula
+            items.append((new_key, ', '.join(str(item) for item in v) if v else ''))
+        else:
+            items.append((new_key, v))
+    return dict(items)
+
+
+class ResultExporter:
+    """Buffer de linhas achatadas + gravação em lote, append-only enquanto o schema não cresce"""
+
+    def __init__(self, path: str, fmt: str = "csv", batch_size: int = 50, flush_seconds: float = 10):
+        if fmt not in FORMATS:
+            raise ValueError(f"Formato de exportação inválido: {fmt} (use {' ou '.join(FORMATS)})")
+        self.fmt = fmt
+        self.path = path
+        self.batch_size = max(1, batch_size)
+        self.flush_seconds = flush_seconds
+        self.rows_written = 0
+        self.rewrites = 0
+        self._buffer = []
+        self._lock = threading.Lock()  # buffer
+        self._write_lock = threading.Lock()  # arquivo + colunas
+        self._columns = self._existing_columns()
+        self._parts = 0
+        self._closed = False
+        self._timer = None
+
+    def _existing_columns(self) -> list:
+        """Cabeçalho do CSV já existente (lido uma única vez, no início)"""
+        if self.fmt != "csv" or not os.path.exists(self.path):
+            return []
+        try:
+            with open(self.path, 'r', encoding='utf-8-sig', newline='') as f:
+                return next(csv.reader(f), [])
+        except Exception:
+            return []
+
+    @property
+    def columns(self) -> list:
+        with self._write_lock:
+            return list(self._columns)
+
+    def add(self, data: dict):
+        """Achata e enfileira um resultado; grava quando o lote enche"""
+        flat_data = flatten_dict(data)
+        # Garantir que arquivo_original sempre existe
+        flat_data.setdefault('arquivo_original', 'N/A')
+        with self._lock:
+            self._buffer.append(flat_data)
+            full = len(self._buffer) >= self.batch_size
+            self._start_timer()
+        if full:
+            self.flush()
+
+    def _start_timer(self):
+        # Linhas esparsas não ficam presas no buffer: flush periódico em segundo plano
+        if self._timer is None and self.flush_seconds > 0:
+            self._timer = threading.Thread(target=self._flush_periodically, name="result-exporter", daemon=True)
+            self._timer.start()
+
+    def _flush_periodically(self):
+        while not self._closed:
+            time.sleep(self.flush_seconds)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"[AVISO] Erro ao exportar resultados: {e}")
+
+    def flush(self) -> int:
+        """Grava as linhas em buffer. Retorna quantas foram gravadas."""
+        with self._write_lock:
+            with self._lock:
+                rows, self._buffer = self._buffer, []
+            if not rows:
+                return 0
+            new_columns = {key for row in rows for key in row} - set(self._columns)
+            # Ordem do cabeçalho existente preservada (append-only); colunas novas vão para o fim
+            columns = self._columns + sorted(new_columns)
+            if self.fmt == "csv":
+                self._write_csv(rows, columns, schema_grew=bool(new_columns))
+            else:
+                self._write_parquet(rows, columns)
+            self._columns = columns
+            self.rows_written += len(rows)
+        print(f"   Exportados {len(rows)} resultado(s) em: {self.path} ({len(columns)} colunas)")
+        return len(rows)
+
+    def _write_csv(self, rows: list, columns: list, schema_grew: bool):
+        if not schema_grew or not self._columns or not os.path.exists(self.path):
+            exists = os.path.exists(self.path) and os.path.getsize(self.path) > 0
+            with open(self.path, 'a', newline='', encoding='utf-8-sig') as f:
+                writer = csv.DictWriter(f, fieldnames=columns, restval='')
+                if not exists:
+                    writer.writeheader()
+                writer.writerows(rows)
+            return
+
+        # Schema cresceu: reescreve o arquivo com o cabeçalho novo (linhas antigas com vazio nas colunas novas)
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(prefix=".resultados-", suffix=".csv", dir=directory)
+        try:
+            with os.fdopen(fd, 'w', newline='', encoding='utf-8-sig') as out, \
+                    open(self.path, 'r', encoding='utf-8-sig', newline='') as src:
+                writer = csv.DictWriter(out, fieldnames=columns, restval='')
+                writer.writeheader()
+                writer.writerows(csv.DictReader(src))
+                writer.writerows(rows)
+            os.replace(tmp_path, self.path)
+            self.rewrites += 1
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def _write_parquet(self, rows: list, columns: list):
+        import pandas as pd
+
+        os.makedirs(self.path, exist_ok=True)
+        self._parts += 1
+        frame = pd.DataFrame.from_records(rows, columns=columns).astype("string")
+        part = os.path.join(self.path, f"part-{int(time.time() * 1000)}-{os.getpid()}-{self._parts:05d}.parquet")
+        frame.to_parquet(part, index=False)
+
+    def close(self):
+        """Grava o que restou no buffer (chamado no encerramento do processo)"""
+        self._closed = True
+        try:
+            self.flush()
+        except Exception as e:
+            print(f"[AVISO] Erro ao exportar resultados: {e}")
+
+
+_exporter = None
+_exporter_lock = threading.Lock()
+
+
+def get_result_exporter():
+    """Exportador global do processo, ou None se a exportação local estiver desativada"""
+    global _exporter
+    fmt = (settings.RESULT_EXPORT_FORMAT or "").lower()
+    if not fmt:
+        return None
+    if _exporter is None:
+        with _exporter_lock:
+            if _exporter is None:
+                if fmt == "parquet":
+                    try:
+                        import pyarrow  # noqa: F401
+                    except ImportError:
+                        print("[AVISO] pyarrow não instalado: exportando resultados em CSV")
+                        fmt = "csv"
+                path = settings.RESULT_EXPORT_PATH + (".csv" if fmt == "csv" else "_parquet")
+                _exporter = ResultExporter(
+                    path, fmt,
+                    batch_size=settings.RESULT_EXPORT_BATCH_SIZE,
+                    flush_seconds=settings.RESULT_EXPORT_FLUSH_SECONDS,
+                )
+                atexit.register(_exporter.close)
+    return _exporter
@@ -0,0 +1,133 @@
+"""
+Gravação em lote dos resultados concluídos no Supabase.
+
+Cada documento concluído custava três round-trips (insert em resultados_analise,
+remove no Storage e delete em documento_gerenciamento). O ResultSink junta os
+resultados e, a cada RESULT_SINK_BATCH_SIZE documentos ou RESULT_SINK_FLUSH_MS,
+faz UM insert multi-linha, UMA remoção em lote no Storage e UM delete `id IN (...)`.
+Falhas do lote caem para o caminho por documento (insert) ou para o status
+CONCLUIDO (delete), como no save_result original.
+"""
+
+import threading
+import time
+
+TABLE_RESULTADOS = 'resultados_analise'
+BUCKET = 'processos'
+
+
+class ResultSink:
+    """Fila de resultados concluídos + thread que grava em lote"""
+
+    def __init__(self, client, table_gerenciamento: str, batch_size: int = 50, flush_ms: int = 500, on_done=None):
+        self.client = client
+        self.table_gerenciamento = table_gerenciamento
+        self.batch_size = max(1, batch_size)
+        self.flush_seconds = flush_ms / 1000
+        # Chamado por documento depois do flush (ex.: liberar a reserva)
+        self.on_done = on_done
+        self.flushes = 0
+        self.documents = 0
+        self.requests = 0  # Requisições enviadas ao Supabase (inclui as dos fallbacks)
+        self._items = []
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="result-sink", daemon=True)
+        self._thread.start()
+
+    def submit(self, record: dict, data_analise: dict):
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("ResultSink encerrado")
+            self._items.append((time.monotonic(), record, data_analise))
+            # Primeiro item inicia a contagem de flush_ms; lote cheio grava na hora
+            if len(self._items) == 1 or len(self._items) >= self.batch_size:
+                self._cond.notify()
+
+    @property
+    def pending(self) -> int:
+        with self._cond:
+            return len(self._items)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._items and not self._closed:
+                    self._cond.wait()
+                if not self._items:
+                    return
+                # Espera o lote encher ou o item mais antigo completar flush_ms
+                deadline = self._items[0][0] + self.flush_seconds
+                while len(self._items) < self.batch_size and not self._closed:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch = self._items[:self.batch_size]
+                del self._items[:self.batch_size]
+            try:
+                self._flush([(record, data) for _, record, data in batch])
+            except Exception as e:
+                print(f"[ERRO] Falha ao gravar lote de resultados: {e}")
+
+    def _flush(self, batch: list):
+        # 1. Um insert multi-linha (mesmas chaves em todas as linhas, exigência do PostgREST)
+        payloads = [
+            {'arquivo_original': record['filename'], 'dados_json': data, 'projeto_id': record.get('projeto_id')}
+            for record, data in batch
+        ]
+        requests = 1
+        try:
+            self.client.table(TABLE_RESULTADOS).insert(payloads).execute()
+        except Exception as db_error:
+            print(f"[AVISO] Insert em lote falhou ({db_error}); gravando resultado por resultado")
+            for payload in payloads:
+                requests += 1
+                try:
+                    self.client.table(TABLE_RESULTADOS).insert(payload).execute()
+                except Exception as row_error:
+                    print(f"[AVISO] Erro ao salvar no Supabase ({payload['arquivo_original']}): {row_error}")
+
+        # 2. Uma remoção em lote no Storage
+        paths = [record['storage_path'] for record, _ in batch if record.get('storage_path')]
+        if paths:
+            requests += 1
+            try:
+                self.client.storage.from_(BUCKET).remove(paths)
+            except Exception as delete_error:
+                print(f"[AVISO] Erro ao remover do bucket (confira RLS DELETE em storage.objects): {delete_error}")
+
+        # 3. Um delete id IN (...) na fila; fallback: marcar como CONCLUIDO
+        ids = [record['id'] for record, _ in batch]
+        requests += 1
+        try:
+            self.client.table(self.table_gerenciamento).delete().in_("id", ids).execute()
+        except Exception as db_del_error:
+            requests += 1
+            try:
+                self.client.table(self.table_gerenciamento).update(
+                    {"status": "CONCLUIDO", "completed_at": "now()"}
+                ).in_("id", ids).execute()
+                print(f"   [AVISO] Delete da fila falhou; status atualizado para CONCLUIDO: {db_del_error}")
+            except Exception as update_error:
+                print(f"[AVISO] Erro ao atualizar/remover da fila: {update_error}")
+
+        self.flushes += 1
+        self.documents += len(batch)
+        self.requests += requests
+        print(f"   Lote gravado: {len(batch)} resultado(s) em {requests} requisição(ões) ({self.documents} no total)")
+        if self.on_done is None:
+            return
+        # Um on_done com erro não pode deixar os demais documentos reservados
+        for record, _ in batch:
+            try:
+                self.on_done(record)
+            except Exception as e:
+                print(f"[AVISO] Erro ao finalizar {record.get('filename', record.get('id'))}: {e}")
+
+    def close(self, timeout: float = 30):
+        """Grava o que está na fila e encerra a thread"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
@@ -1,5 +1,8 @@
 import requests
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 from config import settings
 
 class SalesforceClient:
@@ -8,22 +11,83 @@ class SalesforceClient:
         self.base_url = settings.SALESFORCE_API_URL
         if not self.api_key:
             raise ValueError("Salesforce API Key not configured!")
+        
+        # Keep-alive session: one TLS handshake per pooled connection, not per case
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=settings.SALESFORCE_POOL_SIZE)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({
+            "x-api-key": self.api_key,
+            "Accept": "application/json"
+        })
+        
+        # case_number -> (expires_at, zip_urls or exception): ZIP listings for SALESFORCE_CACHE_TTL_SECONDS,
+        # API errors for SALESFORCE_ERROR_CACHE_SECONDS; empty listings are not cached (may be transient)
+        self._cache = {}
+        self._cache_lock = threading.Lock()
 
     def get_case_zip_urls(self, case_number: str) -> list:
         """
-        Fetches ALL ZIP URLs for a given case number.
+        Fetches ALL ZIP URLs for a given case number (cached for SALESFORCE_CACHE_TTL_SECONDS).
         Returns empty list if none found.
-        Raises specific errors for other issues.
+        Raises specific errors for other issues (the same error is re-raised for
+        SALESFORCE_ERROR_CACHE_SECONDS without calling the API again).
         """
+        with self._cache_lock:
+            cached = self._cache.get(case_number)
+            if cached and cached[0] > time.monotonic():
+                if isinstance(cached[1], Exception):
+                    print(f"   Caso {case_number}: erro recente da API em cache ({cached[1]})")
+                    raise cached[1]
+                print(f"   Caso {case_number} em cache ({len(cached[1])} ZIP(s))")
+                return list(cached[1])
+            self._cache.pop(case_number, None)
+        
+        try:
+            zip_urls = self._fetch_case_zip_urls(case_number)
+        except Exception as e:
+            self._remember(case_number, e, settings.SALESFORCE_ERROR_CACHE_SECONDS)
+            raise
+        if zip_urls:
+            self._remember(case_number, list(zip_urls), settings.SALESFORCE_CACHE_TTL_SECONDS)
+        return zip_urls
+
+    def _remember(self, case_number: str, value, ttl_seconds: float):
+        if ttl_seconds > 0:
+            with self._cache_lock:
+                self._cache[case_number] = (time.monotonic() + ttl_seconds, value)
+
+    def get_many_case_zip_urls(self, case_numbers, max_workers: int = None) -> dict:
+        """
+        Resolves many cases concurrently (at most SALESFORCE_LOOKUP_CONCURRENCY requests at once).
+        Returns {case_number: zip_urls or the exception raised for that case}; results land in the cache.
+        """
+        case_numbers = list(dict.fromkeys(case_numbers))
+        if not case_numbers:
+            return {}
+        max_workers = min(max_workers or settings.SALESFORCE_LOOKUP_CONCURRENCY, len(case_numbers))
+        
+        def lookup(case_number):
+            try:
+                return self.get_case_zip_urls(case_number)
+            except Exception as e:
+                return e
+        
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return dict(zip(case_numbers, executor.map(lookup, case_numbers)))
+
+    def clear_cache(self):
+        with self._cache_lock:
+            self._cache.clear()
+
+    def _fetch_case_zip_urls(self, case_number: str) -> list:
+        """Calls the API (no cache)"""
         url = self.base_url.format(case_number=case_number)
-        headers = {
-            "x-api-key": self.api_key,
-            "Accept": "application/json"
-        }
         
         try:
             print(f"   Buscando caso {case_number} na API...")
-            response = requests.get(url, headers=headers, timeout=15)
+            response = self.session.get(url, timeout=15)
             
             if response.status_code == 200:
                 data = response.json()
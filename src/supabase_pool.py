@@ -0,0 +1,217 @@
+"""
+Fábrica única de clientes Supabase com pool HTTP compartilhado e métricas de latência.
+
+Todos os clientes (chave anon e service role) usam o MESMO httpx.Client, com pool de
+conexões de tamanho explícito, keep-alive e timeouts. O supabase-py envia URL e
+chaves a cada requisição, então compartilhar o pool entre chaves é seguro.
+O transporte mede cada round-trip (até o corpo ser lido) e agrupa por alvo
+(tabela, rpc ou bucket) e operação, em histogramas de latência:
+    documento_gerenciamento select: n=120 p50≤25ms p95≤100ms max=180ms total=4.2s
+"""
+
+import bisect
+import threading
+import time
+from urllib.parse import urlparse, quote
+import httpx
+from config import settings
+
+# Limites superiores dos buckets do histograma (ms)
+BUCKETS_MS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, float("inf"))
+
+REST_OPERATIONS = {"GET": "select", "HEAD": "count", "POST": "insert", "PATCH": "update", "DELETE": "delete"}
+STORAGE_OPERATIONS = {"GET": "download", "HEAD": "info", "POST": "upload", "PUT": "upload", "DELETE": "remove"}
+
+
+def classify_request(method: str, url: str) -> tuple:
+    """(alvo, operação) de uma requisição ao Supabase: tabela/rpc/bucket + select/insert/..."""
+    parts = [p for p in urlparse(url).path.split("/") if p]
+    if parts[:2] == ["rest", "v1"] and len(parts) >= 3:
+        if parts[2] == "rpc" and len(parts) >= 4:
+            return f"rpc:{parts[3]}", "call"
+        return parts[2], REST_OPERATIONS.get(method, method.lower())
+    if parts[:3] == ["storage", "v1", "object"] and len(parts) >= 4:
+        # /object/<bucket>/<path>, /object/list/<bucket>, /object/sign/<bucket>/...
+        if parts[3] in ("list", "sign", "public", "authenticated", "info") and len(parts) >= 5:
+            return f"storage:{parts[4]}", parts[3]
+        return f"storage:{parts[3]}", STORAGE_OPERATIONS.get(method, method.lower())
+    return "/".join(parts[:2]) or "/", method.lower()
+
+
+class LatencyMetrics:
+    """Histogramas de latência por (alvo, operação); thread-safe"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # chave -> [contagem por bucket..., total_segundos, max_segundos, erros]
+        self._series = {}
+
+    def record(self, target: str, operation: str, seconds: float, error: bool = False):
+        index = bisect.bisect_left(BUCKETS_MS, seconds * 1000)
+        with self._lock:
+            series = self._series.setdefault((target, operation), [0] * len(BUCKETS_MS) + [0.0, 0.0, 0])
+            series[index] += 1
+            series[-3] += seconds
+            series[-2] = max(series[-2], seconds)
+            if error:
+                series[-1] += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {key: list(series) for key, series in self._series.items()}
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+
+    @staticmethod
+    def _percentile(buckets: list, count: int, fraction: float) -> float:
+        """Limite superior (ms) do bucket que contém o percentil"""
+        target = fraction * count
+        seen = 0
+        for limit, n in zip(BUCKETS_MS, buckets):
+            seen += n
+            if seen >= target:
+                return limit
+        return BUCKETS_MS[-1]
+
+    def rows(self, since: dict = None) -> list:
+        """Linhas do relatório (desde um snapshot), ordenadas pelo tempo total gasto"""
+        since = since or {}
+        rows = []
+        for key, series in self.snapshot().items():
+            previous = since.get(key)
+            if previous:
+                # max não é subtraível: usa o max acumulado
+                series = [a - b for a, b in zip(series[:-2], previous[:-2])] + [series[-2], series[-1] - previous[-1]]
+            buckets = series[:len(BUCKETS_MS)]
+            count = sum(buckets)
+            if not count:
+                continue
+            rows.append({
+                "target": key[0], "operation": key[1], "count": count,
+                "total_seconds": series[-3], "max_ms": series[-2] * 1000, "errors": series[-1],
+                "p50_ms": self._percentile(buckets, count, 0.50),
+                "p95_ms": self._percentile(buckets, count, 0.95),
+            })
+        return sorted(rows, key=lambda r: r["total_seconds"], reverse=True)
+
+    def summary(self, since: dict = None, limit: int = 10) -> str:
+        lines = []
+        for r in self.rows(since)[:limit]:
+            errors = f" erros={r['errors']}" if r["errors"] else ""
+            lines.append(
+                f"   {r['target']} {r['operation']}: n={r['count']} p50≤{r['p50_ms']:g}ms "
+                f"p95≤{r['p95_ms']:g}ms max={r['max_ms']:.0f}ms total={r['total_seconds']:.1f}s{errors}"
+            )
+        return "\n".join(lines) or "   (nenhuma chamada ao Supabase)"
+
+
+supabase_metrics = LatencyMetrics()
+
+
+class _TimedStream(httpx.SyncByteStream):
+    """Corpo da resposta que registra a latência quando termina de ser lido/fechado"""
+
+    def __init__(self, stream, on_close):
+        self._stream = stream
+        self._on_close = on_close
+
+    def __iter__(self):
+        yield from self._stream
+
+    def close(self):
+        try:
+            self._stream.close()
+        finally:
+            on_close, self._on_close = self._on_close, None
+            if on_close is not None:
+                on_close()
+
+
+class InstrumentedTransport(httpx.HTTPTransport):
+    """HTTPTransport que mede cada round-trip em LatencyMetrics"""
+
+    def __init__(self, metrics: LatencyMetrics, **kwargs):
+        super().__init__(**kwargs)
+        self.metrics = metrics
+
+    def handle_request(self, request):
+        target, operation = classify_request(request.method, str(request.url))
+        started = time.perf_counter()
+        try:
+            response = super().handle_request(request)
+        except Exception:
+            self.metrics.record(target, operation, time.perf_counter() - started, error=True)
+            raise
+        error = response.status_code >= 400
+        response.stream = _TimedStream(
+            response.stream,
+            lambda: self.metrics.record(target, operation, time.perf_counter() - started, error=error),
+        )
+        return response
+
+
+_http_client = None
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_http_client() -> httpx.Client:
+    """httpx.Client compartilhado por todos os clientes Supabase do processo"""
+    global _http_client
+    with _clients_lock:
+        if _http_client is None:
+            pool_size = settings.SUPABASE_POOL_SIZE
+            transport = InstrumentedTransport(
+                supabase_metrics,
+                limits=httpx.Limits(
+                    max_connections=pool_size,
+                    max_keepalive_connections=pool_size,
+                    keepalive_expiry=settings.SUPABASE_KEEPALIVE_SECONDS,
+                ),
+                retries=1,  # nova tentativa só para falha de conexão
+            )
+            _http_client = httpx.Client(
+                transport=transport,
+                timeout=httpx.Timeout(settings.SUPABASE_TIMEOUT_SECONDS, connect=settings.SUPABASE_CONNECT_TIMEOUT_SECONDS),
+                follow_redirects=True,
+            )
+        return _http_client
+
+
+def iter_storage_object(bucket: str, path: str, chunk_size: int = 1024 * 1024, service_role: bool = False):
+    """Baixa um objeto do Storage em blocos pelo pool compartilhado (sem montar a resposta inteira)"""
+    key = settings.SUPABASE_SERVICE_ROLE_KEY if service_role and settings.SUPABASE_SERVICE_ROLE_KEY else settings.SUPABASE_KEY
+    url = f"{settings.SUPABASE_URL.rstrip('/')}/storage/v1/object/{bucket}/{quote(path)}"
+    headers = {"apikey": key, "Authorization": f"Bearer {key}"}
+    with get_http_client().stream("GET", url, headers=headers) as response:
+        response.raise_for_status()
+        yield from response.iter_bytes(chunk_size)
+
+
+def get_supabase_client(service_role: bool = False):
+    """
+    Cliente Supabase compartilhado (um por chave). service_role=True usa
+    SUPABASE_SERVICE_ROLE_KEY (ignora RLS, ex.: upload no Storage pelo ZipProcessor).
+    """
+    from supabase import create_client, ClientOptions
+
+    key = settings.SUPABASE_KEY
+    if service_role:
+        if settings.SUPABASE_SERVICE_ROLE_KEY:
+            key = settings.SUPABASE_SERVICE_ROLE_KEY
+        else:
+            print("[AVISO] SUPABASE_SERVICE_ROLE_KEY não configurada; usando SUPABASE_KEY (sujeito a RLS)")
+    http_client = get_http_client()
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            try:
+                client = create_client(settings.SUPABASE_URL, key, options=ClientOptions(httpx_client=http_client))
+            except TypeError:
+                # supabase-py antigo (sem httpx_client): cliente padrão, sem pool compartilhado nem métricas
+                print("[AVISO] supabase-py sem suporte a httpx_client; atualize para usar o pool compartilhado")
+                client = create_client(settings.SUPABASE_URL, key)
+            _clients[key] = client
+        return client
@@ -0,0 +1,56 @@
+"""
+Contagem local de tokens com tiktoken (mesmo tokenizer usado pela OpenAI).
+"""
+
+import threading
+from functools import lru_cache
+
+_lock = threading.Lock()
+
+
+@lru_cache(maxsize=8)
+def _encoding_for(model: str):
+    import tiktoken
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        # Modelos novos (gpt-4.1, gpt-4o...) usam o o200k_base
+        return tiktoken.get_encoding("o200k_base")
+
+
+def get_encoding(model: str):
+    with _lock:
+        return _encoding_for(model)
+
+
+def count_tokens(text: str, model: str = "gpt-4.1-mini") -> int:
+    """Tokens de um texto. Sem tiktoken disponível, usa a estimativa de 4 caracteres por token."""
+    if not text:
+        return 0
+    try:
+        return len(get_encoding(model).encode(text, disallowed_special=()))
+    except Exception:
+        return len(text) // 4
+
+
+def count_tokens_batch(texts: list, model: str = "gpt-4.1-mini") -> list:
+    """Tokens de cada texto da lista (encode em lote do tiktoken). Sem tiktoken, 4 caracteres por token."""
+    try:
+        return [len(tokens) for tokens in get_encoding(model).encode_batch(texts, disallowed_special=())]
+    except Exception:
+        return [len(text) // 4 for text in texts]
+
+
+def count_message_tokens(messages: list, model: str = "gpt-4.1-mini") -> int:
+    """Tokens de uma lista de mensagens do chat (conteúdo + overhead por mensagem)"""
+    total = 3  # Primer da resposta do assistente
+    for message in messages:
+        total += 4
+        content = message.get("content")
+        if isinstance(content, str):
+            total += count_tokens(content, model)
+        elif isinstance(content, list):
+            for part in content:
+                if part.get("type") == "text":
+                    total += count_tokens(part.get("text", ""), model)
+    return total
@@ -5,27 +5,53 @@ Worker simplificado que exporta resultados para CSV
 - Não salva no Supabase (apenas atualiza status)
 """
 
+import atexit
 import time
 import json
 import os
-import tempfile
+import queue
 import threading
-import csv
+import multiprocessing
 import re
+import socket
 from datetime import datetime
-from concurrent.futures import ThreadPoolExecutor
-from supabase import create_client
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from postgrest import ReturnMethod
+from supabase_pool import get_supabase_client, iter_storage_object, supabase_metrics
 from config import settings
 # from gemini_client import GeminiClient
 from openai_client import OpenAIClient
+from llm_cache import get_response_cache
+from prompt_cache import PromptCache
+from job_notifier import get_job_notifier, CHANNEL_PROCESSAR_AGORA
+from extraction import (
+    extract_file_cached, init_extraction_process, extraction_initargs, converter_pool_summary, EXCEL_EXTENSIONS,
+)
+from document_stream import download_document
+from result_exporter import get_result_exporter
+from result_sink import ResultSink
+from relevance_pruning import prune_document
 
 # Variáveis globais (inicializadas no main_loop)
 supabase = None
 ai_client = None
-semaphore = None
+result_sink = None
 
-# Arquivo CSV de saída
-CSV_OUTPUT = "resultados_analise.csv"
+# Projetos com Batch API em andamento (evita dois batches do mesmo projeto)
+_batch_projects = set()
+_batch_projects_lock = threading.Lock()
+
+# Reserva de documentos: identificação nas leases e documentos em andamento neste processo
+WORKER_ID = settings.WORKER_ID or f"{socket.gethostname()}:{os.getpid()}"
+_claimed_ids = set()
+_claimed_ids_lock = threading.Lock()
+_claim_rpc_available = True
+_result_sink_lock = threading.Lock()
+
+def export_output() -> str:
+    """Arquivo (ou diretório Parquet) de saída da exportação local (result_exporter)"""
+    exporter = get_result_exporter()
+    return exporter.path if exporter is not None else "DESATIVADO"
 
 def extract_schema_keys(prompt_text: str) -> list:
     """
@@ -107,92 +133,63 @@ def find_key_in_dict(data: dict, key: str) -> any:
     
     return None
 
-def load_prompt_from_db(supabase_client, projeto_id=None):
-    """Carrega prompt do Supabase por projeto. Se projeto_id for None, tenta id=1 (legado)."""
+def load_prompt_row(supabase_client, projeto_id=None) -> tuple:
+    """
+    Carrega (prompt_text, versão) do Supabase por projeto. Se projeto_id for None, tenta id=1 (legado).
+    A versão é prompt_config.updated_at (ou o mtime do arquivo, no fallback local).
+    """
     try:
         if projeto_id:
-            result = supabase_client.table('prompt_config').select('prompt_text').eq('projeto_id', projeto_id).maybe_single().execute()
+            result = supabase_client.table('prompt_config').select('prompt_text, updated_at').eq('projeto_id', projeto_id).maybe_single().execute()
         else:
-            result = supabase_client.table('prompt_config').select('prompt_text').eq('id', 1).maybe_single().execute()
+            result = supabase_client.table('prompt_config').select('prompt_text, updated_at').eq('id', 1).maybe_single().execute()
         # Fix: Check if result is not None before accessing data
         # maybe_single().execute() might return None if no record found
         if result and hasattr(result, 'data') and result.data and result.data.get('prompt_text'):
-            return result.data['prompt_text']
+            return result.data['prompt_text'], result.data.get('updated_at')
     except Exception as e:
         print(f"[AVISO] Erro ao carregar prompt do Supabase: {e}")
+    return load_prompt_from_file(), prompt_file_version()
+
+def load_prompt_from_db(supabase_client, projeto_id=None):
+    """Carrega prompt do Supabase por projeto. Se projeto_id for None, tenta id=1 (legado)."""
+    return load_prompt_row(supabase_client, projeto_id)[0]
+
+def load_prompt_version(supabase_client, projeto_id=None):
+    """Consulta leve: apenas prompt_config.updated_at do projeto (versão do prompt)"""
+    if projeto_id:
+        result = supabase_client.table('prompt_config').select('updated_at').eq('projeto_id', projeto_id).maybe_single().execute()
+    else:
+        result = supabase_client.table('prompt_config').select('updated_at').eq('id', 1).maybe_single().execute()
+    if result and hasattr(result, 'data') and result.data:
+        return result.data.get('updated_at')
+    return prompt_file_version()
+
+def prompt_file_path():
+    """Caminho do prompt local: docs/prompt_custom.txt (ou prompt_custom.txt na raiz)"""
+    prompt_path = os.path.join("docs", "prompt_custom.txt")
+    if not os.path.exists(prompt_path):
+        prompt_path = "prompt_custom.txt" # Fallback para raiz
+    return prompt_path
+
+def prompt_file_version():
     try:
-        # Tentar carregar de docs/prompt_custom.txt
-        prompt_path = os.path.join("docs", "prompt_custom.txt")
-        if not os.path.exists(prompt_path):
-             prompt_path = "prompt_custom.txt" # Fallback para raiz
-        
-        with open(prompt_path, "r", encoding="utf-8") as f:
+        return f"file:{os.path.getmtime(prompt_file_path())}"
+    except OSError:
+        return None
+
+def load_prompt_from_file():
+    """Fallback: prompt em docs/prompt_custom.txt (ou prompt_custom.txt na raiz)"""
+    try:
+        with open(prompt_file_path(), "r", encoding="utf-8") as f:
             return f.read()
     except FileNotFoundError:
         pass
     return None
 
-def flatten_dict(d: dict, parent_key: str = '', sep: str = '_') -> dict:
-    """
-    Achata um dicionário aninhado para formato CSV
-    Ex: {"partes": {"autor": "João"}} -> {"partes_autor": "João"}
-    """
-    items = []
-    for k, v in d.items():
-        new_key = f"{parent_key}{sep}{k}" if parent_key else k
-        if isinstance(v, dict):
-            items.extend(flatten_dict(v, new_key, sep=sep).items())
-        elif isinstance(v, list):
-            # Se for lista, converter para string separada por vírgula
-            items.append((new_key, ', '.join(str(item) for item in v) if v else ''))
-        else:
-            items.append((new_key, v))
-    return dict(items)
-
-def save_to_csv(data: dict):
-    """
-    Salva resultado em CSV com todas as colunas achatadas
-    """
-    # Achatando objetos aninhados
-    flat_data = flatten_dict(data)
-    
-    # Garantir que arquivo_original sempre existe
-    if 'arquivo_original' not in flat_data:
-        flat_data['arquivo_original'] = data.get('arquivo_original', 'N/A')
-    
-    file_exists = os.path.exists(CSV_OUTPUT)
-    
-    # Ler cabeçalhos existentes se o arquivo já existe
-    existing_headers = set()
-    if file_exists:
-        try:
-            with open(CSV_OUTPUT, 'r', encoding='utf-8-sig', newline='') as f:
-                reader = csv.DictReader(f)
-                if reader.fieldnames:
-                    existing_headers = set(reader.fieldnames)
-        except Exception:
-            pass
-    
-    # Combinar cabeçalhos existentes com novos
-    all_headers = sorted(list(existing_headers.union(flat_data.keys())))
-    
-    # Se o arquivo não existe, criar com cabeçalho
-    if not file_exists:
-        with open(CSV_OUTPUT, 'w', newline='', encoding='utf-8-sig') as f:
-            writer = csv.DictWriter(f, fieldnames=all_headers)
-            writer.writeheader()
-            # Preencher valores faltantes com vazio
-            row = {header: flat_data.get(header, '') for header in all_headers}
-            writer.writerow(row)
-    else:
-        # Adicionar linha ao CSV existente
-        with open(CSV_OUTPUT, 'a', newline='', encoding='utf-8-sig') as f:
-            writer = csv.DictWriter(f, fieldnames=all_headers)
-            # Preencher valores faltantes com vazio
-            row = {header: flat_data.get(header, '') for header in all_headers}
-            writer.writerow(row)
-    
-    print(f"   Salvo em: {CSV_OUTPUT} ({len(all_headers)} colunas)")
+# Correção via regex da Cobertura; os trechos com as âncoras sempre vão para a IA (select_llm_text)
+REGEX_FIX_PATTERN = r'SEGURADO:.*?TERCEIROS:.*?(\bSIM\b|\bNÃO\b).*?(\bSIM\b|\bNÃO\b)'
+REGEX_FIX_ANCHORS = (r'SEGURADO:', r'TERCEIROS:')
 
 def apply_regex_fix(raw_text: str, data: dict):
     """
@@ -205,8 +202,7 @@ def apply_regex_fix(raw_text: str, data: dict):
         # Regex busca: SEGURADO: (texto qualquer) TERCEIROS: (texto qualquer) (SIM/NÃO) (texto qualquer) (SIM/NÃO)
         # O re.DOTALL faz o . casar com quebras de linha
         # Adicionei \s* para flexibilidade extra
-        pattern = r'SEGURADO:.*?TERCEIROS:.*?(\bSIM\b|\bNÃO\b).*?(\bSIM\b|\bNÃO\b)'
-        match = re.search(pattern, raw_text, re.DOTALL | re.IGNORECASE)
+        match = re.search(REGEX_FIX_PATTERN, raw_text, re.DOTALL | re.IGNORECASE)
         
         if match:
             segurado_val = match.group(1).upper()
@@ -224,197 +220,516 @@ def apply_regex_fix(raw_text: str, data: dict):
     
     return data
 
-def process_file_task(record):
-    """Tarefa individual de processamento"""
+def select_llm_text(raw_text: str, schema_keys: list, is_excel: bool = False) -> str:
+    """
+    Texto enviado à IA: em PDFs longos, só os trechos mais relevantes para as chaves
+    do schema (BM25, até LLM_PRUNE_MAX_TOKENS); com confiança baixa, o documento inteiro.
+    Planilhas já têm orçamento próprio (EXCEL_MAX_TOKENS) e vão inteiras.
+    """
+    if is_excel or not settings.LLM_PRUNE_ENABLED:
+        return raw_text
+    try:
+        text, info = prune_document(
+            raw_text, schema_keys, anchors=REGEX_FIX_ANCHORS,
+            max_tokens=settings.LLM_PRUNE_MAX_TOKENS,
+            min_tokens=settings.LLM_PRUNE_MIN_TOKENS,
+            chunk_tokens=settings.LLM_PRUNE_CHUNK_TOKENS,
+            min_coverage=settings.LLM_PRUNE_MIN_KEY_COVERAGE,
+        )
+    except Exception as e:
+        print(f"[AVISO] Erro na seleção por relevância; enviando documento inteiro: {e}")
+        return raw_text
+    if info["pruned"]:
+        print(f"   ✂️ Seleção por relevância: {info['tokens']}/{info['total_tokens']} tokens "
+              f"({info['sections']}/{info['total_sections']} trechos, {info['coverage']:.0%} das chaves cobertas)")
+    elif info["total_tokens"] > settings.LLM_PRUNE_MIN_TOKENS:
+        print(f"   Documento inteiro para a IA ({info['reason']})")
+    return text
+
+def build_final_prompt(current_prompt: str) -> str:
+    """Anexa as regras críticas de extração ao prompt do projeto"""
+    return f"""{current_prompt}
+
+REGRAS CRÍTICAS DE EXTRAÇÃO:
+1. Retorne APENAS o JSON válido, usando EXATAMENTE as chaves definidas no schema acima.
+2. NÃO adicione nem remova chaves.
+3. Extraia APENAS informações que estão LITERALMENTE escritas no documento.
+4. Se uma informação NÃO estiver explicitamente presente, deixe o campo em branco ("" para strings, null para números/objetos).
+5. NUNCA invente, deduza, presuma, ou interprete informações.
+6. NUNCA use valores de exemplo ou placeholder.
+7. Seja LITERAL - copie o texto exato, não parafraseie."""
+
+def build_result(record, raw_text: str, current_prompt: str, json_text: str, expected_keys: list = None) -> dict:
+    """
+    Converte a resposta da IA no registro final: correção via regex, filtro
+    pelas chaves do schema e metadados do arquivo.
+    expected_keys: chaves já extraídas do prompt (cache por projeto); sem elas, extrai de current_prompt.
+    """
+    filename = record['filename']
+    data_analise = json.loads(json_text)
+
+    # Aplicar Correção Híbrida (Regex sobrepõe AI para campos críticos)
+    data_analise = apply_regex_fix(raw_text, data_analise)
+    
+    # Validação se IA retornou Lista ao invés de Objeto
+    if isinstance(data_analise, list):
+        if len(data_analise) > 0:
+            print(f"[AVISO] Alerta: IA retornou uma lista ({len(data_analise)} itens). Usando o primeiro item.")
+            data_analise = data_analise[0]
+        else:
+            data_analise = {}
+    elif not isinstance(data_analise, dict):
+         data_analise = {}
+    
+    # Extrair chaves esperadas do schema no prompt
+    if expected_keys is None:
+        expected_keys = extract_schema_keys(current_prompt)
+    
+    # Filtrar apenas as chaves esperadas (remover campos extras que a IA pode ter adicionado)
+    if expected_keys:
+        filtered_data = {}
+        for key in expected_keys:
+            # Buscar a chave (pode estar achatada ou aninhada)
+            value = find_key_in_dict(data_analise, key)
+            if value is not None:
+                filtered_data[key] = value
+            else:
+                filtered_data[key] = 'N/A'
+        data_analise = filtered_data
+        print(f"   Filtrado para {len(expected_keys)} chaves esperadas: {', '.join(expected_keys[:5])}...")
+    
+    # Apenas nome do arquivo, data de processamento e campos pedidos pelo usuário (sem detalhes do arquivo)
+    data_analise['numero_caso'] = record.get('caso_id', 'N/A')
+    data_analise['arquivo_original'] = filename
+    data_analise['data_processamento'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    
+    return data_analise
+
+def sync_llm_cache_prompt(projeto_id, prompt_final: str):
+    """Prompt do projeto mudou? Invalida respostas antigas do cache da IA"""
+    response_cache = get_response_cache()
+    if response_cache is not None:
+        response_cache.sync_project_prompt(projeto_id, prompt_final)
+
+# Prompt, prompt final e chaves do schema por projeto (recarregado quando updated_at muda)
+prompt_cache = PromptCache(build_final_prompt, extract_schema_keys, on_change=sync_llm_cache_prompt)
+
+def get_project_prompt(projeto_id):
+    """ProjectPrompt do projeto (cache em memória) ou None se não houver prompt configurado"""
+    return prompt_cache.get(
+        projeto_id,
+        lambda: load_prompt_version(supabase, projeto_id),
+        lambda: load_prompt_row(supabase, projeto_id),
+    )
+
+def is_missing_rpc_error(error) -> bool:
+    """PostgREST responde PGRST202 quando a função ainda não foi criada (migration não aplicada)"""
+    message = str(error)
+    return "PGRST202" in message or "Could not find the function" in message
+
+def track_claimed(records):
+    with _claimed_ids_lock:
+        _claimed_ids.update(str(r['id']) for r in records)
+
+def release_claimed(doc_id):
+    with _claimed_ids_lock:
+        _claimed_ids.discard(str(doc_id))
+
+def claimed_ids() -> list:
+    """Ids reservados por este worker e ainda em andamento"""
+    with _claimed_ids_lock:
+        return list(_claimed_ids)
+
+def claim_rpc_available() -> bool:
+    return _claim_rpc_available
+
+def disable_claim_rpc():
+    """Passa a usar o fallback select + update (função claim_documents ausente no banco)"""
+    global _claim_rpc_available
+    _claim_rpc_available = False
+    print("[AVISO] Função claim_documents não encontrada; usando select + update (execute sql/migrations/add_claim_documents.sql)")
+
+def claim_documents(supabase_client, projeto_id, limit: int, lease_seconds: int = None) -> list:
+    """
+    Reserva até `limit` documentos PENDENTE do projeto (todos se projeto_id for None)
+    e já os marca como PROCESSANDO, numa única chamada atômica (RPC claim_documents).
+    Sem a função no banco, cai no select + update condicional (status ainda PENDENTE):
+    outro worker pode ter selecionado os mesmos ids, então só ficam os ids que este
+    update efetivamente mudou (linhas devolvidas pelo PostgREST).
+    """
+    lease_seconds = lease_seconds or settings.CLAIM_LEASE_SECONDS
+    if _claim_rpc_available:
+        try:
+            response = supabase_client.rpc('claim_documents', {
+                'p_projeto_id': projeto_id,
+                'p_limit': limit,
+                'p_worker_id': WORKER_ID,
+                'p_lease_seconds': lease_seconds,
+            }).execute()
+            files = response.data or []
+            track_claimed(files)
+            return files
+        except Exception as e:
+            if not is_missing_rpc_error(e):
+                raise
+            disable_claim_rpc()
+    
+    query = supabase_client.table(settings.TABLE_GERENCIAMENTO).select("*").eq("status", "PENDENTE").not_.is_("storage_path", "null").limit(limit)
+    if projeto_id:
+        query = query.eq("projeto_id", projeto_id)
+    files = query.execute().data or []
+    if not files:
+        return []
+    # Só fica com as linhas que ainda estavam PENDENTE no momento do update: o Postgres
+    # reavalia o filtro de status após o lock da linha, então cada id muda para um único worker
+    response = supabase_client.table(settings.TABLE_GERENCIAMENTO).update(
+        {"status": "PROCESSANDO", "started_at": "now()"},
+        returning=ReturnMethod.representation,
+    ).in_("id", [f['id'] for f in files]).eq("status", "PENDENTE").execute()
+    claimed = {str(r['id']) for r in (response.data or [])}
+    taken = len(files) - len(claimed)
+    files = [f for f in files if str(f['id']) in claimed]
+    if taken:
+        print(f"   {taken} documento(s) já reservado(s) por outro worker")
+    track_claimed(files)
+    return files
+
+def renew_leases(supabase_client):
+    """Renova as leases dos documentos que este worker ainda está processando"""
+    ids = claimed_ids()
+    if not ids or not _claim_rpc_available:
+        return
+    try:
+        supabase_client.rpc('renew_document_leases', {
+            'p_worker_id': WORKER_ID,
+            'p_ids': ids,
+            'p_lease_seconds': settings.CLAIM_LEASE_SECONDS,
+        }).execute()
+    except Exception as e:
+        print(f"[AVISO] Erro ao renovar leases: {e}")
+
+def mark_error(record, error: Exception):
+    """Registra erro de processamento do documento no banco"""
+    filename = record['filename']
+    print(f"[ERRO] Erro {filename}: {str(error)}")
+    import traceback
+    traceback.print_exc()
+    error_msg = str(error)[:500]  # Limitar tamanho da mensagem
+    
+    try:
+        supabase.table(settings.TABLE_GERENCIAMENTO).update(
+            {"status": "ERRO", "error_message": error_msg}
+        ).eq("id", record['id']).execute()
+    except Exception as update_error:
+        print(f"[AVISO] Erro ao atualizar status: {update_error}")
+    finally:
+        release_claimed(record['id'])
+
+def extract_file_task(record, executor=None) -> dict:
+    """
+    Estágio 1: baixa o arquivo do Storage e extrai o texto (PDF/Excel -> markdown).
+    A extração (CPU) roda no ProcessPoolExecutor quando informado; sem executor
+    roda no processo atual.
+    """
+    filename = record['filename']
+    storage_path = record.get('storage_path')
+    projeto_id = record.get('projeto_id')
+    
+    print(f"Processando: {filename}" + (f" [projeto: {str(projeto_id)[:8]}...]" if projeto_id else ""))
+    
+    if not storage_path:
+        raise ValueError("Caminho do arquivo no storage não encontrado")
+
+    # Detectar tipo de arquivo
+    file_extension = os.path.splitext(storage_path)[1].lower()
+    is_excel = file_extension in EXCEL_EXTENSIONS
+    
+    print(f"   Baixando: {storage_path} ({file_extension})")
+    # Download em streaming: memória até STORAGE_SPOOL_MAX_MB, arquivo temporário acima disso
+    with download_document(iter_storage_object("processos", storage_path), suffix=file_extension) as document:
+        extracted, cache_hit = extract_file_cached(document, file_extension, executor=executor)
+    
+    return {
+        "record": record,
+        "raw_text": extracted["text"],
+        "is_excel": is_excel,
+        "cache_hit": cache_hit,
+    }
+
+def result_saved(record):
+    """Documento gravado (insert + remoção do Storage e da fila): libera a reserva"""
+    release_claimed(record['id'])
+    print(f"[OK] Sucesso: {record['filename']}")
+
+def get_result_sink():
+    """Gravação em lote dos resultados (criada na primeira chamada), ou None se desativada"""
+    global result_sink
+    if not settings.RESULT_SINK_ENABLED:
+        return None
+    with _result_sink_lock:
+        if result_sink is None:
+            result_sink = ResultSink(
+                supabase, settings.TABLE_GERENCIAMENTO,
+                batch_size=settings.RESULT_SINK_BATCH_SIZE,
+                flush_ms=settings.RESULT_SINK_FLUSH_MS,
+                on_done=result_saved,
+            )
+            atexit.register(result_sink.close)
+    return result_sink
+
+def save_result(record, data_analise: dict):
+    """Salva o resultado no Supabase e remove o arquivo do Storage e da fila"""
     filename = record['filename']
     storage_path = record.get('storage_path')
     doc_id_db = record['id']
     projeto_id = record.get('projeto_id')
     
-    with semaphore:  # Garante limite de threads ativas
-        tmp_path = None
+    # 4. Exportação local (CSV/Parquet em lote, sem reler o arquivo a cada linha)
+    exporter = get_result_exporter()
+    if exporter is not None:
+        exporter.add(data_analise)
+    
+    # Em lote: insert, Storage e fila gravados pelo ResultSink junto com outros documentos
+    sink = get_result_sink()
+    if sink is not None:
+        sink.submit(record, data_analise)
+        return
+    
+    # 5. Salvar também no Supabase para exportação via frontend (com projeto_id)
+    try:
+        insert_payload = {
+            'arquivo_original': filename,
+            'dados_json': data_analise
+        }
+        if projeto_id:
+            insert_payload['projeto_id'] = projeto_id
+        supabase.table('resultados_analise').insert(insert_payload).execute()
+        print(f"   Resultado salvo no Supabase para exportacao")
+    except Exception as db_error:
+        print(f"[AVISO] Erro ao salvar no Supabase (CSV local foi salvo): {db_error}")
+    
+    # 5. Remover arquivo do Storage (bucket)
+    try:
+        supabase.storage.from_("processos").remove([storage_path])
+        print(f"   Arquivo removido do Storage")
+    except Exception as delete_error:
+        print(f"[AVISO] Erro ao remover do bucket (confira RLS DELETE em storage.objects): {delete_error}")
+    
+    # 6. Remover registro da fila (limpar banco)
+    try:
+        supabase.table(settings.TABLE_GERENCIAMENTO).delete().eq("id", doc_id_db).execute()
+        print(f"   Registro removido da fila (documento_gerenciamento)")
+    except Exception as db_del_error:
+        # Fallback: marcar como CONCLUIDO se delete falhar (ex.: RLS)
         try:
-            print(f"Processando: {filename}" + (f" [projeto: {str(projeto_id)[:8]}...]" if projeto_id else ""))
-            
-            # 1. Marcar como PROCESSANDO
             supabase.table(settings.TABLE_GERENCIAMENTO).update(
-                {"status": "PROCESSANDO", "started_at": "now()"}
+                {"status": "CONCLUIDO", "completed_at": "now()"}
             ).eq("id", doc_id_db).execute()
+            print(f"   [AVISO] Delete da fila falhou; status atualizado para CONCLUIDO: {db_del_error}")
+        except Exception as update_error:
+            print(f"[AVISO] Erro ao atualizar/remover da fila: {update_error}")
+    
+    result_saved(record)
+
+def analyze_file_task(job: dict):
+    """
+    Estágio 2: envia o texto extraído para a IA, filtra as chaves do schema,
+    salva o resultado e limpa Storage/fila.
+    """
+    record = job['record']
+    raw_text = job['raw_text']
+    filename = record['filename']
+    projeto_id = record.get('projeto_id')
+    
+    # 3. Prompt do projeto (ou legado id=1), do cache por projeto
+    project_prompt = get_project_prompt(projeto_id)
+    if project_prompt is None:
+        raise ValueError("Prompt não configurado. Configure no frontend ou crie prompt_custom.txt")
+    
+    print(f"   Enviando para IA ({'Excel' if job['is_excel'] else 'PDF'}): {filename}")
+    
+    # 4. Análise do texto extraído (PDFs longos: só os trechos relevantes para o schema)
+    llm_text = select_llm_text(raw_text, project_prompt.schema_keys, job['is_excel'])
+    json_text = ai_client._call_openai(
+        llm_text, project_prompt.prompt_final,
+        projeto_id=projeto_id,
+        use_cache=not job.get('force_reprocess', False)
+    )
+    data_analise = build_result(
+        record, raw_text, project_prompt.prompt_text, json_text,
+        expected_keys=project_prompt.schema_keys
+    )
+    
+    save_result(record, data_analise)
 
-            # 2. Baixar do Supabase Storage
-            if not storage_path:
-                raise ValueError("Caminho do arquivo no storage não encontrado")
+class BatchStats:
+    """Contadores de um lote (arquivos de um disparo em processar_agora)"""
 
-            # Detectar tipo de arquivo
-            file_extension = os.path.splitext(storage_path)[1].lower()
-            is_excel = file_extension in ['.xlsx', '.xls']
-            
-            print(f"   Baixando: {storage_path} ({file_extension})")
-            
-            # 2.1 Download do arquivo
-            data = supabase.storage.from_("processos").download(storage_path)
-            
-            # 2.2 Processar de acordo com o tipo
-            if is_excel:
-                # Excel: converter para texto/JSON
-                import pandas as pd
-                import io as io_lib
-                
-                print(f"   Processando Excel...")
-                excel_buffer = io_lib.BytesIO(data)
-                df = pd.read_excel(excel_buffer)
-                
-                # Converter DataFrame para texto estruturado
-                excel_text = "## Dados do Excel:\n\n"
-                excel_text += df.to_string(index=False)
-                excel_text += "\n\n## Dados em JSON:\n"
-                excel_text += df.to_json(orient='records', indent=2, force_ascii=False)
-                
-                raw_text = excel_text
-                tmp_path = None  # Não precisa de arquivo temporário
-            else:
-                # PDF: salvar temporariamente
-                with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp:
-                    tmp.write(data)
-                    tmp_path = tmp.name
-
-            # 3. Carregar prompt do projeto (ou legado id=1)
-            current_prompt = load_prompt_from_db(supabase, projeto_id)
-            if not current_prompt:
-                raise ValueError("Prompt não configurado. Configure no frontend ou crie prompt_custom.txt")
-            
-            print(f"   Enviando para IA...")
-            prompt_final = f"""{current_prompt}
+    def __init__(self, label: str, total: int):
+        self.label = label
+        self.remaining = total
+        self.total = total
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.started = time.time()
+        self.supabase_snapshot = supabase_metrics.snapshot()
+        self._lock = threading.Lock()
 
-REGRAS CRÍTICAS DE EXTRAÇÃO:
-1. Retorne APENAS o JSON válido, usando EXATAMENTE as chaves definidas no schema acima.
-2. NÃO adicione nem remova chaves.
-3. Extraia APENAS informações que estão LITERALMENTE escritas no documento.
-4. Se uma informação NÃO estiver explicitamente presente, deixe o campo em branco ("" para strings, null para números/objetos).
-5. NUNCA invente, deduza, presuma, ou interprete informações.
-6. NUNCA use valores de exemplo ou placeholder.
-7. Seja LITERAL - copie o texto exato, não parafraseie."""
-            
-            # 4. Análise de acordo com o tipo
-            if is_excel:
-                # Excel: enviar texto diretamente para IA
-                print(f"   Enviando Excel para análise...")
-                json_text = ai_client._call_openai(raw_text, prompt_final)
+    def record_extraction(self, cache_hit: bool):
+        with self._lock:
+            if cache_hit:
+                self.cache_hits += 1
             else:
-                # PDF: usar analyze_document
-                json_text, raw_text = ai_client.analyze_document(tmp_path, prompt_final)
-            data_analise = json.loads(json_text)
+                self.cache_misses += 1
 
-            # Aplicar Correção Híbrida (Regex sobrepõe AI para campos críticos)
-            data_analise = apply_regex_fix(raw_text, data_analise)
-            
-            # Validação se IA retornou Lista ao invés de Objeto
-            if isinstance(data_analise, list):
-                if len(data_analise) > 0:
-                    print(f"[AVISO] Alerta: IA retornou uma lista ({len(data_analise)} itens). Usando o primeiro item.")
-                    data_analise = data_analise[0]
-                else:
-                    data_analise = {}
-            elif not isinstance(data_analise, dict):
-                 data_analise = {}
-            
-            # Extrair chaves esperadas do schema no prompt
-            expected_keys = extract_schema_keys(current_prompt)
-            
-            # Filtrar apenas as chaves esperadas (remover campos extras que a IA pode ter adicionado)
-            if expected_keys:
-                filtered_data = {}
-                for key in expected_keys:
-                    # Buscar a chave (pode estar achatada ou aninhada)
-                    value = find_key_in_dict(data_analise, key)
-                    if value is not None:
-                        filtered_data[key] = value
-                    else:
-                        filtered_data[key] = 'N/A'
-                data_analise = filtered_data
-                print(f"   Filtrado para {len(expected_keys)} chaves esperadas: {', '.join(expected_keys[:5])}...")
-            
-            # Apenas nome do arquivo, data de processamento e campos pedidos pelo usuário (sem detalhes do arquivo)
-            data_analise['numero_caso'] = record.get('caso_id', 'N/A')
-            data_analise['arquivo_original'] = filename
-            data_analise['data_processamento'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            
-            # 4. Salvar em CSV local (DESATIVADO PARA ALTA PERFORMANCE)
-            # save_to_csv(data_analise)
-            
-            # 5. Salvar também no Supabase para exportação via frontend (com projeto_id)
-            try:
-                insert_payload = {
-                    'arquivo_original': filename,
-                    'dados_json': data_analise
-                }
-                if projeto_id:
-                    insert_payload['projeto_id'] = projeto_id
-                supabase.table('resultados_analise').insert(insert_payload).execute()
-                print(f"   Resultado salvo no Supabase para exportacao")
-            except Exception as db_error:
-                print(f"[AVISO] Erro ao salvar no Supabase (CSV local foi salvo): {db_error}")
-            
-            # 5. Remover arquivo do Storage (bucket)
-            try:
-                supabase.storage.from_("processos").remove([storage_path])
-                print(f"   Arquivo removido do Storage")
-            except Exception as delete_error:
-                print(f"[AVISO] Erro ao remover do bucket (confira RLS DELETE em storage.objects): {delete_error}")
-            
-            # 6. Remover registro da fila (limpar banco)
+    def file_done(self):
+        with self._lock:
+            self.remaining -= 1
+            finished = self.remaining == 0
+        if finished:
+            print(f"[OK] Lote concluído ({self.label}): {self.total} arquivo(s) em {time.time() - self.started:.1f}s")
+            print(f"   Cache de extração: {self.cache_hits} hit(s), {self.cache_misses} miss(es)")
+            print(converter_pool_summary())
+            print("   Supabase (latência por tabela/operação, maior tempo total primeiro):")
+            print(supabase_metrics.summary(since=self.supabase_snapshot))
+
+class ExtractionPipeline:
+    """
+    Pipeline em dois estágios:
+    - Estágio 1 (CPU): ProcessPoolExecutor com EXTRACTION_PROCESSES processos converte
+      PDF/Excel em texto. Threads leves apenas baixam e aguardam o resultado.
+    - Estágio 2 (I/O): LLM_WORKERS threads consomem uma fila limitada
+      (EXTRACTION_QUEUE_SIZE) e fazem as chamadas à IA.
+    A fila cheia bloqueia o estágio 1 (backpressure) em vez de acumular textos na memória.
+    """
+
+    def __init__(self):
+        self.extraction_processes = settings.EXTRACTION_PROCESSES or os.cpu_count() or 1
+        self.llm_workers = settings.LLM_WORKERS
+        self.process_pool = ProcessPoolExecutor(
+            max_workers=self.extraction_processes,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_extraction_process,
+            initargs=extraction_initargs(),
+        )
+        # Threads de download: o suficiente para manter todos os processos ocupados
+        self.download_executor = ThreadPoolExecutor(
+            max_workers=self.extraction_processes * 2,
+            thread_name_prefix="extract",
+        )
+        self.llm_queue = queue.Queue(maxsize=settings.EXTRACTION_QUEUE_SIZE)
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._capacity_freed = threading.Condition(self._lock)  # Acorda o main_loop quando um documento termina
+        self._llm_threads = []
+        for i in range(self.llm_workers):
+            t = threading.Thread(target=self._llm_consumer_loop, name=f"llm-{i}", daemon=True)
+            t.start()
+            self._llm_threads.append(t)
+
+    @property
+    def in_flight(self) -> int:
+        with self._lock:
+            return self._in_flight
+
+    @property
+    def capacity(self) -> int:
+        """Máximo de documentos em andamento antes de parar de buscar novos"""
+        return self.extraction_processes * 2 + settings.EXTRACTION_QUEUE_SIZE + self.llm_workers
+
+    def wait_for_capacity(self, timeout: float) -> bool:
+        """Bloqueia até haver vaga no pipeline (ou timeout). True se há vaga."""
+        with self._capacity_freed:
+            return self._capacity_freed.wait_for(lambda: self._in_flight < self.capacity, timeout)
+
+    def _done(self, batch=None):
+        with self._lock:
+            self._in_flight -= 1
+            self._capacity_freed.notify_all()
+        if batch is not None:
+            batch.file_done()
+
+    def submit(self, record, batch=None, force_reprocess=False):
+        with self._lock:
+            self._in_flight += 1
+        self.download_executor.submit(self._extract_stage, record, batch, force_reprocess)
+
+    def _extract_stage(self, record, batch=None, force_reprocess=False):
+        try:
+            job = extract_file_task(record, executor=self.process_pool)
+        except Exception as e:
+            mark_error(record, e)
+            self._done(batch)
+            return
+        job['batch'] = batch
+        job['force_reprocess'] = force_reprocess
+        if batch is not None:
+            batch.record_extraction(job['cache_hit'])
+        self.llm_queue.put(job)  # Bloqueia se o estágio de IA estiver saturado
+
+    def _llm_consumer_loop(self):
+        while True:
+            job = self.llm_queue.get()
+            if job is None:
+                break
             try:
-                supabase.table(settings.TABLE_GERENCIAMENTO).delete().eq("id", doc_id_db).execute()
-                print(f"   Registro removido da fila (documento_gerenciamento)")
-            except Exception as db_del_error:
-                # Fallback: marcar como CONCLUIDO se delete falhar (ex.: RLS)
-                try:
-                    supabase.table(settings.TABLE_GERENCIAMENTO).update(
-                        {"status": "CONCLUIDO", "completed_at": "now()"}
-                    ).eq("id", doc_id_db).execute()
-                    print(f"   [AVISO] Delete da fila falhou; status atualizado para CONCLUIDO: {db_del_error}")
-                except Exception as update_error:
-                    print(f"[AVISO] Erro ao atualizar/remover da fila: {update_error}")
-            
-            print(f"[OK] Sucesso: {filename}")
+                analyze_file_task(job)
+            except Exception as e:
+                mark_error(job['record'], e)
+            finally:
+                self._done(job.get('batch'))
+
+    def shutdown(self):
+        self.download_executor.shutdown(wait=True)
+        for _ in self._llm_threads:
+            self.llm_queue.put(None)
+        for t in self._llm_threads:
+            t.join()
+        self.process_pool.shutdown(wait=True)
 
+def init_clients():
+    """Inicializa os clientes globais (Supabase e IA)"""
+    global supabase, ai_client
+    
+    # Cliente compartilhado: pool HTTP dimensionado + métricas de latência por tabela
+    supabase = get_supabase_client()
+    
+    # ai_client = GeminiClient()
+    ai_client = OpenAIClient()
+
+def start_batch_mode(projeto_id, force_reprocess=False, process_pool=None):
+    """Dispara o modo Batch API (batch_processor) em background para o projeto (extraindo no process_pool do worker)"""
+    import batch_processor
+    
+    key = projeto_id or "todos"
+    with _batch_projects_lock:
+        if key in _batch_projects:
+            print(f"   Batch já em andamento para o projeto {key}, ignorando disparo.")
+            return
+        _batch_projects.add(key)
+    
+    def run():
+        try:
+            batch_processor.main(projeto_id, force_reprocess, process_pool)
         except Exception as e:
-            print(f"[ERRO] Erro {filename}: {str(e)}")
+            print(f"[ERRO] Batch do projeto {key} falhou: {e}")
             import traceback
             traceback.print_exc()
-            error_msg = str(e)[:500]  # Limitar tamanho da mensagem
-            
-            # Salvar erro no banco
-            try:
-                supabase.table(settings.TABLE_GERENCIAMENTO).update(
-                    {"status": "ERRO", "error_message": error_msg}
-                ).eq("id", doc_id_db).execute()
-            except Exception as update_error:
-                print(f"[AVISO] Erro ao atualizar status: {update_error}")
-            
         finally:
-            # Limpar arquivo temporário local
-            if tmp_path and os.path.exists(tmp_path):
-                try:
-                    os.remove(tmp_path)
-                except Exception as cleanup_error:
-                    print(f"[AVISO] Erro ao limpar arquivo temporário: {cleanup_error}")
+            with _batch_projects_lock:
+                _batch_projects.discard(key)
+    
+    threading.Thread(target=run, name=f"batch-{key}", daemon=True).start()
+    print(f"[BATCH] Processamento via Batch API iniciado (projeto: {key})")
 
 def main_loop():
     # Inicialização
-    global supabase, ai_client, semaphore
-    
-    supabase = create_client(settings.SUPABASE_URL, settings.SUPABASE_KEY)
-    
-    # ai_client = GeminiClient()
     try:
-        ai_client = OpenAIClient()
+        init_clients()
     except Exception as e:
         print(f"[ERRO] Erro ao iniciar OpenAI: {e}")
         return
 
-    semaphore = threading.Semaphore(settings.MAX_WORKERS)
-    
     # Verificar se há prompt configurado (qualquer projeto ou legado)
     test_prompt = load_prompt_from_db(supabase, None)
     if not test_prompt:
@@ -423,48 +738,69 @@ def main_loop():
         print("   Execute: create_prompt_table.sql no Supabase primeiro")
         return
     
+    # Processos de extração aquecem seus próprios conversores Docling no start
+    pipeline = ExtractionPipeline()
+    notifier = get_job_notifier()
+    
     print("[OK] Worker CSV iniciado!")
-    print(f"   - Threads: {settings.MAX_WORKERS}")
-    print(f"   - Arquivo de saída: {CSV_OUTPUT}")
+    print(f"   - Processos de extração: {pipeline.extraction_processes}")
+    print(f"   - Threads de IA: {pipeline.llm_workers} (fila: {settings.EXTRACTION_QUEUE_SIZE})")
+    print(f"   - Arquivo de saída: {export_output()}")
     print(f"   - Prompt: Carregado do Supabase (atualizado dinamicamente)")
     print(f"   - Modelo: {ai_client.model_name}")
+    print(f"   - Cache de respostas: {'DESATIVADO' if not settings.LLM_CACHE_ENABLED else ('BYPASS' if settings.LLM_CACHE_BYPASS else settings.LLM_CACHE_PATH)}")
+    print(f"   - Disparos: {'LISTEN/NOTIFY + polling a cada ' + str(settings.JOB_POLL_FALLBACK_SECONDS) + 's' if notifier.enabled else 'polling a cada 5s'}")
     print()
     
-    executor = ThreadPoolExecutor(max_workers=settings.MAX_WORKERS)
     TABLE_PROCESSAR_AGORA = "processar_agora"
+    last_lease_renewal = time.time()
     
     while True:
         try:
+            # Mantém as reservas dos documentos em andamento (worker vivo não perde a lease)
+            if time.time() - last_lease_renewal >= settings.CLAIM_LEASE_RENEW_SECONDS:
+                renew_leases(supabase)
+                last_lease_renewal = time.time()
+            
+            # Pipeline saturado: aguarda um documento terminar (acordado por _done; timeout para renovar leases)
+            if not pipeline.wait_for_capacity(timeout=settings.CLAIM_LEASE_RENEW_SECONDS):
+                continue
+            
             # Só processa quando houver registro em processar_agora (botão "Iniciar processamento")
-            trigger_resp = supabase.table(TABLE_PROCESSAR_AGORA).select("id, projeto_id").limit(settings.MAX_WORKERS).execute()
+            trigger_resp = supabase.table(TABLE_PROCESSAR_AGORA).select("*").limit(settings.MAX_WORKERS).execute()
             triggers = trigger_resp.data if trigger_resp.data else []
             
             if not triggers:
-                time.sleep(5)
+                # Aguarda o NOTIFY do insert em processar_agora (ou o próximo poll)
+                notifier.wait(CHANNEL_PROCESSAR_AGORA, notifier.idle_seconds(5))
                 continue
             
             # Para cada disparo, busca PENDENTES do projeto e processa
             for trigger in triggers:
                 projeto_id = trigger.get("projeto_id")
+                # Reprocessamento forçado: ignora respostas da IA em cache
+                force_reprocess = bool(trigger.get("forcar_reprocessamento"))
                 try:
-                    query = supabase.table(settings.TABLE_GERENCIAMENTO).select("*").eq("status", "PENDENTE").not_.is_("storage_path", "null").limit(settings.MAX_WORKERS)
-                    if projeto_id:
-                        query = query.eq("projeto_id", projeto_id)
-                    response = query.execute()
-                    files = response.data if response.data else []
+                    # Modo Batch API: reprocessamento em massa (custo menor, sem pressa)
+                    if str(trigger.get("modo") or "").upper() == "BATCH":
+                        start_batch_mode(projeto_id, force_reprocess, pipeline.process_pool)
+                        continue
+                    
+                    # Reserva atômica: outros workers não recebem os mesmos documentos
+                    files = claim_documents(supabase, projeto_id, settings.MAX_WORKERS)
                     if files:
                         print(f"Processando {len(files)} arquivo(s) (projeto: {projeto_id or 'todos'})")
+                        print(f"   Em andamento: {pipeline.in_flight} | Fila IA: {pipeline.llm_queue.qsize()}")
+                        print(f"   Headroom OpenAI: {ai_client.rate_limiter.format_headroom()}")
+                        batch = BatchStats(f"projeto {projeto_id or 'todos'}", len(files))
                         for file_record in files:
-                            executor.submit(process_file_task, file_record)
-                        time.sleep(2)
+                            pipeline.submit(file_record, batch, force_reprocess=force_reprocess)
                 finally:
                     supabase.table(TABLE_PROCESSAR_AGORA).delete().eq("id", trigger["id"]).execute()
-            
-            time.sleep(2)
 
         except KeyboardInterrupt:
             print("\nWorker interrompido pelo usuario")
-            executor.shutdown(wait=True)
+            pipeline.shutdown()
             break
         except Exception as e:
             print(f"[AVISO] Erro no loop: {e}")
@@ -472,5 +808,14 @@ def main_loop():
             traceback.print_exc()
             time.sleep(5)
 
+def run():
+    """Inicia o worker no modo configurado em WORKER_MODE (threads ou async)"""
+    if settings.WORKER_MODE == "async":
+        import asyncio
+        import async_worker
+        asyncio.run(async_worker.main_loop_async())
+    else:
+        main_loop()
+
 if __name__ == "__main__":
-    main_loop()
+    run()
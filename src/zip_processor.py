@@ -1,65 +1,122 @@
-import io
 import zipfile
 import requests
 import fitz  # PyMuPDF
 import os
 import tempfile
+import threading
+import unicodedata
 from datetime import datetime
-from supabase import create_client
+from supabase_pool import get_supabase_client
 from config import settings
 from browser_downloader import BrowserDownloader
+from http_downloader import ZipDownloader, HttpRangeFile
 from openai_client import OpenAIClient
 
+
+def normalize_text(text):
+    """Remove acentos e converte para minúsculas"""
+    text = unicodedata.normalize('NFKD', text)
+    text = text.encode('ASCII', 'ignore').decode('ASCII')
+    return text.lower()
+
+
+def select_zip_members(names):
+    """
+    Filters ZIP member names with "analise" OR "formulario" (case/accent-insensitive).
+    Returns (pdf_files, excel_files).
+    """
+    pdf_files = []
+    excel_files = []
+    for f in names:
+        normalized = normalize_text(f)
+        # Busca por "analise" OU "formulario"
+        if "analise" in normalized or "formulario" in normalized:
+            if f.lower().endswith('.pdf'):
+                pdf_files.append(f)
+            elif f.lower().endswith('.xlsx') or f.lower().endswith('.xls'):
+                excel_files.append(f)
+    return pdf_files, excel_files
+
+
+class CaseZipScan:
+    """
+    Shared by the ZIPs of one case scanned in parallel: the first ZIP with a valid
+    form claims the registration and the others stop early.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._claimed = False
+
+    @property
+    def done(self) -> bool:
+        return self._claimed
+
+    def claim(self) -> bool:
+        with self._lock:
+            if self._claimed:
+                return False
+            self._claimed = True
+            return True
+
+    def release(self):
+        """Registration failed: lets another ZIP of the case register its form"""
+        with self._lock:
+            self._claimed = False
+
+
+ALREADY_FOUND = "Formulário já registrado por outro ZIP do caso."
+PDF_KEYWORDS = ["FORMULARIO", "ANALISE", "SINISTRO"]
+
+
+def find_keywords(text) -> set:
+    """PDF_KEYWORDS present in the text (case/accent-insensitive); shared by local scoring and Vision OCR"""
+    normalized = normalize_text(text or "").upper()
+    return {kw for kw in PDF_KEYWORDS if kw in normalized}
+
+
 class ZipProcessor:
     def __init__(self):
-        # Use Service Role Key to bypass RLS for storage uploads
-        self.supabase = create_client(settings.SUPABASE_URL, settings.SUPABASE_SERVICE_ROLE_KEY)
+        # Use Service Role Key to bypass RLS for storage uploads (shared HTTP pool)
+        self.supabase = get_supabase_client(service_role=True)
         self.browser_downloader = BrowserDownloader()
+        # HTTP direto primeiro; navegador só quando a página exige JavaScript
+        self.zip_downloader = ZipDownloader(self.browser_downloader)
         # Initialize OpenAI client for OCR validation
         try:
             self.ai_client = OpenAIClient()
         except Exception as e:
             print(f"[AVISO] Não foi possível inicializar OpenAI para OCR: {e}")
             self.ai_client = None
+        # PDFs decididos localmente vs. com Vision OCR
+        self.validation_stats = {"local": 0, "ocr": 0}
+        self._validation_lock = threading.Lock()
 
-    def process_zip_url(self, case_number: str, zip_url: str, case_id: int, projeto_id: str = None):
+    def process_zip_url(self, case_number: str, zip_url: str, case_id: int, projeto_id: str = None,
+                        scan: CaseZipScan = None):
         """
         Downloads ZIP, finds valid PDF or Excel, uploads to Storage, and registers in DB.
         Priority: PDF first, then Excel as fallback.
+        With `scan`, stops early (result "skipped") once another ZIP of the case registered its form.
         """
+        claimed = False
         try:
-            # 1. Download ZIP using browser (handles JavaScript redirects)
-            print(f"   Baixando ZIP via navegador: {zip_url[:50]}...")
-            zip_bytes = self.browser_downloader.download_file(zip_url, timeout_ms=60000)
-            zip_buffer = io.BytesIO(zip_bytes)
+            if scan is not None and scan.done:
+                return {"success": False, "skipped": True, "error": ALREADY_FOUND}
+            
+            # 1. Download ZIP (direct HTTP, browser fallback for JavaScript pages)
+            print(f"   Baixando ZIP: {zip_url[:50]}...")
+            # Spooled temp file (small ZIPs in memory, large ones on disk), or a remote
+            # HttpRangeFile when the server supports Range (only the needed bytes are fetched)
+            zip_file = self.zip_downloader.download_to_file(zip_url, timeout_ms=60000)
             
-            # 2. Open ZIP and find files
+            # 2. Open ZIP and find files (only the matching members are read)
             found_valid_file = False
             error_msg = None
             
-            with zipfile.ZipFile(zip_buffer) as z:
-                # Filter files with "analise" OR "formulario" in the name (case-insensitive, accent-insensitive)
-                import unicodedata
-                import re
-                
-                def normalize_text(text):
-                    """Remove acentos e converte para minúsculas"""
-                    text = unicodedata.normalize('NFKD', text)
-                    text = text.encode('ASCII', 'ignore').decode('ASCII')
-                    return text.lower()
-                
-                all_files = z.namelist()
-                pdf_files = []
-                excel_files = []
-                
-                for f in all_files:
-                    normalized = normalize_text(f)
-                    # Busca por "analise" OU "formulario"
-                    if "analise" in normalized or "formulario" in normalized:
-                        if f.lower().endswith('.pdf'):
-                            pdf_files.append(f)
-                        elif f.lower().endswith('.xlsx') or f.lower().endswith('.xls'):
-                            excel_files.append(f)
+            with zip_file, zipfile.ZipFile(zip_file) as z:
+                # Only the central directory is needed here; with HTTP Range nothing else is downloaded yet
+                pdf_files, excel_files = select_zip_members(z.namelist())
                 
                 print(f"   Encontrados: {len(pdf_files)} PDF(s) e {len(excel_files)} Excel(s) com 'analise'")
                 
@@ -88,11 +145,13 @@ class ZipProcessor:
                 if not valid_file_bytes and pdf_files:
                     print("   Excel não encontrado. Tentando PDF como fallback...")
                     for filename in pdf_files:
+                        if scan is not None and scan.done:
+                            break
                         print(f"   Verificando PDF: {filename}")
                         with z.open(filename) as f_pdf:
                             pdf_bytes = f_pdf.read()
                             
-                            if self._validate_pdf_content(pdf_bytes):
+                            if self._validate_pdf_content(pdf_bytes, filename):
                                 print(f"   ✅ PDF válido encontrado: {filename}")
                                 valid_file_bytes = pdf_bytes
                                 valid_filename = filename
@@ -102,10 +161,22 @@ class ZipProcessor:
                                 print(f"   ❌ PDF inválido (não é Formulário de Sinistro)")
                 
                 if not valid_file_bytes:
+                    if scan is not None and scan.done:
+                        return {"success": False, "skipped": True, "error": ALREADY_FOUND}
                     error_msg = "Nenhum arquivo válido encontrado (PDF deve ser Formulário de Sinistro)."
                     print(f"   [AVISO] {error_msg}")
                     return {"success": False, "error": error_msg}
                 
+                # Only one ZIP per case registers its form
+                if scan is not None:
+                    if not scan.claim():
+                        print(f"   {ALREADY_FOUND} Pulando.")
+                        return {"success": False, "skipped": True, "error": ALREADY_FOUND}
+                    claimed = True
+                
+                if isinstance(zip_file, HttpRangeFile):
+                    print(f"   ⚡ Range: {zip_file.summary()}")
+                
                 # 5. Sanitize filename for Supabase Storage
                 import unicodedata
                 import re
@@ -178,55 +249,85 @@ class ZipProcessor:
                 return {"success": False, "error": "Nenhum arquivo válido encontrado."}
 
         except Exception as e:
+            if claimed:
+                scan.release()
             print(f"   [ERRO] Erro processando ZIP: {e}")
             import traceback
             traceback.print_exc()
             return {"success": False, "error": str(e)}
 
-    def _validate_pdf_content(self, pdf_bytes: bytes) -> bool:
+    def _score_pdf_locally(self, doc, filename: str = None) -> dict:
+        """
+        Local signals (no API call): keywords across all pages (reading the text layer
+        is cheap next to a Vision call), in the PDF metadata and in the filename,
+        plus the text-layer density (chars per page).
+        """
+        pages = len(doc)
+        text = "".join(page.get_text() for page in doc)
+        metadata = " ".join(str(v) for v in (doc.metadata or {}).values() if v)
+        
+        text_keywords = find_keywords(text)
+        return {
+            "text_keywords": text_keywords,
+            "all_keywords": text_keywords | find_keywords(metadata) | find_keywords(os.path.basename(filename or "")),
+            "chars_per_page": len(text.strip()) / pages if pages else 0,
+            "preview": text[:200],
+        }
+
+    def _record_validation(self, used_ocr: bool):
+        with self._validation_lock:
+            self.validation_stats["ocr" if used_ocr else "local"] += 1
+            local, ocr = self.validation_stats["local"], self.validation_stats["ocr"]
+        print(f"   📊 Validação de PDF: {local} decidida(s) localmente (OCR evitado), {ocr} com OCR")
+
+    def _validate_pdf_content(self, pdf_bytes: bytes, filename: str = None) -> bool:
         """
         Checks if document contains keywords: formulario, analise, sinistro
         Requires at least 2 out of 3 keywords to be present
-        Uses OCR fallback if text extraction fails or keywords not found
+        Local scoring first (all pages, metadata, filename, text density);
+        Vision OCR only when the local result is ambiguous
         """
         try:
             print(f"\n   🔍 [DEBUG] Iniciando validação de PDF ({len(pdf_bytes)} bytes)")
             
-            # Try standard text extraction first
-            doc = fitz.open(stream=pdf_bytes, filetype="pdf")
-            if len(doc) < 1:
-                print("   ❌ [DEBUG] PDF vazio ou sem páginas")
-                return False
-            
-            text = doc[0].get_text().upper()
-            print(f"   📄 [DEBUG] Texto extraído: {len(text)} caracteres")
-            if len(text) > 0:
-                print(f"   📝 [DEBUG] Preview: {text[:200]}...")
-            
-            # Normalize text (remove accents)
-            import unicodedata
-            def normalize(s):
-                s = unicodedata.normalize('NFKD', s)
-                return s.encode('ASCII', 'ignore').decode('ASCII').upper()
-            
-            normalized_text = normalize(text)
-            
-            # Keywords to search for (at least 2 must be present)
-            keywords = ["FORMULARIO", "ANALISE", "SINISTRO"]
-            found_keywords = sum(1 for kw in keywords if kw in normalized_text)
+            with fitz.open(stream=pdf_bytes, filetype="pdf") as doc:
+                if len(doc) < 1:
+                    print("   ❌ [DEBUG] PDF vazio ou sem páginas")
+                    return False
+                score = self._score_pdf_locally(doc, filename)
+            found_keywords = len(score["text_keywords"])
+            dense_text = score["chars_per_page"] >= settings.PDF_TEXT_DENSE_CHARS
             
-            print(f"   🔎 [DEBUG] Palavras-chave encontradas: {found_keywords}/3")
-            for kw in keywords:
-                status = "✅" if kw in normalized_text else "❌"
+            print(f"   📄 [DEBUG] Texto: {score['chars_per_page']:.0f} caracteres/página")
+            if score["preview"]:
+                print(f"   📝 [DEBUG] Preview: {score['preview'].upper()}...")
+            print(f"   🔎 [DEBUG] Palavras-chave no texto: {found_keywords}/3, "
+                  f"com metadados e nome: {len(score['all_keywords'])}/3")
+            for kw in PDF_KEYWORDS:
+                status = "✅" if kw in score["text_keywords"] else "❌"
                 print(f"      {status} {kw}")
             
-            # If found at least 2 keywords with standard extraction
-            if len(text.strip()) > 20 and found_keywords >= 2:
+            # Texto com pelo menos 2 palavras-chave: formulário confirmado
+            if found_keywords >= 2:
                 print(f"   ✅ Documento válido: encontradas {found_keywords}/3 palavras-chave")
+                self._record_validation(used_ocr=False)
                 return True
             
-            # If not found or text too short, try OCR
+            # Camada de texto real (não é digitalizado) e nenhuma palavra-chave: outro documento
+            if dense_text and found_keywords == 0:
+                print("   ❌ Texto extraível sem nenhuma palavra-chave: não é o formulário")
+                self._record_validation(used_ocr=False)
+                return False
+            
+            # Digitalizado, mas nome/metadados trazem as 3 palavras-chave
+            if not dense_text and len(score["all_keywords"]) == len(PDF_KEYWORDS):
+                print("   ✅ Documento válido: nome e metadados confirmam o formulário")
+                self._record_validation(used_ocr=False)
+                return True
+            
+            # Ambíguo: OCR (contado como não decidido localmente mesmo sem cliente OpenAI)
             print(f"   ⚠️ Apenas {found_keywords}/3 palavras-chave encontradas. Tentando OCR...")
+            self._record_validation(used_ocr=True)
             
             # Check if OpenAI client is available
             if not self.ai_client:
@@ -251,19 +352,13 @@ class ZipProcessor:
                         print(extracted_text)
                         print(f"   📥 [DEBUG] ===== FIM DO TEXTO =====\n")
                         
-                        # Now check for keywords in the extracted text
-                        import unicodedata
-                        def normalize(s):
-                            s = unicodedata.normalize('NFKD', s)
-                            return s.encode('ASCII', 'ignore').decode('ASCII').upper()
-                        
-                        normalized_ocr = normalize(extracted_text)
-                        keywords = ["FORMULARIO", "ANALISE", "SINISTRO"]
-                        found_in_ocr = sum(1 for kw in keywords if kw in normalized_ocr)
+                        # Now check for keywords in the extracted text (same rule as the local scoring)
+                        ocr_keywords = find_keywords(extracted_text)
+                        found_in_ocr = len(ocr_keywords)
                         
                         print(f"   🔎 [DEBUG] Palavras-chave no OCR: {found_in_ocr}/3")
-                        for kw in keywords:
-                            status = "✅" if kw in normalized_ocr else "❌"  
+                        for kw in PDF_KEYWORDS:
+                            status = "✅" if kw in ocr_keywords else "❌"
                             print(f"      {status} {kw}")
                         
                         # Accept if found at least 2 keywords
@@ -0,0 +1,18 @@
+"""
+Configuração comum dos testes: os módulos ficam em src/ (rodados como
+`python src/worker.py`) e o config exige algumas variáveis do .env.
+Os testes locais usam valores fictícios; os scripts de diagnóstico
+(test_connections.py etc.) continuam lendo o .env real.
+"""
+
+import os
+import sys
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+if SRC_DIR not in sys.path:
+    sys.path.insert(0, SRC_DIR)
+
+os.environ.setdefault("SUPABASE_URL", "http://127.0.0.1:1")
+os.environ.setdefault("SUPABASE_KEY", "test-key")
+os.environ.setdefault("GOOGLE_API_KEY", "test-key")
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
@@ -0,0 +1,67 @@
+"""
+Testa a reserva assíncrona de documentos (async_worker.claim_documents_async):
+só a função inexistente (PGRST202) desativa a RPC; outros 404 são erro.
+Também o caminho do Storage codificado na URL do download.
+Execute: python -m pytest tests/test_async_worker.py
+"""
+
+import asyncio
+
+import httpx
+import pytest
+
+import async_worker
+import worker
+
+
+def make_rest(handler):
+    rest = async_worker.AsyncSupabaseRest("http://supabase.test", "test-key", max_connections=2)
+    rest.http = httpx.AsyncClient(transport=httpx.MockTransport(handler), headers=rest.http.headers)
+    return rest
+
+
+@pytest.fixture(autouse=True)
+def claim_rpc(monkeypatch):
+    monkeypatch.setattr(worker, "_claim_rpc_available", True)
+
+
+def test_unrelated_404_keeps_claim_rpc_enabled():
+    def handler(request):
+        return httpx.Response(404, text="<html>Not Found</html>")
+
+    rest = make_rest(handler)
+    with pytest.raises(httpx.HTTPStatusError):
+        asyncio.run(async_worker.claim_documents_async(rest, None, 10))
+    assert worker.claim_rpc_available()
+
+
+def test_missing_function_falls_back_to_select_and_update():
+    calls = []
+
+    def handler(request):
+        calls.append((request.method, request.url.path))
+        if request.url.path.endswith("/rpc/claim_documents"):
+            return httpx.Response(404, json={"code": "PGRST202", "message": "Could not find the function"})
+        if request.method == "GET":
+            return httpx.Response(200, json=[{"id": 1}, {"id": 2}])
+        return httpx.Response(200, json=[{"id": 2}])
+
+    rest = make_rest(handler)
+    files = asyncio.run(async_worker.claim_documents_async(rest, None, 10))
+    assert not worker.claim_rpc_available()
+    assert [f["id"] for f in files] == [2]
+    assert [method for method, _ in calls] == ["POST", "GET", "PATCH"]
+    worker.release_claimed(2)
+
+
+def test_download_document_quotes_storage_path():
+    seen = []
+
+    def handler(request):
+        seen.append(request.url.raw_path.decode())
+        return httpx.Response(200, content=b"%PDF")
+
+    rest = make_rest(handler)
+    document = asyncio.run(rest.download_document("processos", "caso 1/peça #2?.pdf", ".pdf"))
+    document.close()
+    assert seen == ["/storage/v1/object/processos/caso%201/pe%C3%A7a%20%232%3F.pdf"]
@@ -0,0 +1,314 @@
+"""
+Testa o modo Batch API (batch_processor) contra um servidor HTTP local que
+imita os endpoints /v1/files e /v1/batches da OpenAI.
+Execute: python -m pytest tests/test_batch_api.py
+"""
+
+import json
+import threading
+import time
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import openai
+import pytest
+
+import batch_processor
+
+
+class FakeBatchAPI:
+    """Estado do stand-in: arquivos enviados e batches criados"""
+
+    def __init__(self, fail_ids=()):
+        self.files = {}
+        self.batches = {}
+        self.fail_ids = set(fail_ids)
+        self.retrieves = 0
+        self.fail_retrieves = 0  # Próximas N consultas ao batch respondem 500
+        self.lock = threading.Lock()
+
+    def run_batch(self, batch_id, input_file_id):
+        """Gera o arquivo de saída: cada requisição responde com o id e o tamanho do prompt"""
+        output_lines, error_lines = [], []
+        for line in self.files[input_file_id].decode("utf-8").splitlines():
+            req = json.loads(line)
+            if req["custom_id"] in self.fail_ids:
+                error_lines.append(json.dumps({
+                    "custom_id": req["custom_id"], "response": None,
+                    "error": {"code": "server_error", "message": "falha simulada"},
+                }))
+                continue
+            content = json.dumps({"custom_id": req["custom_id"], "model": req["body"]["model"],
+                                  "messages": len(req["body"]["messages"])})
+            output_lines.append(json.dumps({
+                "custom_id": req["custom_id"],
+                "response": {"status_code": 200, "body": {"choices": [{"message": {"content": content}}]}},
+                "error": None,
+            }))
+        batch = self.batches[batch_id]
+        batch["output_file_id"] = self._store("\n".join(output_lines).encode("utf-8"))
+        if error_lines:
+            batch["error_file_id"] = self._store("\n".join(error_lines).encode("utf-8"))
+        batch["request_counts"] = {"total": len(output_lines) + len(error_lines),
+                                   "completed": len(output_lines), "failed": len(error_lines)}
+
+    def _store(self, content: bytes) -> str:
+        file_id = f"file-{len(self.files) + 1}"
+        self.files[file_id] = content
+        return file_id
+
+
+def make_handler(api: FakeBatchAPI):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def _json(self, payload, status=200):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _body(self) -> bytes:
+            return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+        def do_POST(self):
+            with api.lock:
+                if self.path == "/v1/files":
+                    raw = self._body()
+                    msg = BytesParser().parsebytes(
+                        f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode("utf-8") + raw
+                    )
+                    content = next(p.get_payload(decode=True) for p in msg.get_payload()
+                                   if p.get_param("name", header="content-disposition") == "file")
+                    file_id = api._store(content)
+                    return self._json({"id": file_id, "object": "file", "bytes": len(content),
+                                       "created_at": 0, "filename": "batch_input.jsonl",
+                                       "purpose": "batch", "status": "processed"})
+                if self.path == "/v1/batches":
+                    req = json.loads(self._body())
+                    batch_id = f"batch_{len(api.batches) + 1}"
+                    api.batches[batch_id] = {
+                        "id": batch_id, "object": "batch", "endpoint": req["endpoint"],
+                        "input_file_id": req["input_file_id"], "completion_window": req["completion_window"],
+                        "status": "validating", "created_at": 0, "metadata": req.get("metadata"),
+                    }
+                    return self._json(api.batches[batch_id])
+            self._json({"error": {"message": "not found"}}, 404)
+
+        def do_GET(self):
+            with api.lock:
+                if self.path.startswith("/v1/batches/") and api.fail_retrieves:
+                    api.fail_retrieves -= 1
+                    return self._json({"error": {"message": "instável"}}, 500)
+                if self.path.startswith("/v1/batches/"):
+                    batch = api.batches[self.path.rsplit("/", 1)[1]]
+                    api.retrieves += 1
+                    # validating -> in_progress -> completed, como a API real
+                    if batch["status"] == "validating":
+                        batch["status"] = "in_progress"
+                    elif batch["status"] == "in_progress":
+                        api.run_batch(batch["id"], batch["input_file_id"])
+                        batch["status"] = "completed"
+                    return self._json(batch)
+                if self.path.startswith("/v1/files/") and self.path.endswith("/content"):
+                    content = api.files[self.path.split("/")[3]]
+                    self.send_response(200)
+                    self.send_header("Content-Type", "application/octet-stream")
+                    self.send_header("Content-Length", str(len(content)))
+                    self.end_headers()
+                    self.wfile.write(content)
+                    return
+            self._json({"error": {"message": "not found"}}, 404)
+
+    return Handler
+
+
+@pytest.fixture
+def fake_api():
+    api = FakeBatchAPI(fail_ids={"doc-3"})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(api))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    client = openai.OpenAI(api_key="test", base_url=f"http://127.0.0.1:{server.server_address[1]}/v1")
+    yield api, client
+    server.shutdown()
+
+
+def test_submit_poll_and_map_results(fake_api):
+    api, client = fake_api
+    body = {"model": "gpt-test", "messages": [{"role": "system", "content": "s"}, {"role": "user", "content": "u"}],
+            "response_format": {"type": "json_object"}, "temperature": 0.0}
+    requests = [(batch_processor.custom_id_for(i), body) for i in (1, 2, 3)]
+
+    batch_id = batch_processor.submit_batch(client, batch_processor.build_batch_jsonl(requests), {"projeto_id": "p"})
+    batch = batch_processor.wait_for_batch(client, batch_id, poll_seconds=0, timeout_seconds=10)
+    results = batch_processor.download_batch_results(client, batch)
+
+    assert batch.status == "completed"
+    assert api.retrieves == 2  # validating -> in_progress -> completed
+    # O JSONL enviado contém exatamente o corpo de chat completions
+    sent = [json.loads(line) for line in api.files["file-1"].decode("utf-8").splitlines()]
+    assert [line["custom_id"] for line in sent] == ["doc-1", "doc-2", "doc-3"]
+    assert all(line["url"] == "/v1/chat/completions" and line["body"] == body for line in sent)
+    # Cada resultado volta mapeado pelo custom_id
+    assert json.loads(results["doc-1"]["content"])["custom_id"] == "doc-1"
+    assert json.loads(results["doc-2"]["content"])["messages"] == 2
+    assert results["doc-3"] == {"error": "falha simulada"}
+
+
+def test_parse_batch_output_handles_http_errors_and_empty_content():
+    lines = "\n".join([
+        json.dumps({"custom_id": "doc-1", "response": {"status_code": 429, "body": {"error": {"message": "rate"}}}}),
+        json.dumps({"custom_id": "doc-2", "response": {"status_code": 200, "body": {"choices": [{"message": {"content": ""}}]}}}),
+        "",
+    ])
+    results = batch_processor.parse_batch_output(lines)
+    assert results["doc-1"] == {"error": "rate"}
+    assert results["doc-2"] == {"error": "Resposta vazia da OpenAI"}
+
+
+def test_wait_for_batch_keeps_polling_after_transient_errors(fake_api):
+    api, client = fake_api
+    client = client.with_options(max_retries=0)
+    body = {"model": "gpt-test", "messages": []}
+    batch_id = batch_processor.submit_batch(client, batch_processor.build_batch_jsonl([("doc-1", body)]))
+    api.fail_retrieves = 3
+    batch = batch_processor.wait_for_batch(client, batch_id, poll_seconds=0, timeout_seconds=10)
+    assert batch.status == "completed"
+    assert api.fail_retrieves == 0
+
+
+def test_uncollected_batch_marks_documents_and_is_recorded(fake_api, tmp_path, monkeypatch):
+    api, client = fake_api
+    state = str(tmp_path / "batches.jsonl")
+    monkeypatch.setattr(batch_processor.settings, "BATCH_STATE_PATH", state)
+    errors = []
+    monkeypatch.setattr(batch_processor.worker, "mark_error", lambda record, error: errors.append((record["id"], str(error))))
+
+    def timeout(*args, **kwargs):
+        raise TimeoutError("sem resposta")
+
+    monkeypatch.setattr(batch_processor, "wait_for_batch", timeout)
+    batch_processor.record_batch("batch_9", "proj", [1, 2])
+    runner = batch_processor.BatchRunner(None, type("AI", (), {"client": client})())
+    pending = {batch_processor.custom_id_for(i): {"record": {"id": i}} for i in (1, 2)}
+    prompt = type("Prompt", (), {"prompt_final": "p"})()
+    runner._collect("batch_9", pending, prompt, "proj", 0, batch_processor.TextSpool())
+
+    assert [doc_id for doc_id, _ in errors] == [1, 2]
+    assert all("--collect batch_9" in message for _, message in errors)
+    assert batch_processor.load_batch_record("batch_9")["doc_ids"] == ["1", "2"]
+    assert batch_processor.load_batch_record("batch_x") is None
+
+
+class FakeAIClient:
+    model_name = "gpt-test"
+
+    def __init__(self, client):
+        self.client = client
+
+    def build_messages(self, text, prompt):
+        return [{"role": "system", "content": prompt}, {"role": "user", "content": text}]
+
+    def build_request_body(self, messages):
+        return {"model": self.model_name, "messages": messages}
+
+
+_original_wait_for_batch = batch_processor.wait_for_batch
+
+
+def _wait_now(client, batch_id):
+    return _original_wait_for_batch(client, batch_id, poll_seconds=0, timeout_seconds=10)
+
+
+@pytest.fixture
+def project_run(fake_api, tmp_path, monkeypatch):
+    """run_project com o worker simulado: documentos 1..6, texto de ~1 KB cada"""
+    api, client = fake_api
+    monkeypatch.setattr(batch_processor.settings, "BATCH_STATE_PATH", str(tmp_path / "batches.jsonl"))
+    records = [{"id": i, "filename": f"doc{i}.pdf"} for i in range(1, 7)]
+    saved, errors = {}, []
+    monkeypatch.setattr(batch_processor.worker, "claim_documents", lambda *args, **kwargs: list(records))
+    monkeypatch.setattr(batch_processor.worker, "get_project_prompt",
+                        lambda projeto_id: type("Prompt", (), {"prompt_final": "p", "prompt_text": "p", "schema_keys": []})())
+    monkeypatch.setattr(batch_processor.worker, "extract_file_task", lambda record, pool: {
+        "record": record, "raw_text": f"texto {record['id']} " + "x" * 1000, "is_excel": False, "cache_hit": False,
+    })
+    monkeypatch.setattr(batch_processor.worker, "select_llm_text", lambda text, keys, is_excel: text)
+    monkeypatch.setattr(batch_processor.worker, "build_result", lambda record, raw_text, *args, **kwargs: raw_text)
+    monkeypatch.setattr(batch_processor.worker, "save_result", lambda record, data: saved.update({record["id"]: data}))
+    monkeypatch.setattr(batch_processor.worker, "mark_error", lambda record, error: errors.append(record["id"]))
+    monkeypatch.setattr(batch_processor, "get_response_cache", lambda: None)
+    monkeypatch.setattr(batch_processor, "wait_for_batch", _wait_now)
+    runner = batch_processor.BatchRunner(None, FakeAIClient(client), process_pool=object())
+    return api, runner, saved, errors
+
+
+def _input_files(api) -> list:
+    """custom_ids de cada JSONL enviado como entrada de batch, na ordem dos batches"""
+    inputs = [batch["input_file_id"] for batch in api.batches.values()]
+    return [[json.loads(line)["custom_id"] for line in api.files[f].decode("utf-8").splitlines()] for f in inputs]
+
+
+def test_run_project_splits_batches_by_request_count(project_run, monkeypatch):
+    api, runner, saved, errors = project_run
+    monkeypatch.setattr(batch_processor.settings, "BATCH_MAX_REQUESTS", 4)
+    runner.run_project("proj")
+
+    files = _input_files(api)
+    assert [len(ids) for ids in files] == [4, 2]
+    assert sorted(sum(files, [])) == [f"doc-{i}" for i in range(1, 7)]
+    # Cada documento recebe o próprio texto bruto (lido do spool), exceto o que falhou no batch
+    assert errors == [3]
+    assert sorted(saved) == [1, 2, 4, 5, 6]
+    assert all(saved[i].startswith(f"texto {i} ") for i in saved)
+
+
+def test_run_project_splits_batches_by_size(project_run, monkeypatch):
+    api, runner, saved, errors = project_run
+    # Cada linha tem pouco mais de 1 KB: cabem duas por arquivo
+    monkeypatch.setattr(batch_processor.settings, "BATCH_MAX_FILE_MB", 2.5 / 1024)
+    runner.run_project("proj")
+
+    files = _input_files(api)
+    assert [len(ids) for ids in files] == [2, 2, 2]
+    assert all(len(api.files[b["input_file_id"]]) <= 2.5 * 1024 for b in api.batches.values())
+    assert len(saved) == 5 and errors == [3]
+    records = [json.loads(line) for line in open(batch_processor.settings.BATCH_STATE_PATH, encoding="utf-8")]
+    assert [r["batch_id"] for r in records] == list(api.batches)
+
+
+def test_batch_file_accepts_single_oversized_line():
+    batch_file = batch_processor.BatchFile(max_requests=10, max_bytes=10)
+    line = batch_processor.batch_line("doc-1", {"model": "m"})
+    assert batch_file.fits(line)
+    batch_file.add("doc-1", line, {})
+    assert not batch_file.fits(line)
+    batch_file.close()
+
+
+def test_text_spool_round_trip():
+    spool = batch_processor.TextSpool()
+    spool.put("doc-1", "primeiro ção")
+    spool.put("doc-2", "segundo")
+    assert spool.get("doc-2") == "segundo"
+    assert spool.get("doc-1") == "primeiro ção"
+    spool.close()
+
+
+def test_leases_are_renewed_while_the_batch_runs(monkeypatch):
+    renewals = []
+    monkeypatch.setattr(batch_processor.settings, "CLAIM_LEASE_RENEW_SECONDS", 0.01)
+    monkeypatch.setattr(batch_processor.worker, "renew_leases", lambda client: renewals.append(client))
+    runner = batch_processor.BatchRunner("supabase", None)
+    with runner._renewing_leases():
+        deadline = time.time() + 5
+        while len(renewals) < 3 and time.time() < deadline:
+            time.sleep(0.01)
+    count = len(renewals)
+    time.sleep(0.05)
+    assert count >= 3 and set(renewals) == {"supabase"}
+    assert len(renewals) == count  # Para de renovar ao fim da execução
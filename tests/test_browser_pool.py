@@ -0,0 +1,164 @@
+"""
+Testa o navegador compartilhado (browser_downloader.BrowserPool) com um
+Playwright falso: reciclagem de contextos após N usos ou erro, encerramento
+limpo da thread do loop e seletor lembrado por host tentado primeiro.
+Requer playwright instalado (importado por browser_downloader).
+Execute: python -m pytest tests/test_browser_pool.py
+"""
+
+import asyncio
+
+import pytest
+
+pytest.importorskip("playwright")
+
+import browser_downloader  # noqa: E402
+from browser_downloader import BrowserPool, DOWNLOAD_SELECTORS, ordered_selectors, remember_selector  # noqa: E402
+
+
+class FakeContext:
+    def __init__(self, number):
+        self.number = number
+        self.closed = False
+
+    async def close(self):
+        self.closed = True
+
+
+class FakeBrowser:
+    def __init__(self):
+        self.contexts = []
+        self.connected = True
+        self.closed = False
+
+    async def new_context(self, **kwargs):
+        context = FakeContext(len(self.contexts) + 1)
+        self.contexts.append(context)
+        return context
+
+    def is_connected(self):
+        return self.connected
+
+    async def close(self):
+        self.closed = True
+
+
+class FakePlaywright:
+    def __init__(self):
+        self.browsers = []
+        self.stopped = False
+        self.chromium = self
+
+    async def launch(self, **kwargs):
+        browser = FakeBrowser()
+        self.browsers.append(browser)
+        return browser
+
+    async def start(self):
+        return self
+
+    async def stop(self):
+        self.stopped = True
+
+
+@pytest.fixture
+def playwright(monkeypatch):
+    fake = FakePlaywright()
+    monkeypatch.setattr(browser_downloader, "async_playwright", lambda: fake)
+    return fake
+
+
+@pytest.fixture
+def make_pool(playwright):
+    pools = []
+
+    def make(size=1, context_max_uses=2, browser_max_downloads=0):
+        pool = BrowserPool(size, context_max_uses, browser_max_downloads)
+        pools.append(pool)
+        return pool
+
+    yield make
+    for pool in pools:
+        pool.close()
+
+
+async def context_number(context):
+    return context.number
+
+
+def test_context_is_recycled_after_max_uses(make_pool, playwright):
+    pool = make_pool(context_max_uses=2)
+    assert [pool.run_with_context(context_number) for _ in range(5)] == [1, 1, 2, 2, 3]
+    contexts = playwright.browsers[0].contexts
+    assert [c.closed for c in contexts] == [True, True, False]
+    assert pool.stats["contexts_created"] == 3 and pool.stats["contexts_recycled"] == 2
+
+
+def test_failed_download_recycles_the_context(make_pool, playwright):
+    pool = make_pool(context_max_uses=10)
+
+    async def fail(context):
+        raise RuntimeError("página quebrou")
+
+    with pytest.raises(RuntimeError):
+        pool.run_with_context(fail)
+    assert playwright.browsers[0].contexts[0].closed
+    assert pool.run_with_context(context_number) == 2
+
+
+def test_disconnected_browser_is_relaunched(make_pool, playwright):
+    pool = make_pool(context_max_uses=10)
+    pool.run_with_context(context_number)
+    playwright.browsers[0].connected = False
+    pool.run_with_context(context_number)
+    assert len(playwright.browsers) == 2 and pool.stats["launches"] == 2
+
+
+def test_close_stops_the_loop_thread(playwright):
+    pool = BrowserPool(1, 2, 0)
+    pool.run_with_context(context_number)
+    pool.close()
+    assert not pool._thread.is_alive() and pool._loop.is_closed()
+    assert playwright.browsers[0].closed and playwright.stopped
+    assert playwright.browsers[0].contexts[0].closed
+    pool.close()  # atexit depois de um close explícito: nada a fazer
+
+
+class FakeLocator:
+    def __init__(self, page, selector):
+        self.page, self.selector = page, selector
+
+    async def count(self):
+        self.page.tried.append(self.selector)
+        return 1 if self.selector in self.page.present else 0
+
+
+class FakePage:
+    def __init__(self, present):
+        self.present = set(present)
+        self.tried = []
+
+    def locator(self, selector):
+        return FakeLocator(self, selector)
+
+    async def wait_for_timeout(self, ms):
+        pass
+
+
+def test_remembered_selector_is_tried_first(monkeypatch):
+    monkeypatch.setattr(browser_downloader, "_host_selectors", {})
+    host = "files.salesforce.test"
+    assert ordered_selectors(host) == DOWNLOAD_SELECTORS
+    remember_selector(host, "a[download]")
+    assert ordered_selectors(host)[0] == "a[download]"
+    assert sorted(ordered_selectors(host)) == sorted(DOWNLOAD_SELECTORS)
+
+    page = FakePage(present={"button.downloadbutton", "a[download]"})
+    downloader = browser_downloader.BrowserDownloader(pool=object())
+    selector, _ = asyncio.run(downloader._find_download_button(page, host, lambda: False))
+    assert selector == "a[download]"
+    assert page.tried[0] == "a[download]"
+    # Outro host continua na ordem padrão
+    other = FakePage(present={"button.downloadbutton", "a[download]"})
+    selector, _ = asyncio.run(downloader._find_download_button(other, "outro.host", lambda: False))
+    assert selector == "button.downloadbutton"
@@ -0,0 +1,131 @@
+"""
+Testa o processamento dos ZIPs de um caso em paralelo (pipeline_manager):
+o primeiro ZIP com formulário cancela os downloads ainda não iniciados e o
+limite global de downloads (BoundedSemaphore) é sempre devolvido, inclusive
+em erros e cancelamentos.
+Requer playwright instalado (importado por zip_processor).
+Execute: python -m pytest tests/test_case_zip_scan.py
+"""
+
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("playwright")
+
+import pipeline_manager  # noqa: E402
+
+
+class FakeQuery:
+    def __init__(self, db, values):
+        self.db, self.values = db, values
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self
+
+    def execute(self):
+        if self.values is not None:
+            self.db.updates.append(self.values)
+        return SimpleNamespace(data=[{"id": 1, "retry_count": 0}])
+
+
+class FakeSupabase:
+    def __init__(self):
+        self.updates = []
+
+    def table(self, name):
+        return SimpleNamespace(
+            update=lambda values: FakeQuery(self, values),
+            select=lambda *args: FakeQuery(self, None),
+        )
+
+
+class FakeZipProcessor:
+    def __init__(self, results):
+        self.results = results
+        self.started = []
+        self.zip_downloader = SimpleNamespace(stats=SimpleNamespace(summary=lambda: "-"))
+
+    def process_zip_url(self, case_number, zip_url, case_id, projeto_id=None, scan=None):
+        self.started.append(zip_url)
+        # Semáforo global ocupado durante o processamento do ZIP
+        assert pipeline_manager.download_semaphore._value == 0
+        result = self.results[zip_url]
+        if callable(result):
+            result = result()
+        if isinstance(result, Exception):
+            raise result
+        if result["success"] and not scan.claim():
+            return {"success": False, "skipped": True, "error": "já registrado"}
+        return result
+
+
+@pytest.fixture
+def pipeline(monkeypatch):
+    def setup(results, case_concurrency):
+        db = FakeSupabase()
+        processor = FakeZipProcessor(results)
+        monkeypatch.setattr(pipeline_manager, "supabase", db)
+        monkeypatch.setattr(pipeline_manager, "zip_processor", processor)
+        monkeypatch.setattr(pipeline_manager, "semaphore", threading.Semaphore(1))
+        monkeypatch.setattr(pipeline_manager, "download_semaphore", threading.BoundedSemaphore(1))
+        monkeypatch.setattr(pipeline_manager.settings, "CASE_ZIP_CONCURRENCY", case_concurrency)
+        return db, processor
+    return setup
+
+
+def run_case(zip_urls):
+    pipeline_manager.process_case_task({"id": 1, "numero_caso": "C1", "projeto_id": "p1"}, zip_urls)
+
+
+def semaphore_released():
+    semaphore = pipeline_manager.download_semaphore
+    if not semaphore.acquire(blocking=False):
+        return False
+    semaphore.release()
+    # BoundedSemaphore: liberar além do valor inicial levanta ValueError
+    with pytest.raises(ValueError):
+        semaphore.release()
+    return True
+
+
+def test_success_cancels_remaining_downloads(pipeline):
+    ok = {"success": True, "files_processed": 1}
+    db, processor = pipeline({f"zip{n}": ok for n in range(1, 5)}, case_concurrency=1)
+    run_case([f"zip{n}" for n in range(1, 5)])
+    assert processor.started == ["zip1"]
+    assert db.updates[-1]["status"] == "CONCLUIDO"
+    assert semaphore_released()
+
+
+def test_zip_errors_release_the_global_limit(pipeline):
+    db, processor = pipeline({"zip1": RuntimeError("download falhou"), "zip2": RuntimeError("zip corrompido")},
+                             case_concurrency=2)
+    run_case(["zip1", "zip2"])
+    assert sorted(processor.started) == ["zip1", "zip2"]
+    assert db.updates[-1]["status"] == "ERRO"
+    assert "download falhou" in db.updates[-1]["error_message"]
+    assert semaphore_released()
+
+
+def test_failure_then_success_cancels_the_rest(pipeline):
+    results = {"zip1": RuntimeError("timeout"), "zip2": {"success": True}, "zip3": {"success": True}}
+    db, processor = pipeline(results, case_concurrency=1)
+    run_case(["zip1", "zip2", "zip3"])
+    assert processor.started == ["zip1", "zip2"]
+    assert db.updates[-1]["status"] == "CONCLUIDO"
+    assert semaphore_released()
+
+
+def test_download_waiting_on_the_global_limit_is_skipped_after_success(pipeline):
+    def slow_success():
+        time.sleep(0.3)  # zip2 já começou e espera pelo semáforo global
+        return {"success": True}
+
+    db, processor = pipeline({"zip1": slow_success, "zip2": {"success": True}}, case_concurrency=2)
+    run_case(["zip1", "zip2"])
+    assert processor.started == ["zip1"]
+    assert db.updates[-1]["status"] == "CONCLUIDO"
+    assert semaphore_released()
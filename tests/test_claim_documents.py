@@ -0,0 +1,146 @@
+"""
+Testa a reserva de documentos (worker.claim_documents e renew_leases) com um
+cliente Supabase falso: RPC atômica, fallback select + update condicional quando a
+função não existe (só ficam os ids que o update mudou) e renovação das leases.
+Execute: python -m pytest tests/test_claim_documents.py
+"""
+
+from types import SimpleNamespace
+
+import pytest
+
+import worker
+
+
+class FakeQuery:
+    """Builder encadeável do postgrest: guarda a operação e os filtros"""
+
+    def __init__(self, client, table, op, payload=None, kwargs=None):
+        self.client = client
+        self.call = {"table": table, "op": op, "payload": payload, "kwargs": kwargs or {}, "filters": []}
+
+    def __getattr__(self, name):
+        if name == "not_":
+            return self
+
+        def filter_(*args):
+            self.call["filters"].append((name, args))
+            return self
+        return filter_
+
+    def execute(self):
+        self.client.calls.append(self.call)
+        return SimpleNamespace(data=self.client.respond(self.call))
+
+
+class FakeTable:
+    def __init__(self, client, name):
+        self.client, self.name = client, name
+
+    def select(self, columns):
+        return FakeQuery(self.client, self.name, "select", columns)
+
+    def update(self, values, **kwargs):
+        return FakeQuery(self.client, self.name, "update", values, kwargs)
+
+
+class FakeSupabase:
+    def __init__(self, rpc=None, pending=(), transitioned=()):
+        self.calls = []
+        self.rpc_handler = rpc
+        self.pending = [{"id": doc_id, "filename": f"{doc_id}.pdf"} for doc_id in pending]
+        self.transitioned = list(transitioned)
+
+    def rpc(self, function, params):
+        query = FakeQuery(self, None, "rpc", params)
+        query.call["function"] = function
+        return query
+
+    def table(self, name):
+        return FakeTable(self, name)
+
+    def respond(self, call):
+        if call["op"] == "rpc":
+            return self.rpc_handler(call["function"], call["payload"])
+        if call["op"] == "select":
+            return self.pending
+        return [{"id": doc_id} for doc_id in self.transitioned]
+
+
+@pytest.fixture(autouse=True)
+def isolated_claims(monkeypatch):
+    monkeypatch.setattr(worker, "_claim_rpc_available", True)
+    monkeypatch.setattr(worker, "_claimed_ids", set())
+
+
+def missing_function(function, params):
+    raise Exception("{'code': 'PGRST202', 'message': 'Could not find the function public.claim_documents'}")
+
+
+def test_rpc_claims_and_tracks_documents():
+    client = FakeSupabase(rpc=lambda function, params: [{"id": "a"}, {"id": "b"}])
+    files = worker.claim_documents(client, "proj", 5, lease_seconds=60)
+    assert [f["id"] for f in files] == ["a", "b"]
+    assert sorted(worker.claimed_ids()) == ["a", "b"]
+    call = client.calls[0]
+    assert call["function"] == "claim_documents"
+    assert call["payload"] == {"p_projeto_id": "proj", "p_limit": 5, "p_worker_id": worker.WORKER_ID, "p_lease_seconds": 60}
+    assert worker.claim_rpc_available()
+
+
+def test_rpc_errors_other_than_missing_function_are_raised():
+    def boom(function, params):
+        raise Exception("connection reset")
+
+    with pytest.raises(Exception, match="connection reset"):
+        worker.claim_documents(FakeSupabase(rpc=boom), None, 5)
+    assert worker.claim_rpc_available()
+
+
+def test_fallback_keeps_only_rows_this_update_transitioned():
+    # Outro worker selecionou os mesmos ids e mudou "b" antes deste update
+    client = FakeSupabase(rpc=missing_function, pending=["a", "b", "c"], transitioned=["a", "c"])
+    files = worker.claim_documents(client, "proj", 3)
+    assert not worker.claim_rpc_available()
+    assert [f["id"] for f in files] == ["a", "c"]
+    assert sorted(worker.claimed_ids()) == ["a", "c"]
+    update = client.calls[-1]
+    assert update["op"] == "update" and update["payload"]["status"] == "PROCESSANDO"
+    assert ("eq", ("status", "PENDENTE")) in update["filters"]
+    assert ("in_", ("id", ["a", "b", "c"])) in update["filters"]
+    assert update["kwargs"]["returning"] == worker.ReturnMethod.representation
+
+
+def test_fallback_without_pending_documents_skips_update():
+    client = FakeSupabase(rpc=missing_function)
+    assert worker.claim_documents(client, None, 3) == []
+    assert [c["op"] for c in client.calls] == ["rpc", "select"]
+
+
+def test_renew_leases_sends_claimed_ids():
+    received = []
+    client = FakeSupabase(rpc=lambda function, params: received.append((function, params)) or [])
+    worker.track_claimed([{"id": 7}, {"id": 8}])
+    worker.release_claimed(8)
+    worker.renew_leases(client)
+    assert received == [("renew_document_leases", {
+        "p_worker_id": worker.WORKER_ID, "p_ids": ["7"], "p_lease_seconds": worker.settings.CLAIM_LEASE_SECONDS,
+    })]
+
+
+def test_renew_leases_is_noop_without_claims_or_rpc(monkeypatch):
+    client = FakeSupabase(rpc=lambda function, params: pytest.fail("RPC não deveria ser chamada"))
+    worker.renew_leases(client)
+    worker.track_claimed([{"id": 1}])
+    monkeypatch.setattr(worker, "_claim_rpc_available", False)
+    worker.renew_leases(client)
+    assert client.calls == []
+
+
+def test_renew_leases_error_is_only_logged(capsys):
+    def boom(function, params):
+        raise Exception("timeout")
+
+    worker.track_claimed([{"id": 1}])
+    worker.renew_leases(FakeSupabase(rpc=boom))
+    assert "Erro ao renovar leases: timeout" in capsys.readouterr().out
@@ -0,0 +1,77 @@
+"""
+Testa o pool de conversores Docling (ocupação, pico e aquecimento) e o resumo
+combinado dos pools dos processos de extração.
+Execute: python -m pytest tests/test_docling_pool.py
+"""
+
+import os
+import threading
+
+import docling_pool
+import extraction
+from docling_pool import ConverterPool, summarize_stats, PIPELINE_NO_OCR, PIPELINE_VLM
+
+
+def test_checkout_tracks_occupancy_and_peak(monkeypatch):
+    pool = ConverterPool({PIPELINE_NO_OCR: 2, PIPELINE_VLM: 1})
+    monkeypatch.setattr(pool, "_create", lambda kind: object())  # sem carregar modelos do Docling
+    inside = threading.Barrier(3, timeout=5)
+    release = threading.Event()
+
+    def use():
+        with pool.checkout(PIPELINE_NO_OCR):
+            inside.wait()
+            release.wait(5)
+
+    threads = [threading.Thread(target=use) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    inside.wait()
+    assert pool.stats()[PIPELINE_NO_OCR]["in_use"] == 2
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    stats = pool.stats()[PIPELINE_NO_OCR]
+    assert (stats["created"], stats["in_use"], stats["peak_in_use"], stats["idle"]) == (2, 0, 2, 2)
+
+
+def test_summarize_stats_combines_processes():
+    def stats(created, peak, warmup):
+        return {
+            PIPELINE_NO_OCR: {"size": 1, "created": created, "in_use": 0, "peak_in_use": peak,
+                              "idle": created, "warmup_seconds": warmup},
+            PIPELINE_VLM: {"size": 1, "created": 0, "in_use": 0, "peak_in_use": 0, "idle": 0, "warmup_seconds": 0.0},
+        }
+
+    summary = summarize_stats([stats(1, 1, 2.5), stats(1, 1, 3.0), stats(0, 0, 0.0)])
+    assert "Docling 'no_ocr': 3 processo(s), 2/3 conversor(es) criado(s), 0 em uso (pico 2), aquecimento 5.5s" in summary
+    assert summarize_stats([]) == "   Docling: nenhuma conversão neste processo"
+
+
+def test_extraction_reports_pool_stats_outside_the_cached_result(monkeypatch):
+    cached = {}
+    cache = type("Cache", (), {
+        "make_key": staticmethod(lambda data, sig, content_hash=None: "k"),
+        "get": lambda self, key: None,
+        "put": lambda self, key, value: cached.update({key: dict(value)}),
+    })()
+    monkeypatch.setattr(extraction, "get_extraction_cache", lambda: cache)
+    monkeypatch.setattr(extraction, "excel_to_text", lambda data: "planilha")
+    monkeypatch.setattr(extraction, "_process_pool_stats", {})
+
+    extracted, _ = extraction.extract_file_cached(b"xlsx", ".xlsx")
+    assert "pool_stats" not in extracted and "pool_stats" not in cached["k"]
+    assert list(extraction._process_pool_stats) == [os.getpid()]
+    assert "Docling 'no_ocr': 1 processo(s)" in extraction.converter_pool_summary()
+
+
+def test_extraction_process_uses_configured_sizes_and_warms_one(monkeypatch):
+    monkeypatch.setattr(extraction.settings, "DOCLING_POOL_SIZE", 3)
+    monkeypatch.setattr(extraction.settings, "DOCLING_VLM_POOL_SIZE", 2)
+    monkeypatch.setattr(ConverterPool, "_create", lambda self, kind: object())
+    monkeypatch.setattr(docling_pool, "_pool", None)  # restaurado ao fim do teste
+    extraction.init_extraction_process(*extraction.extraction_initargs())
+    stats = extraction.get_converter_pool().stats()
+    assert (stats[PIPELINE_NO_OCR]["size"], stats[PIPELINE_NO_OCR]["created"]) == (3, 1)
+    assert (stats[PIPELINE_VLM]["size"], stats[PIPELINE_VLM]["created"]) == (2, 0)
@@ -0,0 +1,91 @@
+"""
+Testa o DownloadedDocument: download em blocos fica em memória até o limite e vai
+para arquivo temporário acima dele, com a mesma chave de cache do conteúdo inteiro.
+Execute: python -m pytest tests/test_document_stream.py
+"""
+
+import io
+import os
+
+import pandas as pd
+
+from document_stream import DownloadedDocument, download_document
+from extraction_cache import ExtractionCache
+
+
+def chunks_of(data: bytes, size: int):
+    for start in range(0, len(data), size):
+        yield data[start:start + size]
+
+
+def test_small_download_stays_in_memory():
+    data = b"%PDF-1.4 " + bytes(range(256)) * 10
+    with DownloadedDocument(".pdf", max_memory_bytes=len(data)) as document:
+        for chunk in chunks_of(data, 100):
+            document.write(chunk)
+        document.finish()
+        assert document.in_memory
+        assert document.source == data
+
+
+def test_large_download_spills_to_temp_file_and_cleans_up():
+    data = os.urandom(50_000)
+    document = DownloadedDocument(".pdf", max_memory_bytes=10_000)
+    with document:
+        for chunk in chunks_of(data, 4096):
+            document.write(chunk)
+        document.finish()
+        assert not document.in_memory
+        assert document.source.endswith(".pdf")
+        with open(document.source, "rb") as f:
+            assert f.read() == data
+        path = document.path
+    assert not os.path.exists(path)
+
+
+def test_cache_key_matches_whole_content_key():
+    data = os.urandom(30_000)
+    expected = ExtractionCache.make_key(data, "pdf:v1")
+    with DownloadedDocument(max_memory_bytes=5_000) as streamed:
+        for chunk in chunks_of(data, 1000):
+            streamed.write(chunk)
+        streamed.finish()
+        assert ExtractionCache.make_key(None, "pdf:v1", content_hash=streamed.content_hash()) == expected
+        # content_hash() devolve uma cópia: a chave pode ser recalculada
+        assert ExtractionCache.make_key(None, "pdf:v1", content_hash=streamed.content_hash()) == expected
+
+
+def test_failed_download_removes_temp_file(monkeypatch):
+    created = []
+    original_spill = DownloadedDocument._spill
+
+    def spill(self):
+        original_spill(self)
+        created.append(self.path)
+
+    monkeypatch.setattr(DownloadedDocument, "_spill", spill)
+    monkeypatch.setattr("document_stream.settings.STORAGE_SPOOL_MAX_MB", 0.001)
+
+    def broken_download():
+        yield b"x" * 4096
+        raise ConnectionError("conexão interrompida")
+
+    try:
+        download_document(broken_download(), suffix=".pdf")
+    except ConnectionError:
+        pass
+    assert created and not os.path.exists(created[0])
+
+
+def test_excel_serializer_reads_spilled_file():
+    from excel_serializer import serialize_excel
+
+    buffer = io.BytesIO()
+    pd.DataFrame({"processo": ["123", "456"], "valor": [10, 20]}).to_excel(buffer, index=False)
+    data = buffer.getvalue()
+    with DownloadedDocument(".xlsx", max_memory_bytes=100) as document:
+        for chunk in chunks_of(data, 1000):
+            document.write(chunk)
+        document.finish()
+        assert not document.in_memory
+        assert serialize_excel(document.source) == serialize_excel(data)
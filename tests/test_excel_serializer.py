@@ -0,0 +1,55 @@
+"""
+Testa a serialização de planilhas para o prompt (excel_serializer).
+Execute: python -m pytest tests/test_excel_serializer.py
+"""
+
+import io
+
+import pandas as pd
+import pytest
+
+from excel_serializer import serialize_excel
+from token_utils import count_tokens
+
+
+def make_workbook() -> bytes:
+    buffer = io.BytesIO()
+    with pd.ExcelWriter(buffer) as writer:
+        # Tabela começando na linha 3, com coluna e linhas vazias no meio
+        resumo = pd.DataFrame({
+            "Sinistro": [101, None, 103],
+            "Valor": [1500.5, None, 320.0],
+            "Vazia": [None, None, None],
+            "Parcelas": [1.0, None, 3.0],
+        })
+        resumo.to_excel(writer, sheet_name="Resumo", index=False, startrow=2)
+        pd.DataFrame({"Item": [f"item {i}" for i in range(500)]}).to_excel(writer, sheet_name="Itens", index=False)
+    return buffer.getvalue()
+
+
+WORKBOOK = make_workbook()
+
+
+def test_all_sheets_compact_csv():
+    text = serialize_excel(WORKBOOK, fmt="csv", max_tokens=10000)
+    assert "## Planilha: Resumo (2 linhas x 3 colunas)" in text
+    assert "Sinistro,Valor,Parcelas\n101,1500.5,1\n103,320.0,3" in text
+    assert "Vazia" not in text
+    assert "## Planilha: Itens (500 linhas x 1 colunas)" in text
+
+
+def test_markdown_table():
+    text = serialize_excel(WORKBOOK, fmt="markdown", max_tokens=10000)
+    assert "| Sinistro | Valor | Parcelas |\n| --- | --- | --- |\n| 101 | 1500.5 | 1 |" in text
+
+
+def test_token_budget_truncates_rows():
+    text = serialize_excel(WORKBOOK, fmt="csv", max_tokens=300)
+    assert count_tokens(text) <= 300 + 30  # aviso de linhas omitidas fica fora do orçamento
+    assert "linha(s) omitida(s)" in text
+    assert text.startswith("## Planilha: Resumo")
+
+
+def test_invalid_format():
+    with pytest.raises(ValueError):
+        serialize_excel(WORKBOOK, fmt="json")
@@ -0,0 +1,113 @@
+"""
+Testa o cache de extrações em disco (extraction_cache): chave pelo conteúdo +
+pipeline, eviction LRU pelo mtime até EXTRACTION_CACHE_MAX_MB, entradas
+corrompidas/parciais e acesso concorrente de várias threads.
+Execute: python -m pytest tests/test_extraction_cache.py
+"""
+
+import hashlib
+import os
+import threading
+
+from extraction_cache import ExtractionCache
+
+
+def entry(text: str) -> dict:
+    return {"text": text, "ocr": False}
+
+
+def test_key_depends_on_content_and_pipeline():
+    key = ExtractionCache.make_key(b"pdf", "docling-v1")
+    assert key == ExtractionCache.make_key(b"pdf", "docling-v1")
+    assert key != ExtractionCache.make_key(b"pdf", "docling-v2")
+    assert key != ExtractionCache.make_key(b"outro pdf", "docling-v1")
+    # Hash calculado no download em streaming: mesma chave, sem alterar o hash do chamador
+    streamed = hashlib.sha256(b"pdf")
+    assert ExtractionCache.make_key(None, "docling-v1", content_hash=streamed) == key
+    assert streamed.hexdigest() == hashlib.sha256(b"pdf").hexdigest()
+
+
+def test_roundtrip_and_counters(tmp_path):
+    cache = ExtractionCache(str(tmp_path), max_bytes=10_000)
+    assert cache.get("k") is None
+    cache.put("k", entry("Pagina 1 ação"))
+    assert cache.get("k") == entry("Pagina 1 ação")
+    assert cache.snapshot() == (1, 1)
+
+
+def test_eviction_removes_least_recently_used(tmp_path):
+    size = len(b'{"text": "xxxxxxxxxx", "ocr": false}')
+    # Limite para 3,5 entradas: a quarta estoura e a eviction (até 90%) remove só uma
+    cache = ExtractionCache(str(tmp_path), max_bytes=int(size * 3.5))
+    for number, key in enumerate(["a", "b", "c"]):
+        cache.put(key, entry("x" * 10))
+        os.utime(cache._path(key), (1000 + number, 1000 + number))
+    # Hit em "a" atualiza o mtime: "b" passa a ser a menos usada
+    assert cache.get("a") is not None
+    cache.put("d", entry("x" * 10))
+    assert cache.get("b") is None
+    assert all(cache.get(key) is not None for key in ("a", "c", "d"))
+    assert cache._total_bytes <= cache.max_bytes
+
+
+def test_overwrite_does_not_inflate_size_and_oversize_is_skipped(tmp_path):
+    cache = ExtractionCache(str(tmp_path), max_bytes=200)
+    cache.put("k", entry("x" * 50))
+    cache.put("k", entry("y" * 10))
+    assert cache._total_bytes == os.path.getsize(cache._path("k"))
+    cache.put("grande", entry("z" * 500))
+    assert cache.get("grande") is None
+
+
+def test_corrupt_or_partial_entry_is_a_miss_and_removed(tmp_path):
+    cache = ExtractionCache(str(tmp_path), max_bytes=10_000)
+    with open(cache._path("json"), "w", encoding="utf-8") as f:
+        f.write('{"text": "pela met')
+    with open(cache._path("utf8"), "wb") as f:
+        f.write('{"text": "aç'.encode("utf-8")[:-1])
+    # Temporário de uma escrita interrompida não conta como entrada
+    with open(os.path.join(str(tmp_path), "sobra.tmp"), "wb") as f:
+        f.write(b"x" * 100)
+    assert len(ExtractionCache(str(tmp_path), max_bytes=10_000)._entries()) == 2
+
+    assert cache.get("json") is None and cache.get("utf8") is None
+    assert not os.path.exists(cache._path("json")) and not os.path.exists(cache._path("utf8"))
+    cache.put("json", entry("ok"))
+    assert cache.get("json") == entry("ok")
+
+
+def test_concurrent_put_and_get(tmp_path):
+    cache = ExtractionCache(str(tmp_path), max_bytes=10_000_000)
+    values = {f"k{n}": entry(f"documento {n} " * 200) for n in range(8)}
+    errors, partial = [], []
+    start = threading.Barrier(16, timeout=10)
+
+    def writer(key):
+        try:
+            start.wait()
+            for _ in range(20):
+                cache.put(key, values[key])
+        except Exception as e:
+            errors.append(e)
+
+    def reader(key):
+        try:
+            start.wait()
+            for _ in range(50):
+                value = cache.get(key)
+                if value is not None and value != values[key]:
+                    partial.append(key)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=writer, args=(k,)) for k in values]
+    threads += [threading.Thread(target=reader, args=(k,)) for k in values]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == [] and partial == []
+    assert all(cache.get(key) == value for key, value in values.items())
+    assert cache._total_bytes == sum(size for _, size, _ in cache._entries())
+    assert not [name for name in os.listdir(str(tmp_path)) if name.endswith(".tmp")]
@@ -0,0 +1,52 @@
+"""
+Testa o cache de respostas na frente do Gemini (gemini_client._call_gemini_text):
+hit não chama _generate_text e a chave não colide com as entradas da OpenAI.
+Requer google-generativeai instalado.
+Execute: python -m pytest tests/test_gemini_cache.py
+"""
+
+import pytest
+
+pytest.importorskip("google.generativeai")
+
+import gemini_client  # noqa: E402
+import openai_client  # noqa: E402
+from llm_cache import ResponseCache  # noqa: E402
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    cache = ResponseCache(str(tmp_path / "llm.sqlite3"), ttl_seconds=3600)
+    monkeypatch.setattr(gemini_client, "get_response_cache", lambda: cache)
+    monkeypatch.setattr(gemini_client.settings, "LLM_CACHE_BYPASS", False)
+    return cache
+
+
+@pytest.fixture
+def client(monkeypatch):
+    client = gemini_client.GeminiClient()
+    client.calls = []
+
+    def generate(text, prompt):
+        client.calls.append((text, prompt))
+        return f'{{"chamada": {len(client.calls)}}}'
+
+    monkeypatch.setattr(client, "_generate_text", generate)
+    return client
+
+
+def test_cache_hit_skips_generate_text(cache, client):
+    assert client._call_gemini_text("texto", "prompt", projeto_id="p1") == '{"chamada": 1}'
+    assert client._call_gemini_text("texto", "prompt", projeto_id="p1") == '{"chamada": 1}'
+    assert client.calls == [("texto", "prompt")]
+    # Bypass por chamada força nova geração
+    assert client._call_gemini_text("texto", "prompt", use_cache=False) == '{"chamada": 2}'
+
+
+def test_gemini_and_openai_keys_do_not_collide(cache, client):
+    # Mesmo nome de modelo, prompt e texto: só o provedor diferencia as entradas
+    openai_key = cache.make_key(client.model_name, openai_client.SYSTEM_PROMPT, "prompt", "texto")
+    cache.put(openai_key, '{"openai": true}', client.model_name, "prompt")
+    assert client._call_gemini_text("texto", "prompt") == '{"chamada": 1}'
+    assert cache.make_key(client.model_name, gemini_client.CACHE_NAMESPACE, "prompt", "texto") != openai_key
+    assert cache.get(openai_key) == '{"openai": true}'
@@ -0,0 +1,157 @@
+"""
+Testa o download direto via HTTP (http_downloader) contra um servidor local que
+imita as páginas de download da Salesforce (formulário auto-submit, meta refresh,
+redirect por JavaScript e página que exige clique).
+Execute: python -m pytest tests/test_http_downloader.py
+"""
+
+import io
+import threading
+import zipfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+import pytest
+
+from http_downloader import DirectDownloader, DirectDownloadError, ZipDownloader, find_next_step
+
+
+def make_zip() -> bytes:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as z:
+        z.writestr("Formulario_Analise.pdf", b"%PDF-1.4 teste")
+    return buffer.getvalue()
+
+
+ZIP_BYTES = make_zip()
+
+PAGES = {
+    "/form": """<html><body onload="document.forms['dl'].submit()">
+        <form id="dl" name="dl" method="POST" action="/submit">
+          <input type="hidden" name="token" value="abc123">
+          <input type="hidden" name="file" value="caso-1">
+          <input type="submit" value="Download">
+        </form></body></html>""",
+    "/meta": """<html><head><meta http-equiv="refresh" content="0; url=/files/caso.zip"></head></html>""",
+    "/js": """<html><script>window.location.href = '/files/caso.zip';</script></html>""",
+    "/click": """<html><body><button class="downloadbutton" onclick="startDownload()">Fazer download</button></body></html>""",
+    "/html-file": """<html><body>Sessão expirada</body></html>""",
+}
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    posts = []
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body: bytes, headers: dict):
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path in PAGES:
+            return self._send(200, PAGES[self.path].encode("utf-8"), {"Content-Type": "text/html; charset=utf-8"})
+        if self.path == "/files/caso.zip":
+            return self._send(200, ZIP_BYTES, {
+                "Content-Type": "application/zip",
+                "Content-Disposition": 'attachment; filename="caso.zip"',
+            })
+        if self.path == "/files/not-a-zip":
+            return self._send(200, b"<html>erro</html>", {"Content-Type": "application/octet-stream"})
+        self._send(404, b"not found", {"Content-Type": "text/plain"})
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0))).decode("utf-8")
+        fields = {k: v[0] for k, v in parse_qs(body).items()}
+        StandInHandler.posts.append(fields)
+        if self.path == "/submit" and fields.get("token") == "abc123":
+            # Salesforce responde ao POST com redirect para o arquivo
+            return self._send(302, b"", {"Location": "/files/caso.zip"})
+        self._send(403, b"forbidden", {"Content-Type": "text/plain"})
+
+
+@pytest.fixture(scope="module")
+def base_url():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+
+
+class FakeBrowser:
+    def __init__(self):
+        self.calls = []
+
+    def download_to_file(self, url, timeout_ms=60000):
+        self.calls.append(url)
+        return io.BytesIO(ZIP_BYTES)
+
+
+def download(downloader, url) -> bytes:
+    with downloader.download_to_file(url) as f:
+        return f.read()
+
+
+@pytest.mark.parametrize("path", ["/form", "/meta", "/js", "/files/caso.zip"])
+def test_direct_download_follows_auto_flows(base_url, path):
+    assert download(DirectDownloader(), base_url + path) == ZIP_BYTES
+
+
+def test_auto_submit_form_posts_hidden_fields(base_url):
+    StandInHandler.posts.clear()
+    download(DirectDownloader(), base_url + "/form")
+    assert StandInHandler.posts == [{"token": "abc123", "file": "caso-1"}]
+
+
+def test_page_requiring_click_is_not_resolved():
+    assert find_next_step(PAGES["/click"], "http://host/click") is None
+
+
+@pytest.mark.parametrize("path", ["/click", "/html-file", "/files/not-a-zip"])
+def test_direct_download_rejects_non_zip(base_url, path):
+    with pytest.raises(DirectDownloadError):
+        download(DirectDownloader(), base_url + path)
+
+
+def test_zip_downloader_falls_back_to_browser_and_records_stats(base_url):
+    browser = FakeBrowser()
+    downloader = ZipDownloader(browser)
+    host = base_url.split("//", 1)[1]
+
+    assert download(downloader, base_url + "/form") == ZIP_BYTES
+    assert browser.calls == []
+
+    assert download(downloader, base_url + "/click") == ZIP_BYTES
+    assert browser.calls == [base_url + "/click"]
+
+    assert downloader.stats.success_rate(host, "direct") == 0.5
+    assert downloader.stats.success_rate(host, "browser") == 1.0
+
+
+def test_host_with_failing_direct_path_goes_straight_to_browser(base_url, monkeypatch):
+    monkeypatch.setattr("http_downloader.settings.DIRECT_DOWNLOAD_MIN_ATTEMPTS", 2)
+    browser = FakeBrowser()
+    downloader = ZipDownloader(browser)
+    host = base_url.split("//", 1)[1]
+
+    for _ in range(3):
+        download(downloader, base_url + "/click")
+
+    # Depois de 2 falhas o HTTP direto deixa de ser tentado para o host
+    assert downloader.stats.attempts(host, "direct") == 2
+    assert len(browser.calls) == 3
+
+
+def test_large_zip_is_spooled_to_disk(base_url, monkeypatch):
+    # Limite de ~50 bytes: o ZIP de teste passa do limite e vai para disco
+    monkeypatch.setattr("http_downloader.settings.ZIP_SPOOL_MAX_MB", 0.00005)
+    with DirectDownloader().download_to_file(base_url + "/files/caso.zip") as f:
+        assert f._rolled
+        with zipfile.ZipFile(f) as z:
+            assert z.read("Formulario_Analise.pdf") == b"%PDF-1.4 teste"
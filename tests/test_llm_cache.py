@@ -0,0 +1,94 @@
+"""
+Testa o cache de respostas da IA (llm_cache): TTL, invalidação por projeto quando
+o prompt muda, bypass (LLM_CACHE_BYPASS / use_cache=False) e chave separando
+modelo, system prompt, prompt do projeto e texto.
+Execute: python -m pytest tests/test_llm_cache.py
+"""
+
+import pytest
+
+import llm_cache
+import openai_client
+from llm_cache import ResponseCache
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return ResponseCache(str(tmp_path / "llm.sqlite3"), ttl_seconds=3600)
+
+
+def test_key_separates_model_system_prompt_prompt_and_text():
+    base = ("gpt-4o-mini", "system v1", "prompt", "texto")
+    key = ResponseCache.make_key(*base)
+    assert key == ResponseCache.make_key(*base)
+    for index, other in enumerate(["gpt-4o", "system v2", "prompt v2", "texto 2"]):
+        parts = list(base)
+        parts[index] = other
+        assert ResponseCache.make_key(*parts) != key
+    # Fronteira entre as partes faz parte da chave
+    assert ResponseCache.make_key("m", "s", "ab", "c") != ResponseCache.make_key("m", "s", "a", "bc")
+
+
+def test_ttl_expires_entries(cache, monkeypatch):
+    now = [1_000_000.0]
+    monkeypatch.setattr(llm_cache.time, "time", lambda: now[0])
+    cache.put("k", '{"a": 1}', "gpt", "prompt", projeto_id="p1")
+    now[0] += 3599
+    assert cache.get("k") == '{"a": 1}'
+    now[0] += 2
+    assert cache.get("k") is None
+    assert cache.purge_expired() == 1
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_prompt_change_invalidates_only_that_project(cache):
+    assert cache.sync_project_prompt("p1", "prompt v1") == 0
+    cache.put("p1-old", "r1", "gpt", "prompt v1", projeto_id="p1")
+    cache.put("p2", "r2", "gpt", "prompt v1", projeto_id="p2")
+    # Mesmo prompt: nada muda
+    assert cache.sync_project_prompt("p1", "prompt v1") == 0
+    assert cache.get("p1-old") == "r1"
+
+    assert cache.sync_project_prompt("p1", "prompt v2") == 1
+    assert cache.get("p1-old") is None
+    assert cache.get("p2") == "r2"
+
+    assert cache.invalidate_project("p2") == 1
+    assert cache.get("p2") is None
+
+
+class FakeOpenAIClient(openai_client.OpenAIClient):
+    def __init__(self):
+        self.model_name = "gpt-teste"
+        self.requests = []
+
+    def _request_completion(self, messages):
+        self.requests.append(messages)
+        return f'{{"chamada": {len(self.requests)}}}'
+
+
+@pytest.fixture
+def client(cache, monkeypatch):
+    monkeypatch.setattr(openai_client, "get_response_cache", lambda: cache)
+    monkeypatch.setattr(openai_client.settings, "LLM_CACHE_BYPASS", False)
+    return FakeOpenAIClient()
+
+
+def test_cache_hit_skips_the_api(client):
+    assert client._call_openai("texto", "prompt", projeto_id="p1") == '{"chamada": 1}'
+    assert client._call_openai("texto", "prompt", projeto_id="p1") == '{"chamada": 1}'
+    assert len(client.requests) == 1
+    # Outro prompt (nova versão) não reaproveita a resposta
+    client._call_openai("texto", "prompt v2", projeto_id="p1")
+    assert len(client.requests) == 2
+
+
+def test_bypass_calls_the_api_and_overwrites_the_entry(client, monkeypatch):
+    client._call_openai("texto", "prompt")
+    assert client._call_openai("texto", "prompt", use_cache=False) == '{"chamada": 2}'
+    monkeypatch.setattr(openai_client.settings, "LLM_CACHE_BYPASS", True)
+    assert client._call_openai("texto", "prompt") == '{"chamada": 3}'
+    monkeypatch.setattr(openai_client.settings, "LLM_CACHE_BYPASS", False)
+    # A resposta nova sobrescreveu a antiga
+    assert client._call_openai("texto", "prompt") == '{"chamada": 3}'
+    assert len(client.requests) == 3
@@ -0,0 +1,120 @@
+"""
+Testa a extração de PDFs em fatias de páginas: divisão com PyMuPDF, conversão em
+paralelo, markdown remontado na ordem das páginas e tempos por página.
+Execute: python -m pytest tests/test_pdf_shards.py
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import fitz
+import pytest
+
+import extraction
+from pdf_shards import merge_shards, slowest_pages, split_pdf
+
+
+def make_pdf(pages: int, blank=()) -> bytes:
+    doc = fitz.open()
+    for number in range(1, pages + 1):
+        page = doc.new_page()
+        if number not in blank:
+            page.insert_text((72, 72), f"Pagina {number}")
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def page_texts(data: bytes) -> list:
+    doc = fitz.open(stream=data, filetype="pdf")
+    texts = [page.get_text().strip() for page in doc]
+    doc.close()
+    return texts
+
+
+def test_split_pdf_keeps_page_order():
+    shards = split_pdf(make_pdf(10), shard_pages=4, min_pages=5)
+    assert [(first, pages) for first, pages, _ in shards] == [(1, 4), (5, 4), (9, 2)]
+    assert page_texts(shards[1][2]) == ["Pagina 5", "Pagina 6", "Pagina 7", "Pagina 8"]
+
+
+def test_small_pdf_is_not_split():
+    assert split_pdf(make_pdf(4), shard_pages=2, min_pages=5) is None
+    assert split_pdf(make_pdf(6), shard_pages=8, min_pages=5) is None
+
+
+def test_merge_and_slowest_pages():
+    merged = merge_shards([
+        {"first_page": 3, "text": "b", "ocr": True, "page_timings": [{"page": 3, "seconds": 5.0, "estimated": False}]},
+        {"first_page": 1, "text": "a", "ocr": False, "page_timings": [{"page": 1, "seconds": 0.5, "estimated": True}]},
+    ])
+    assert merged["text"] == "a\n\nb"
+    assert merged["ocr"] is True
+    assert slowest_pages(merged["page_timings"], limit=2) == "p.3 5.0s, p.1 0.5s (estimado)"
+
+
+@pytest.fixture
+def fake_docling(monkeypatch):
+    """Conversão Docling trocada por PyMuPDF; perfil por página só nas fatias que começam em 'Pagina 1'"""
+    calls = SimpleNamespace(no_ocr=[], vlm=[])
+
+    def convert(data):
+        texts = page_texts(data)
+        calls.no_ocr.append(texts)
+        timings = {}
+        if texts[0] == "Pagina 1":
+            item = SimpleNamespace(scope=SimpleNamespace(value="page"), times=[0.25] * len(texts))
+            timings = {"layout": item, "page_parse": item}
+        return "\n".join(t for t in texts if t), SimpleNamespace(timings=timings)
+
+    def convert_vlm(data):
+        pages = len(page_texts(data))
+        calls.vlm.append(pages)
+        return f"OCR de {pages} páginas", SimpleNamespace(timings={})
+
+    monkeypatch.setattr(extraction, "_convert_no_ocr", convert)
+    monkeypatch.setattr(extraction, "_convert_vlm", convert_vlm)
+    monkeypatch.setattr(extraction, "get_extraction_cache", lambda: None)
+    monkeypatch.setattr(extraction.settings, "PDF_SHARD_ENABLED", True)
+    monkeypatch.setattr(extraction.settings, "PDF_SHARD_PAGES", 3)
+    monkeypatch.setattr(extraction.settings, "PDF_SHARD_MIN_PAGES", 5)
+    return calls
+
+
+def test_extract_file_cached_converts_shards_in_parallel(fake_docling):
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        extracted, cache_hit = extraction.extract_file_cached(make_pdf(7), ".pdf", executor=executor)
+    assert not cache_hit
+    assert len(fake_docling.no_ocr) == 3 and fake_docling.vlm == []
+    assert extracted["text"] == "\n\n".join(["Pagina 1\nPagina 2\nPagina 3", "Pagina 4\nPagina 5\nPagina 6", "Pagina 7"])
+    timings = extracted["page_timings"]
+    assert [t["page"] for t in timings] == list(range(1, 8))
+    # Perfil do Docling: soma das etapas por página; sem perfil: tempo da fatia dividido
+    assert [t["seconds"] for t in timings[:3]] == [0.5, 0.5, 0.5]
+    assert not timings[0]["estimated"] and timings[3]["estimated"]
+
+
+def test_small_pdf_uses_single_conversion(fake_docling):
+    extracted, _ = extraction.extract_file_cached(make_pdf(2), ".pdf")
+    assert len(fake_docling.no_ocr) == 1
+    # Documento inteiro com pouco texto: fallback VLM como antes
+    assert fake_docling.vlm == [2]
+    assert extracted == {"text": "OCR de 2 páginas", "ocr": True}
+
+
+def test_nearly_blank_shard_does_not_trigger_ocr(fake_docling):
+    # Fatia 4-6 só com separadores em branco; o documento inteiro tem texto suficiente
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        extracted, _ = extraction.extract_file_cached(make_pdf(9, blank={4, 5, 6}), ".pdf", executor=executor)
+    assert len(fake_docling.no_ocr) == 3
+    assert fake_docling.vlm == []
+    assert not extracted["ocr"]
+    assert "Pagina 9" in extracted["text"]
+
+
+def test_scanned_document_ocr_decided_once_for_whole_document(fake_docling):
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        extracted, _ = extraction.extract_file_cached(make_pdf(7, blank=range(1, 8)), ".pdf", executor=executor)
+    assert fake_docling.vlm == [7]
+    assert extracted["ocr"] and extracted["text"] == "OCR de 7 páginas"
+    assert len(extracted["page_timings"]) == 7
@@ -0,0 +1,111 @@
+"""
+Testa a validação local do formulário nos PDFs dos ZIPs (zip_processor):
+aceite/recusa claros sem OCR, caso ambíguo indo para o Vision com as mesmas
+palavras-chave, palavras-chave em qualquer página e contagem de OCR evitado.
+Requer playwright instalado (importado por zip_processor).
+Execute: python -m pytest tests/test_pdf_validation.py
+"""
+
+import threading
+
+import fitz
+import pytest
+
+pytest.importorskip("playwright")
+
+import zip_processor  # noqa: E402
+from zip_processor import ZipProcessor, find_keywords  # noqa: E402
+
+FILLER = "Lorem ipsum dolor sit amet, consectetur adipiscing elit. " * 10
+
+
+def make_pdf(pages: list, metadata: dict = None) -> bytes:
+    doc = fitz.open()
+    for text in pages:
+        page = doc.new_page()
+        if text:
+            page.insert_textbox(fitz.Rect(36, 36, 560, 800), text)
+    if metadata:
+        doc.set_metadata(metadata)
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+class FakeVision:
+    def __init__(self, text):
+        self.text = text
+        self.calls = 0
+
+    def extract_text_with_vision(self, path):
+        self.calls += 1
+        return self.text
+
+
+def make_processor(ai_client=None):
+    processor = ZipProcessor.__new__(ZipProcessor)
+    processor.ai_client = ai_client
+    processor.validation_stats = {"local": 0, "ocr": 0}
+    processor._validation_lock = threading.Lock()
+    return processor
+
+
+@pytest.fixture(autouse=True)
+def dense_threshold(monkeypatch):
+    monkeypatch.setattr(zip_processor.settings, "PDF_TEXT_DENSE_CHARS", 300)
+
+
+def test_find_keywords_ignores_case_and_accents():
+    assert find_keywords("Formulário de Análise") == {"FORMULARIO", "ANALISE"}
+    assert find_keywords(None) == set()
+
+
+def test_clear_accept_without_ocr():
+    vision = FakeVision("")
+    processor = make_processor(vision)
+    assert processor._validate_pdf_content(make_pdf([f"FORMULÁRIO DE ANÁLISE DE SINISTRO\n{FILLER}"]))
+    assert vision.calls == 0
+    assert processor.validation_stats == {"local": 1, "ocr": 0}
+
+
+def test_keywords_on_any_page_are_found():
+    vision = FakeVision("")
+    processor = make_processor(vision)
+    pages = [FILLER] * 7 + [f"Formulário de análise\n{FILLER}"]
+    assert processor._validate_pdf_content(make_pdf(pages))
+    assert vision.calls == 0
+
+
+def test_clear_reject_dense_text_without_keywords():
+    vision = FakeVision("FORMULARIO ANALISE SINISTRO")
+    processor = make_processor(vision)
+    assert not processor._validate_pdf_content(make_pdf([FILLER, FILLER]))
+    assert vision.calls == 0
+    assert processor.validation_stats == {"local": 1, "ocr": 0}
+
+
+def test_scanned_pdf_with_keywords_in_name_and_metadata_skips_ocr():
+    vision = FakeVision("")
+    processor = make_processor(vision)
+    pdf = make_pdf([""], metadata={"title": "Formulário de Sinistro"})
+    assert processor._validate_pdf_content(pdf, "docs/analise.pdf")
+    assert vision.calls == 0
+
+
+@pytest.mark.parametrize("ocr_text, expected", [
+    ("Formulário de Análise de Sinistro", True),
+    ("Petição inicial, análise preliminar", False),
+])
+def test_ambiguous_pdf_goes_to_vision_with_the_same_keywords(ocr_text, expected):
+    vision = FakeVision(ocr_text)
+    processor = make_processor(vision)
+    # Pouco texto (digitalizado) com uma palavra-chave: ambíguo
+    assert processor._validate_pdf_content(make_pdf(["Sinistro"])) is expected
+    assert vision.calls == 1
+    assert processor.validation_stats == {"local": 0, "ocr": 1}
+
+
+def test_ambiguous_without_client_is_still_counted():
+    processor = make_processor(None)
+    assert processor._validate_pdf_content(make_pdf(["Sinistro"]))
+    assert processor.validation_stats == {"local": 0, "ocr": 1}
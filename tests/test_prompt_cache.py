@@ -0,0 +1,135 @@
+"""
+Testa o cache de prompts por projeto (prompt_cache): nova versão em
+prompt_config.updated_at recarrega o prompt e avisa on_change; erro ao consultar
+a versão ou ao recarregar mantém o último prompt válido.
+Execute: python -m pytest tests/test_prompt_cache.py
+"""
+
+import asyncio
+
+import pytest
+
+from prompt_cache import PromptCache
+
+
+class FakePromptConfig:
+    """prompt_config de um projeto: texto + updated_at, com contadores de consultas"""
+
+    def __init__(self, text="prompt v1", updated_at="2026-01-01T00:00:00"):
+        self.text = text
+        self.updated_at = updated_at
+        self.version_error = None
+        self.prompt_error = None
+        self.version_calls = 0
+        self.prompt_calls = 0
+
+    def fetch_version(self):
+        self.version_calls += 1
+        if self.version_error:
+            raise self.version_error
+        return self.updated_at
+
+    def fetch_prompt(self):
+        self.prompt_calls += 1
+        if self.prompt_error:
+            raise self.prompt_error
+        return self.text, self.updated_at
+
+    def save(self, text, updated_at):
+        self.text, self.updated_at = text, updated_at
+
+
+@pytest.fixture
+def changes():
+    return []
+
+
+@pytest.fixture
+def cache(changes):
+    # check_seconds=0: toda chamada consulta a versão
+    return PromptCache(lambda text: f"FINAL {text}", lambda text: text.split(), check_seconds=0,
+                       on_change=lambda projeto_id, final: changes.append((projeto_id, final)))
+
+
+def test_same_version_does_not_reload(cache):
+    config = FakePromptConfig()
+    first = cache.get("p1", config.fetch_version, config.fetch_prompt)
+    assert cache.get("p1", config.fetch_version, config.fetch_prompt) is first
+    assert (config.prompt_calls, config.version_calls) == (1, 1)
+
+
+def test_fresh_entry_skips_version_check():
+    cache = PromptCache(str, str.split, check_seconds=60)
+    config = FakePromptConfig()
+    cache.get("p1", config.fetch_version, config.fetch_prompt)
+    config.save("prompt v2", "2026-02-01T00:00:00")
+    assert cache.get("p1", config.fetch_version, config.fetch_prompt).prompt_text == "prompt v1"
+    assert config.version_calls == 0
+
+
+def test_bumped_updated_at_invalidates_the_prompt(cache, changes):
+    config = FakePromptConfig()
+    cache.get("p1", config.fetch_version, config.fetch_prompt)
+    config.save("prompt v2 valor", "2026-02-01T00:00:00")
+    entry = cache.get("p1", config.fetch_version, config.fetch_prompt)
+    assert entry.prompt_text == "prompt v2 valor"
+    assert entry.prompt_final == "FINAL prompt v2 valor"
+    assert entry.schema_keys == ["prompt", "v2", "valor"]
+    assert entry.version == "2026-02-01T00:00:00"
+    assert changes == [("p1", "FINAL prompt v1"), ("p1", "FINAL prompt v2 valor")]
+
+
+def test_resaved_without_changes_only_updates_version(cache, changes):
+    config = FakePromptConfig()
+    first = cache.get("p1", config.fetch_version, config.fetch_prompt)
+    config.save("prompt v1", "2026-03-01T00:00:00")
+    assert cache.get("p1", config.fetch_version, config.fetch_prompt) is first
+    assert first.version == "2026-03-01T00:00:00"
+    assert len(changes) == 1
+
+
+def test_version_fetch_error_keeps_last_good_prompt(cache):
+    config = FakePromptConfig()
+    first = cache.get("p1", config.fetch_version, config.fetch_prompt)
+    config.version_error = RuntimeError("supabase fora do ar")
+    assert cache.get("p1", config.fetch_version, config.fetch_prompt) is first
+    assert config.prompt_calls == 1
+
+
+def test_prompt_fetch_error_keeps_last_good_prompt(cache, capsys):
+    config = FakePromptConfig()
+    first = cache.get("p1", config.fetch_version, config.fetch_prompt)
+    config.save("prompt v2", "2026-02-01T00:00:00")
+    config.prompt_error = RuntimeError("timeout")
+    assert cache.get("p1", config.fetch_version, config.fetch_prompt) is first
+    assert "usando o último válido: timeout" in capsys.readouterr().out
+    # Recuperado: a versão nova é carregada
+    config.prompt_error = None
+    assert cache.get("p1", config.fetch_version, config.fetch_prompt).prompt_text == "prompt v2"
+
+
+def test_prompt_fetch_error_without_previous_value_is_raised(cache):
+    config = FakePromptConfig()
+    config.prompt_error = RuntimeError("timeout")
+    with pytest.raises(RuntimeError):
+        cache.get("p1", config.fetch_version, config.fetch_prompt)
+
+
+def test_async_get_reloads_on_new_version_and_falls_back_on_error(cache):
+    config = FakePromptConfig()
+
+    async def fetch_version():
+        return config.fetch_version()
+
+    async def fetch_prompt():
+        return config.fetch_prompt()
+
+    async def scenario():
+        first = await cache.get_async("p1", fetch_version, fetch_prompt)
+        config.save("prompt v2", "2026-02-01T00:00:00")
+        config.prompt_error = RuntimeError("timeout")
+        assert await cache.get_async("p1", fetch_version, fetch_prompt) is first
+        config.prompt_error = None
+        return await cache.get_async("p1", fetch_version, fetch_prompt)
+
+    assert asyncio.run(scenario()).prompt_text == "prompt v2"
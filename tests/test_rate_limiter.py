@@ -0,0 +1,157 @@
+"""
+Testa o limitador adaptativo da OpenAI (rate_limiter) com relógio falso:
+reabastecimento dos baldes, ajuste pelos headers x-ratelimit-*, 429 seguindo o
+reset informado, devolução da reserva em falhas e a métrica de headroom.
+Execute: python -m pytest tests/test_rate_limiter.py
+"""
+
+from types import SimpleNamespace
+
+import httpx
+import openai
+import pytest
+
+import openai_client
+import rate_limiter
+from rate_limiter import RateLimiter, parse_reset_duration
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """time.monotonic/time.sleep do limitador num relógio controlado pelo teste"""
+    state = SimpleNamespace(now=1000.0, slept=[])
+
+    def sleep(seconds):
+        state.slept.append(seconds)
+        state.now += seconds
+
+    monkeypatch.setattr(rate_limiter.time, "monotonic", lambda: state.now)
+    monkeypatch.setattr(rate_limiter.time, "sleep", sleep)
+    return state
+
+
+def test_parse_reset_duration():
+    assert parse_reset_duration("6m0s") == 360
+    assert parse_reset_duration("1.5s") == 1.5
+    assert parse_reset_duration("20ms") == pytest.approx(0.02)
+    assert parse_reset_duration("2") == 2
+    assert parse_reset_duration(None) == 0
+
+
+def test_buckets_refill_linearly_up_to_the_limit(clock):
+    limiter = RateLimiter(requests_per_minute=60, tokens_per_minute=6000)
+    limiter.acquire(6000)
+    assert limiter.headroom()["tokens_available"] == 0
+    clock.now += 30
+    h = limiter.headroom()
+    assert (h["requests_available"], h["tokens_available"], h["tokens_pct"]) == (60, 3000, 50.0)
+    clock.now += 600
+    assert limiter.headroom()["tokens_available"] == 6000
+
+
+def test_acquire_waits_for_refill_and_records_throttling(clock):
+    limiter = RateLimiter(requests_per_minute=60, tokens_per_minute=600)
+    limiter.acquire(600)
+    limiter.acquire(300)  # 300 tokens a 10/s: 30s de espera (em passos de até 5s)
+    assert sum(clock.slept) == pytest.approx(30)
+    h = limiter.headroom()
+    assert (h["throttled_calls"], h["throttled_seconds"]) == (1, 30.0)
+    assert "esperas: 1 (30.0s)" in limiter.format_headroom()
+
+
+def test_headers_set_limits_and_never_raise_the_balance(clock):
+    limiter = RateLimiter(requests_per_minute=100, tokens_per_minute=10000)
+    limiter.update_from_headers({
+        "x-ratelimit-limit-requests": "500", "x-ratelimit-remaining-requests": "499",
+        "x-ratelimit-limit-tokens": "30000", "x-ratelimit-remaining-tokens": "2500",
+    })
+    h = limiter.headroom()
+    assert (h["requests_limit"], h["requests_available"]) == (500, 100)
+    assert (h["tokens_limit"], h["tokens_available"]) == (30000, 2500)
+    # Header inválido é ignorado
+    limiter.update_from_headers({"x-ratelimit-limit-tokens": "abc"})
+    assert limiter.headroom()["tokens_limit"] == 30000
+
+
+def test_rate_limited_follows_reset_headers(clock):
+    limiter = RateLimiter(requests_per_minute=600, tokens_per_minute=60000)
+    pause = limiter.on_rate_limited({"x-ratelimit-remaining-tokens": "0", "x-ratelimit-reset-tokens": "12s"})
+    assert pause == 12
+    assert not limiter.headroom()["blocked"]
+    # Balde de tokens volta a encher em 12s; o de requisições não foi afetado
+    limiter.acquire(60000)
+    assert sum(clock.slept) == pytest.approx(12)
+    assert limiter.headroom()["requests_available"] == 599
+
+
+def test_retry_after_blocks_and_missing_headers_pause_briefly(clock):
+    limiter = RateLimiter(requests_per_minute=600, tokens_per_minute=60000)
+    assert limiter.on_rate_limited({"retry-after": "3"}) == 3
+    assert limiter.headroom()["blocked"]
+    limiter.acquire(1)
+    assert sum(clock.slept) == pytest.approx(3)
+    assert limiter.on_rate_limited({}) == 1.0
+    assert limiter.headroom()["blocked"]
+
+
+def test_refund_returns_the_reservation(clock):
+    limiter = RateLimiter(requests_per_minute=10, tokens_per_minute=1000)
+    limiter.acquire(800)
+    limiter.refund(800)
+    h = limiter.headroom()
+    assert (h["requests_available"], h["tokens_available"]) == (10, 1000)
+
+
+def rate_limit_error(headers):
+    request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+    return openai.RateLimitError("Rate limit", response=httpx.Response(429, headers=headers, request=request), body=None)
+
+
+class FakeCompletions:
+    """chat.completions.with_raw_response: falha com os erros dados, depois responde"""
+
+    def __init__(self, errors):
+        self.errors = list(errors)
+        self.calls = 0
+        self.with_raw_response = self
+
+    def create(self, **body):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        message = SimpleNamespace(content='{"ok": true}')
+        return SimpleNamespace(
+            headers={},
+            parse=lambda: SimpleNamespace(choices=[SimpleNamespace(message=message)]),
+        )
+
+
+def make_client(limiter, errors):
+    client = openai_client.OpenAIClient.__new__(openai_client.OpenAIClient)
+    client.model_name = "gpt-teste"
+    client.rate_limiter = limiter
+    client.client = SimpleNamespace(chat=SimpleNamespace(completions=FakeCompletions(errors)))
+    client._estimate_request_tokens = lambda messages: 1000
+    return client
+
+
+def test_retry_after_429_charges_the_bucket_once(clock):
+    limiter = RateLimiter(requests_per_minute=600, tokens_per_minute=1_000_000)
+    client = make_client(limiter, [rate_limit_error({"x-ratelimit-reset-requests": "100ms"})])
+    assert client._request_completion([]) == '{"ok": true}'
+    assert client.client.chat.completions.calls == 2
+    h = limiter.headroom()
+    # Uma única reserva de 1000 tokens (a da tentativa que falhou foi devolvida)
+    assert h["tokens_available"] == 1_000_000 - 1000
+    # Sem backoff exponencial: só a espera do limitador pelo reset informado
+    assert sum(clock.slept) < 1
+
+
+def test_failed_attempts_refund_and_are_raised(clock, monkeypatch):
+    monkeypatch.setattr(openai_client, "_backoff", lambda retry_state: 0)
+    limiter = RateLimiter(requests_per_minute=600, tokens_per_minute=1_000_000)
+    client = make_client(limiter, [RuntimeError("conexão")] * 3)
+    with pytest.raises(Exception):
+        client._request_completion([])
+    assert client.client.chat.completions.calls == 3
+    assert limiter.headroom()["tokens_available"] == 1_000_000
@@ -0,0 +1,71 @@
+"""
+Testa a seleção por relevância (BM25) do texto enviado à IA: trechos do schema
+dentro do orçamento, âncoras do regex fix sempre incluídas e documento inteiro
+quando a confiança é baixa.
+Execute: python -m pytest tests/test_relevance_pruning.py
+"""
+
+from relevance_pruning import OMITTED_MARKER, bm25_scores, key_terms, normalize_terms, prune_document
+
+SCHEMA_KEYS = ["numero_processo", "valor_indenizacao", "nome_segurado"]
+ANCHORS = (r"SEGURADO:", r"TERCEIROS:")
+FILLER = " ".join(["Lorem ipsum dolor sit amet consectetur adipiscing elit sed eiusmod tempor."] * 30)
+
+
+def build_document() -> str:
+    sections = ["# Capa\n\nPoder Judiciário. Número do processo 0001234-56.2023.8.26.0100."]
+    for page in range(1, 41):
+        sections.append(f"## Folha {page}\n\n{FILLER}")
+    sections[20] = "## Sentença\n\nFixo o valor da indenização em R$ 50.000,00 em favor do segurado."
+    sections[33] = "## Apólice\n\nSEGURADO: SIM TERCEIROS: NÃO"
+    return "\n\n".join(sections)
+
+
+def prune(text, keys=SCHEMA_KEYS, **kwargs):
+    params = dict(anchors=ANCHORS, max_tokens=1500, min_tokens=2000, chunk_tokens=400, min_coverage=0.6)
+    params.update(kwargs)
+    return prune_document(text, keys, **params)
+
+
+def test_normalize_terms_strips_accents_plural_and_stopwords():
+    assert normalize_terms("Valor da Indenização dos Processos") == ["valor", "indenizacao", "processo"]
+    assert key_terms(["numero_processo", "(obs)", "__"]) == [{"numero", "processo"}, {"obs"}]
+
+
+def test_bm25_prefers_rare_matching_terms():
+    scores = bm25_scores([["valor", "processo"], ["processo"], ["outro", "termo"]], {"valor", "processo"})
+    assert scores[0] > scores[1] > scores[2] == 0
+
+
+def test_relevant_sections_fit_the_budget_in_document_order():
+    document = build_document()
+    text, info = prune(document)
+    assert info["pruned"]
+    assert info["tokens"] <= 1500 < info["total_tokens"]
+    assert info["coverage"] == 1
+    # Cabeçalho, sentença e âncoras do regex fix, na ordem original
+    assert text.index("Número do processo") < text.index("valor da indenização") < text.index("SEGURADO: SIM")
+    assert OMITTED_MARKER in text
+    assert text.count(FILLER) < 3
+
+
+def test_small_document_goes_whole():
+    text, info = prune("Número do processo 123", max_tokens=10)
+    assert not info["pruned"] and info["reason"] == "documento pequeno"
+    assert text == "Número do processo 123"
+
+
+def test_low_confidence_sends_full_document():
+    document = build_document()
+    # Vocabulário do schema não aparece no documento
+    text, info = prune(document, keys=["cpf_reclamante", "cnpj_empresa", "numero_processo"])
+    assert not info["pruned"] and "chaves aparecem" in info["reason"]
+    assert text == document
+    # Nenhuma chave presente, mesmo sem cobertura mínima exigida
+    text, info = prune(document, keys=["cpf_reclamante", "cnpj_empresa"], min_coverage=0)
+    assert not info["pruned"] and info["reason"] == "só 0/2 chaves aparecem no documento"
+    assert text == document
+    # Orçamento não comporta os trechos das chaves presentes
+    text, info = prune(document, max_tokens=1, anchors=())
+    assert not info["pruned"] and info["reason"].startswith("cobertura baixa")
+    assert text == document
@@ -0,0 +1,106 @@
+"""
+Testa a exportação incremental de resultados em CSV (result_exporter).
+Execute: python -m pytest tests/test_result_exporter.py
+"""
+
+import csv
+import threading
+import time
+
+from result_exporter import ResultExporter, flatten_dict
+
+
+def read_csv(path):
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        reader = csv.DictReader(f)
+        return reader.fieldnames, list(reader)
+
+
+def test_flatten_dict():
+    assert flatten_dict({"partes": {"autor": "João"}, "valores": [1, 2]}) == {"partes_autor": "João", "valores": "1, 2"}
+
+
+def test_rows_are_batched_and_header_rewritten_only_when_schema_grows(tmp_path):
+    path = str(tmp_path / "resultados.csv")
+    exporter = ResultExporter(path, "csv", batch_size=2, flush_seconds=0)
+
+    exporter.add({"arquivo_original": "a.pdf", "valor": 10})
+    assert not (tmp_path / "resultados.csv").exists()  # ainda no buffer
+    exporter.add({"arquivo_original": "b.pdf", "valor": 20})
+    exporter.add({"arquivo_original": "c.pdf", "valor": 30})
+    exporter.add({"arquivo_original": "d.pdf", "valor": 40})
+    assert exporter.rewrites == 0
+
+    # Chave nova: cabeçalho reescrito uma vez, linhas antigas com a coluna vazia
+    exporter.add({"arquivo_original": "e.pdf", "partes": {"autor": "Maria"}})
+    exporter.close()
+    assert exporter.rewrites == 1
+
+    header, rows = read_csv(path)
+    assert header == ["arquivo_original", "valor", "partes_autor"]
+    assert [r["arquivo_original"] for r in rows] == ["a.pdf", "b.pdf", "c.pdf", "d.pdf", "e.pdf"]
+    assert rows[0]["partes_autor"] == "" and rows[4]["partes_autor"] == "Maria"
+
+
+def test_existing_file_header_is_reused(tmp_path):
+    path = str(tmp_path / "resultados.csv")
+    first = ResultExporter(path, "csv", batch_size=1, flush_seconds=0)
+    first.add({"arquivo_original": "a.pdf", "valor": 1})
+
+    second = ResultExporter(path, "csv", batch_size=1, flush_seconds=0)
+    assert second.columns == ["arquivo_original", "valor"]
+    second.add({"arquivo_original": "b.pdf"})
+    assert second.rewrites == 0
+    assert [r["arquivo_original"] for r in read_csv(path)[1]] == ["a.pdf", "b.pdf"]
+
+
+def test_append_keeps_unsorted_existing_header(tmp_path):
+    # Arquivo gravado pelo antigo save_to_csv: cabeçalho fora de ordem alfabética
+    path = tmp_path / "resultados.csv"
+    path.write_text("zeta,arquivo_original\n1,a.pdf\n", encoding="utf-8-sig")
+
+    exporter = ResultExporter(str(path), "csv", batch_size=1, flush_seconds=0)
+    exporter.add({"arquivo_original": "b.pdf", "zeta": 2})
+    assert exporter.rewrites == 0
+    header, rows = read_csv(str(path))
+    assert header == ["zeta", "arquivo_original"]
+    assert rows[1] == {"zeta": "2", "arquivo_original": "b.pdf"}
+
+    # Coluna nova: reescrita com as colunas antigas na mesma ordem e a nova no fim
+    exporter.add({"arquivo_original": "c.pdf", "alfa": "x"})
+    header, rows = read_csv(str(path))
+    assert header == ["zeta", "arquivo_original", "alfa"]
+    assert rows[0] == {"zeta": "1", "arquivo_original": "a.pdf", "alfa": ""}
+    assert rows[2] == {"zeta": "", "arquivo_original": "c.pdf", "alfa": "x"}
+
+
+def test_many_writer_threads(tmp_path):
+    path = str(tmp_path / "resultados.csv")
+    exporter = ResultExporter(path, "csv", batch_size=7, flush_seconds=0)
+
+    def write(thread_id):
+        for i in range(50):
+            exporter.add({"arquivo_original": f"{thread_id}-{i}.pdf", f"campo_{i % 5}": i})
+
+    threads = [threading.Thread(target=write, args=(t,)) for t in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    exporter.close()
+
+    header, rows = read_csv(path)
+    assert header == ["arquivo_original"] + [f"campo_{i}" for i in range(5)]
+    assert len(rows) == 400 == exporter.rows_written
+    assert len({r["arquivo_original"] for r in rows}) == 400
+
+
+def test_sparse_rows_flushed_by_timer(tmp_path):
+    path = tmp_path / "resultados.csv"
+    exporter = ResultExporter(str(path), "csv", batch_size=100, flush_seconds=0.1)
+    exporter.add({"arquivo_original": "a.pdf"})
+    deadline = time.monotonic() + 3
+    while not path.exists() and time.monotonic() < deadline:
+        time.sleep(0.05)
+    exporter.close()
+    assert read_csv(str(path))[1] == [{"arquivo_original": "a.pdf"}]
@@ -0,0 +1,158 @@
+"""
+Testa a gravação em lote dos resultados (result_sink) com um cliente Supabase falso
+que registra as chamadas (insert, remove no Storage, delete id IN (...)).
+Execute: python -m pytest tests/test_result_sink.py
+"""
+
+import threading
+import time
+
+from result_sink import ResultSink
+
+
+class FakeQuery:
+    def __init__(self, client, table):
+        self.client, self.table, self.op = client, table, None
+
+    def insert(self, payload):
+        self.op = ("insert", self.table, payload)
+        return self
+
+    def delete(self):
+        self.op = ("delete", self.table)
+        return self
+
+    def update(self, values):
+        self.op = ("update", self.table, values)
+        return self
+
+    def in_(self, column, values):
+        self.op = self.op + (list(values),)
+        return self
+
+    def execute(self):
+        with self.client.lock:
+            self.client.calls.append(self.op)
+        if self.op[0] in self.client.fail:
+            raise RuntimeError(f"{self.op[0]} falhou")
+        return self
+
+
+class FakeBucket:
+    def __init__(self, client):
+        self.client = client
+
+    def remove(self, paths):
+        with self.client.lock:
+            self.client.calls.append(("remove", list(paths)))
+
+
+class FakeStorage:
+    def __init__(self, client):
+        self.client = client
+
+    def from_(self, bucket):
+        return FakeBucket(self.client)
+
+
+class FakeSupabase:
+    def __init__(self, fail=()):
+        self.calls, self.fail, self.lock = [], set(fail), threading.Lock()
+        self.storage = FakeStorage(self)
+
+    def table(self, name):
+        return FakeQuery(self, name)
+
+
+def record(i):
+    return {"id": i, "filename": f"doc{i}.pdf", "storage_path": f"p/doc{i}.pdf", "projeto_id": None}
+
+
+def test_full_batches_use_three_requests_each():
+    client, done = FakeSupabase(), []
+    sink = ResultSink(client, "documento_gerenciamento", batch_size=50, flush_ms=10_000, on_done=done.append)
+    for i in range(100):
+        sink.submit(record(i), {"valor": i})
+    deadline = time.monotonic() + 5
+    while len(done) < 100 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    sink.close()
+
+    assert [c[0] for c in client.calls] == ["insert", "remove", "delete"] * 2
+    assert len(client.calls[0][2]) == 50
+    assert client.calls[2] == ("delete", "documento_gerenciamento", list(range(50)))
+    assert sorted(r["id"] for r in done) == list(range(100))
+    assert sink.requests == 6
+
+
+def test_partial_batch_flushed_after_interval():
+    client, done = FakeSupabase(), []
+    sink = ResultSink(client, "documento_gerenciamento", batch_size=50, flush_ms=100, on_done=done.append)
+    started = time.monotonic()
+    sink.submit(record(1), {"valor": 1})
+    while not done and time.monotonic() - started < 5:
+        time.sleep(0.01)
+    elapsed = time.monotonic() - started
+    sink.close()
+    assert done and 0.09 <= elapsed < 2
+
+
+def test_close_flushes_pending():
+    client = FakeSupabase()
+    sink = ResultSink(client, "documento_gerenciamento", batch_size=50, flush_ms=60_000)
+    for i in range(3):
+        sink.submit(record(i), {})
+    sink.close()
+    assert sink.documents == 3 and sink.flushes == 1
+
+
+def test_failed_batch_insert_falls_back_per_row_and_delete_to_status():
+    client = FakeSupabase(fail={"delete"})
+    sink = ResultSink(client, "documento_gerenciamento", batch_size=2, flush_ms=60_000)
+
+    original_execute = FakeQuery.execute
+
+    def execute(self):
+        # Só o insert multi-linha falha
+        if self.op[0] == "insert" and isinstance(self.op[2], list):
+            with self.client.lock:
+                self.client.calls.append(self.op)
+            raise RuntimeError("lote rejeitado")
+        return original_execute(self)
+
+    FakeQuery.execute = execute
+    try:
+        sink.submit(record(1), {})
+        sink.submit(record(2), {})
+        sink.close()
+    finally:
+        FakeQuery.execute = original_execute
+
+    ops = [c[0] for c in client.calls]
+    assert ops == ["insert", "insert", "insert", "remove", "delete", "update"]
+    assert client.calls[-1] == ("update", "documento_gerenciamento", {"status": "CONCLUIDO", "completed_at": "now()"}, [1, 2])
+    assert sink.requests == len(client.calls) == 6
+
+
+def test_requests_counted_without_storage_paths():
+    client = FakeSupabase()
+    sink = ResultSink(client, "documento_gerenciamento", batch_size=2, flush_ms=60_000)
+    sink.submit(dict(record(1), storage_path=None), {})
+    sink.close()
+    assert [c[0] for c in client.calls] == ["insert", "delete"]
+    assert sink.requests == 2
+
+
+def test_failing_on_done_does_not_skip_other_records():
+    client, done = FakeSupabase(), []
+
+    def on_done(rec):
+        if rec["id"] == 1:
+            raise RuntimeError("falha ao liberar")
+        done.append(rec["id"])
+
+    sink = ResultSink(client, "documento_gerenciamento", batch_size=3, flush_ms=60_000, on_done=on_done)
+    for i in range(3):
+        sink.submit(record(i), {})
+    sink.close()
+    assert done == [0, 2]
@@ -0,0 +1,125 @@
+"""
+Testa o cliente da API Salesforce (salesforce_client) contra um servidor local:
+sessão keep-alive reutilizada, cache com TTL (listas vazias não ficam em cache,
+erros ficam por pouco tempo) e limite de consultas simultâneas no modo em lote.
+Execute: python -m pytest tests/test_salesforce_client.py
+"""
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+import pytest
+
+import salesforce_client
+from salesforce_client import SalesforceClient
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    state = None
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        state = StandInHandler.state
+        case_number = self.path.rsplit("/", 1)[-1]
+        with state.lock:
+            state.connections.add(self.client_address)
+            state.calls.append(case_number)
+            state.in_flight += 1
+            state.max_in_flight = max(state.max_in_flight, state.in_flight)
+        time.sleep(state.delay)
+        status, payload = state.responses.get(case_number, (200, {"arquivos": [
+            {"nomeArquivo": f"{case_number}.zip", "tipoArquivo": "ZIP", "downloadUrl": f"https://files/{case_number}.zip"},
+        ]}))
+        body = json.dumps(payload).encode()
+        with state.lock:
+            state.in_flight -= 1
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def api(monkeypatch):
+    state = SimpleNamespace(lock=threading.Lock(), connections=set(), calls=[], in_flight=0,
+                            max_in_flight=0, delay=0.0, responses={})
+    StandInHandler.state = state
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setattr(salesforce_client.settings, "SALESFORCE_API_KEY", "sf-key")
+    monkeypatch.setattr(salesforce_client.settings, "SALESFORCE_API_URL",
+                        f"http://127.0.0.1:{server.server_address[1]}/caso/{{case_number}}")
+    monkeypatch.setattr(salesforce_client.settings, "SALESFORCE_CACHE_TTL_SECONDS", 300)
+    monkeypatch.setattr(salesforce_client.settings, "SALESFORCE_ERROR_CACHE_SECONDS", 30)
+    yield state
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    state = SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(salesforce_client.time, "monotonic", lambda: state.now)
+    return state
+
+
+def test_sequential_lookups_reuse_one_connection(api):
+    client = SalesforceClient()
+    for case_number in ("C1", "C2", "C3"):
+        assert client.get_case_zip_urls(case_number) == [f"https://files/{case_number}.zip"]
+    assert api.calls == ["C1", "C2", "C3"]
+    assert len(api.connections) == 1
+
+
+def test_listing_is_cached_until_the_ttl_expires(api, clock):
+    client = SalesforceClient()
+    client.get_case_zip_urls("C1")
+    clock.now += 299
+    client.get_case_zip_urls("C1")
+    assert api.calls == ["C1"]
+    clock.now += 2
+    client.get_case_zip_urls("C1")
+    assert api.calls == ["C1", "C1"]
+
+
+def test_empty_listing_is_not_cached(api, clock):
+    api.responses["C1"] = (200, {"arquivos": []})
+    client = SalesforceClient()
+    assert client.get_case_zip_urls("C1") == []
+    del api.responses["C1"]
+    assert client.get_case_zip_urls("C1") == ["https://files/C1.zip"]
+    assert api.calls == ["C1", "C1"]
+
+
+def test_errors_are_cached_briefly(api, clock):
+    api.responses["C1"] = (500, {"erro": "indisponível"})
+    client = SalesforceClient()
+    for _ in range(2):
+        with pytest.raises(ConnectionError, match="500"):
+            client.get_case_zip_urls("C1")
+    assert api.calls == ["C1"]
+    del api.responses["C1"]
+    clock.now += 31
+    assert client.get_case_zip_urls("C1") == ["https://files/C1.zip"]
+    assert api.calls == ["C1", "C1"]
+
+
+def test_bulk_lookup_caps_concurrency_and_keeps_errors_per_case(api, monkeypatch):
+    monkeypatch.setattr(salesforce_client.settings, "SALESFORCE_LOOKUP_CONCURRENCY", 2)
+    api.delay = 0.1
+    api.responses["C3"] = (403, {})
+    client = SalesforceClient()
+    results = client.get_many_case_zip_urls(["C1", "C2", "C3", "C4", "C5", "C6", "C1"])
+    assert list(results) == ["C1", "C2", "C3", "C4", "C5", "C6"]
+    assert isinstance(results["C3"], PermissionError)
+    assert results["C6"] == ["https://files/C6.zip"]
+    assert api.max_in_flight == 2
+    assert sorted(api.calls) == ["C1", "C2", "C3", "C4", "C5", "C6"]
@@ -0,0 +1,106 @@
+"""
+Testa o cliente Supabase compartilhado (supabase_pool) contra um servidor local
+que imita o PostgREST e o Storage: pool único entre chaves e métricas por tabela/operação.
+Execute: python -m pytest tests/test_supabase_pool.py
+"""
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import supabase_pool
+from supabase_pool import LatencyMetrics, classify_request
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    connections = set()
+    keys = []
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status=200, body=b"[]"):
+        StandInHandler.connections.add(self.client_address)
+        StandInHandler.keys.append(self.headers.get("apikey"))
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            self.rfile.read(length)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self._reply()
+
+    def do_POST(self):
+        self._reply(201, b"[]")
+
+    def do_DELETE(self):
+        self._reply(200, json.dumps([{"name": "a.pdf"}]).encode())
+
+    do_PATCH = do_GET
+
+
+@pytest.fixture
+def stand_in(monkeypatch):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    StandInHandler.connections.clear()
+    StandInHandler.keys.clear()
+    monkeypatch.setattr(supabase_pool.settings, "SUPABASE_URL", f"http://127.0.0.1:{server.server_address[1]}")
+    monkeypatch.setattr(supabase_pool.settings, "SUPABASE_SERVICE_ROLE_KEY", "service-key")
+    monkeypatch.setattr(supabase_pool, "_http_client", None)
+    monkeypatch.setattr(supabase_pool, "_clients", {})
+    supabase_pool.supabase_metrics.reset()
+    yield
+    server.shutdown()
+
+
+def test_classify_request():
+    base = "https://x.supabase.co"
+    assert classify_request("GET", f"{base}/rest/v1/documento_gerenciamento?select=*") == ("documento_gerenciamento", "select")
+    assert classify_request("POST", f"{base}/rest/v1/rpc/claim_documents") == ("rpc:claim_documents", "call")
+    assert classify_request("DELETE", f"{base}/storage/v1/object/processos") == ("storage:processos", "remove")
+    assert classify_request("GET", f"{base}/storage/v1/object/processos/a/b.pdf") == ("storage:processos", "download")
+    assert classify_request("POST", f"{base}/storage/v1/object/list/processos") == ("storage:processos", "list")
+
+
+def test_clients_share_one_pool_and_record_latency(stand_in):
+    anon = supabase_pool.get_supabase_client()
+    service = supabase_pool.get_supabase_client(service_role=True)
+    assert anon is supabase_pool.get_supabase_client()
+    assert anon is not service
+
+    for _ in range(5):
+        anon.table("documento_gerenciamento").select("*").eq("status", "PENDENTE").execute()
+    service.table("resultados_analise").insert([{"a": 1}, {"a": 2}]).execute()
+    service.storage.from_("processos").remove(["a.pdf"])
+
+    # Mesmo pool HTTP (keep-alive) para as duas chaves; cada chamada com a sua chave
+    assert len(StandInHandler.connections) == 1
+    assert StandInHandler.keys.count("service-key") == 2
+
+    rows = {(r["target"], r["operation"]): r for r in supabase_pool.supabase_metrics.rows()}
+    assert rows[("documento_gerenciamento", "select")]["count"] == 5
+    assert rows[("resultados_analise", "insert")]["count"] == 1
+    assert rows[("storage:processos", "remove")]["count"] == 1
+    assert "documento_gerenciamento select: n=5" in supabase_pool.supabase_metrics.summary()
+
+
+def test_summary_since_snapshot():
+    metrics = LatencyMetrics()
+    metrics.record("t", "select", 0.02)
+    snapshot = metrics.snapshot()
+    metrics.record("t", "select", 0.3)
+    metrics.record("t", "insert", 0.001, error=True)
+    rows = metrics.rows(since=snapshot)
+    # Maior tempo total primeiro
+    assert [(r["operation"], r["count"]) for r in rows] == [("select", 1), ("insert", 1)]
+    assert rows[0]["p50_ms"] == 500 and rows[0]["total_seconds"] == pytest.approx(0.3)
+    assert rows[1]["errors"] == 1
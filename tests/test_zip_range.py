@@ -0,0 +1,114 @@
+"""
+Testa a leitura parcial de ZIPs via HTTP Range (http_downloader.HttpRangeFile) contra
+um servidor local que aceita Range, como o endpoint final de arquivos da Salesforce.
+Execute: python -m pytest tests/test_zip_range.py
+"""
+
+import io
+import os
+import re
+import threading
+import zipfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from http_downloader import DirectDownloader, HttpRangeFile
+
+
+def make_zip() -> bytes:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as z:
+        # Anexos grandes do caso (fotos, laudos) que não interessam
+        for i in range(4):
+            z.writestr(f"anexos/foto_{i}.jpg", os.urandom(512 * 1024), compress_type=zipfile.ZIP_STORED)
+        z.writestr("Formulário de Análise.pdf", b"%PDF-1.4 formulario " * 100, compress_type=zipfile.ZIP_DEFLATED)
+        z.writestr("anexos/laudo.pdf", os.urandom(256 * 1024), compress_type=zipfile.ZIP_STORED)
+    return buffer.getvalue()
+
+
+ZIP_BYTES = make_zip()
+FORM_NAME = "Formulário de Análise.pdf"
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        accepts_range = self.path == "/files/caso.zip"
+        if self.path not in ("/files/caso.zip", "/files/no-range.zip"):
+            self.send_response(404)
+            self.end_headers()
+            return
+
+        body, status = ZIP_BYTES, 200
+        match = re.match(r"bytes=(\d+)-(\d+)", self.headers.get("Range", ""))
+        if match and accepts_range:
+            start, end = int(match.group(1)), min(int(match.group(2)), len(ZIP_BYTES) - 1)
+            body, status = ZIP_BYTES[start:end + 1], 206
+
+        self.send_response(status)
+        self.send_header("Content-Type", "application/zip")
+        self.send_header("Content-Disposition", 'attachment; filename="caso.zip"')
+        if accepts_range:
+            self.send_header("Accept-Ranges", "bytes")
+        if status == 206:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(ZIP_BYTES)}")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # O cliente fechou a resposta inicial sem ler o corpo (vai usar Range)
+            pass
+
+
+@pytest.fixture(scope="module")
+def base_url():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), RangeHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+
+
+@pytest.fixture(autouse=True)
+def small_range_threshold(monkeypatch):
+    monkeypatch.setattr("http_downloader.settings.ZIP_RANGE_MIN_MB", 1)
+    monkeypatch.setattr("http_downloader.settings.ZIP_RANGE_BLOCK_KB", 64)
+
+
+def test_only_central_directory_and_matching_member_are_fetched(base_url):
+    with DirectDownloader().download_to_file(base_url + "/files/caso.zip") as f:
+        assert isinstance(f, HttpRangeFile)
+        with zipfile.ZipFile(f) as z:
+            names = z.namelist()
+            assert FORM_NAME in names and len(names) == 6
+            assert z.read(FORM_NAME) == b"%PDF-1.4 formulario " * 100
+
+        # Diretório central + membro filtrado: bem menos que os ~2.3 MB do ZIP
+        assert f.bytes_fetched < 200 * 1024
+        assert f.bytes_fetched < len(ZIP_BYTES) / 10
+
+
+def test_large_member_is_read_in_one_request(base_url):
+    with DirectDownloader().download_to_file(base_url + "/files/caso.zip") as f:
+        with zipfile.ZipFile(f) as z:
+            requests_before = f.requests
+            data = z.read("anexos/laudo.pdf")
+        assert len(data) == 256 * 1024
+        assert f.requests - requests_before <= 2
+
+
+def test_server_without_range_gets_full_download(base_url):
+    with DirectDownloader().download_to_file(base_url + "/files/no-range.zip") as f:
+        assert not isinstance(f, HttpRangeFile)
+        assert f.read() == ZIP_BYTES
+
+
+def test_small_zip_is_downloaded_whole(base_url, monkeypatch):
+    monkeypatch.setattr("http_downloader.settings.ZIP_RANGE_MIN_MB", 10)
+    with DirectDownloader().download_to_file(base_url + "/files/caso.zip") as f:
+        assert not isinstance(f, HttpRangeFile)
+        assert f.read() == ZIP_BYTES